@@ -1,8 +1,10 @@
 # === Bot.py: Основной модуль Telegram-бота для RFM-анализа и рекомендаций ===
 # Этот файл реализует функциональность бота: работа с БД, анализом данных, языками и интерфейсом.
 
+import asyncio
 import logging
 import os
+import tempfile
 import psycopg2
 import pandas as pd
 import aiohttp
@@ -18,6 +20,9 @@ from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 import RFM  # Импорт модуля RFM.py для анализа RFM
+import RFMCache  # Кэш результатов RFM-анализа по содержимому файла
+import RFMSnapshot  # Инкрементальный RFM-анализ: дельты вливаются в снимок пользователя
+from Metrics import Metrics, logging_hook  # Замеры стадий RFM-анализа
 from Model import Gemini
 import re
 from VectorSearch import init_recommendations, find_recommendations
@@ -39,6 +44,11 @@ DB_PARAMS = {
 DEVELOPER_EMAIL = "ЗДЕСЬ_ПОЧТА_АДМИНА"  # Email для обратной связи
 SMTP_EMAIL = "ЗДЕСЬ_ПОЧТА_АДМИНА"  # Email для отправки писем
 SMTP_PASSWORD = "ЗДЕСЬ_ПАРОЛЬ_ОТ_ПОЧТЫ"  # Пароль для SMTP (нужен App Password для Gmail)
+UPLOAD_SPOOL_BYTES = 32 * 1024 * 1024  # Загрузки до этого размера держим в памяти, больше — во временном файле
+UPLOAD_BLOCK_SIZE = 64 * 1024  # Какими блоками принимаем файл из Telegram
+# Процессов для очистки больших файлов. В боте — один: анализ идёт в потоке рядом с циклом событий
+# и моделью SentenceTransformer, а параллельные загрузки разных пользователей и так делят ядра
+RFM_WORKERS = 1
 
 
 # === Интерфейс и локализация ===
@@ -678,10 +688,10 @@ async def handle_result_format(update: Update, context: ContextTypes.DEFAULT_TYP
             response = f"{reply['csv_success']}```{result['result_table']}```"
             await query.message.reply_text(response, parse_mode='Markdown', reply_markup=keyboard)
             save_message(user.id, response)
-        elif format_choice == 'diagram' and result.get('plot_path') and os.path.exists(result['plot_path']):
-            with open(result['plot_path'], 'rb') as plot_file:
-                await query.message.reply_photo(photo=plot_file, caption="График сегментов RFM" if lang == 'ru' else "RFM Segments Chart", reply_markup=keyboard)
-                save_message(user.id, "График сегментов RFM" if lang == 'ru' else "RFM Segments Chart")
+        elif format_choice == 'diagram' and result.get('plot_bytes'):
+            # График приходит готовой картинкой в памяти — на диск его не пишем
+            await query.message.reply_photo(photo=result['plot_bytes'], caption="График сегментов RFM" if lang == 'ru' else "RFM Segments Chart", reply_markup=keyboard)
+            save_message(user.id, "График сегментов RFM" if lang == 'ru' else "RFM Segments Chart")
         elif format_choice == 'text' and result.get('result_text'):
             await query.message.reply_text(result['result_text'], parse_mode='HTML', reply_markup=keyboard)
             save_message(user.id, result['result_text'])
@@ -899,50 +909,66 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(reply['mute_message'], reply_markup=keyboard)
             return
         doc = update.message.document
-        if not doc.file_name.lower().endswith('.csv'):
-            await update.message.reply_text(f"{reply['csv_error']} Файл должен быть в формате CSV.",
+        # Кроме CSV принимаем сжатые (.csv.gz, .zip) и колоночные (Parquet, Feather) файлы —
+        # так в лимит Telegram на размер загрузки помещаются выгрузки в разы больше
+        if not (doc.file_name or '').lower().endswith(RFM.SUPPORTED_EXTENSIONS):
+            await update.message.reply_text(f"{reply['csv_error']} Файл должен быть в формате CSV "
+                                            f"(можно сжатый: .csv.gz, .zip), Parquet или Feather.",
                                             reply_markup=keyboard)
             return
         file_name = doc.file_name or 'file.csv'
         save_message(user.id, f"File uploaded: {file_name}")
         update_last_message_time(user.id)
         file = await doc.get_file()
-        file_path = os.path.join(os.getcwd(), file_name)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file.file_path) as response:
-                if response.status == 200:
-                    with open(file_path, 'wb') as f:
-                        f.write(await response.read())
-        if context.user_data.get("awaiting_csv", False):
-            # Показ предпросмотра CSV
-            df = pd.read_csv(file_path)
-            preview = f"\n{df.head().to_string(index=False)}"
-            await update.message.reply_text(f"{reply['csv_loaded']}```\n{preview}\n```", parse_mode='MarkdownV2')
-
-            # Выполнение RFM-анализа через модуль RFM
-            result = RFM.main(file_path)
-            context.user_data["awaiting_csv"] = False
-            context.user_data['rfm_result'] = result  # Сохранение результата для выбора формата
-
-            # Запрос формата вывода результатов
-            await update.message.reply_text(
-                reply['csv_format_choice'],
-                reply_markup=InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton(reply['table_button'], callback_data='table'),
-                        InlineKeyboardButton(reply['diagram_button'], callback_data='diagram'),
-                        InlineKeyboardButton(reply['text_button'], callback_data='text')
-                    ]
-                ])
-            )
-        else:
-            # Простой предпросмотр CSV без анализа
-            df = pd.read_csv(file_path)
-            await update.message.reply_text(f"Первые 5 строк в вашем файле:```\n{f"\n{df.head().to_string(index=False)}"}\n```",
-                                            parse_mode='MarkdownV2', reply_markup=keyboard)
-        # Очистка временного файла
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Загрузка остаётся в памяти и уходит на диск, только если больше UPLOAD_SPOOL_BYTES;
+        # общего файла в рабочем каталоге нет — одноимённые загрузки разных пользователей не мешают друг другу
+        with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES) as upload:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(file.file_path) as response:
+                    if response.status == 200:
+                        async for block in response.content.iter_chunked(UPLOAD_BLOCK_SIZE):
+                            upload.write(block)
+            upload.seek(0)
+
+            if context.user_data.get("awaiting_csv", False):
+                # Предпросмотр показываем сразу — на больших файлах анализ идёт заметное время.
+                # Читается только начало файла, потом загрузка перематывается для анализа
+                preview = RFM.preview(upload)
+                upload.seek(0)
+                if preview is not None:
+                    preview = f"\n{preview.to_string(index=False)}"
+                    await update.message.reply_text(f"{reply['csv_loaded']}```\n{preview}\n```", parse_mode='MarkdownV2')
+
+                # Выполнение RFM-анализа через модуль RFM; с подписью «дельта» файл вливается в снимок прошлых загрузок
+                caption = (update.message.caption or "").lower()
+                # Анализ синхронный и долгий — выполняем его в потоке, чтобы бот отвечал другим пользователям
+                if 'дельта' in caption or 'delta' in caption:
+                    result = await asyncio.to_thread(RFMSnapshot.main, upload, RFMSnapshot.snapshot_path(user.id))
+                else:
+                    # Повторная загрузка того же файла берётся из кэша; время стадий анализа пишется в лог
+                    result = await asyncio.to_thread(RFMCache.main, upload, metrics=Metrics(hook=logging_hook(logger)),
+                                                     workers=RFM_WORKERS)
+                context.user_data["awaiting_csv"] = False
+                context.user_data['rfm_result'] = result  # Сохранение результата для выбора формата
+
+                # Запрос формата вывода результатов
+                await update.message.reply_text(
+                    reply['csv_format_choice'],
+                    reply_markup=InlineKeyboardMarkup([
+                        [
+                            InlineKeyboardButton(reply['table_button'], callback_data='table'),
+                            InlineKeyboardButton(reply['diagram_button'], callback_data='diagram'),
+                            InlineKeyboardButton(reply['text_button'], callback_data='text')
+                        ]
+                    ])
+                )
+            else:
+                # Простой предпросмотр CSV без анализа: читается только начало файла
+                df = RFM.preview(upload)
+                if df is None:
+                    raise ValueError("Файл пуст или не читается как CSV")
+                await update.message.reply_text(f"Первые 5 строк в вашем файле:```\n{f"\n{df.to_string(index=False)}"}\n```",
+                                                parse_mode='MarkdownV2', reply_markup=keyboard)
     except psycopg2.Error:
         await update.message.reply_text(reply['db_error'], reply_markup=keyboard)
     except Exception as e:
@@ -0,0 +1,117 @@
+# === Diagnostics.py: сбор сообщений о ходе анализа ===
+# Заметки (кодировка, найденные столбцы) и проблемы в данных (плохие даты, пропущенные строки)
+# копятся в одном объекте, общем для FileProcessor, RFMAnalyzer и RFM.main. Проблемы считаются
+# по категориям, а примеров хранится не больше max_examples — память не растёт с размером файла.
+
+# Сколько примеров храним для каждой категории проблем
+DEFAULT_MAX_EXAMPLES = 3
+# Источники сообщений: чтение и очистка файла / RFM-анализ
+FILE_SOURCE = 'file'
+ANALYSIS_SOURCE = 'analysis'
+
+
+# === Класс Diagnostics ===
+# Счётчики проблем с примерами и заметки в порядке появления
+class Diagnostics:
+    """Журнал диагностики. note() добавляет готовую строку, issue() — ещё одну проблему в категорию
+       (O(1): счётчик плюс пример, пока их меньше max_examples). render() собирает компактный текст:
+       каждая категория — одна строка с числом случаев и первыми примерами с номерами строк файла."""
+
+    def __init__(self, max_examples=DEFAULT_MAX_EXAMPLES):
+        self.max_examples = max_examples
+        self.entries = []  # (источник, текст заметки или None, ключ категории или None) — в порядке появления
+        self.counts = {}  # (источник, категория) -> число случаев
+        self.examples = {}  # (источник, категория) -> [(номер строки или None, значение)]
+
+    def note(self, text, source=FILE_SOURCE):
+        """Добавляет готовый текст (с переводами строк) как есть."""
+        if text:
+            self.entries.append((source, text, None))
+
+    def issue(self, category, example=None, row=None, source=FILE_SOURCE, count=1):
+        """Учитывает count случаев проблемы; пример (и номер строки) сохраняется, если место ещё есть."""
+        key = self._category(source, category)
+        self.counts[key] += count
+        if example is not None and len(self.examples[key]) < self.max_examples:
+            self.examples[key].append((row, example))
+
+    def issue_rows(self, category, values, source=FILE_SOURCE):
+        """Учитывает проблему сразу для всех строк values (Series: индекс — номера строк, значения — примеры)."""
+        if len(values):
+            examples = values.iloc[:self.max_examples]
+            for row, example in examples.items():
+                self.issue(category, example, row, source)
+            if len(values) > len(examples):
+                self.issue(category, source=source, count=len(values) - len(examples))
+
+    def merge(self, other):
+        """Вливает журнал other (например, из рабочего процесса) так, будто его сообщения записаны здесь:
+           заметки дописываются, счётчики складываются, примеры добираются до max_examples."""
+        for source, text, key in other.entries:
+            if key is None:
+                self.note(text, source)
+                continue
+            self._category(*key)
+            self.counts[key] += other.counts[key]
+            room = self.max_examples - len(self.examples[key])
+            self.examples[key].extend(other.examples[key][:max(room, 0)])
+
+    def count(self, category, source=FILE_SOURCE):
+        """Сколько раз встретилась проблема."""
+        return self.counts.get((source, category), 0)
+
+    def clear(self, source=None):
+        """Забывает все сообщения источника (или вообще все)."""
+        self.entries = [entry for entry in self.entries if source is not None and entry[0] != source]
+        for key in [key for key in self.counts if source is None or key[0] == source]:
+            del self.counts[key], self.examples[key]
+
+    def render(self, *sources):
+        """Текст диагностики выбранных источников (по умолчанию всех) в порядке появления сообщений."""
+        parts = []
+        for source, text, key in self.entries:
+            if sources and source not in sources:
+                continue
+            parts.append(text if key is None else self._render_issue(key))
+        return "".join(parts)
+
+    def summary(self):
+        """Структурированная сводка проблем: категория, источник, число случаев и примеры."""
+        return [{'source': source, 'category': category, 'count': self.counts[(source, category)],
+                 'examples': [{'row': row, 'value': value} for row, value in self.examples[(source, category)]]}
+                for source, category in self.counts]
+
+    def _category(self, source, category):
+        """Ключ категории; новая категория занимает место в порядке сообщений."""
+        key = (source, category)
+        if key not in self.counts:
+            self.counts[key] = 0
+            self.examples[key] = []
+            self.entries.append((source, None, key))
+        return key
+
+    def _render_issue(self, key):
+        """Одна строка на категорию: «• Категория: N (например: строка 12 — значение; ...)»."""
+        line = f"• {key[1]}: {self.counts[key]}"
+        examples = [f"строка {row} — {value}" if row is not None else f"{value}" for row, value in self.examples[key]]
+        if examples:
+            line += f" (например: {'; '.join(examples)})"
+        return line + "\n"
+
+
+def message_property(source):
+    """Свойство error_message для классов с self.diagnostics: чтение — текст своего источника,
+       а старый приём error_message += "..." дописывает заметку (присваивание другого текста начинает заново)."""
+
+    def getter(self):
+        return self.diagnostics.render(source)
+
+    def setter(self, value):
+        current = self.diagnostics.render(source)
+        if value.startswith(current):
+            self.diagnostics.note(value[len(current):], source)
+        else:
+            self.diagnostics.clear(source)
+            self.diagnostics.note(value, source)
+
+    return property(getter, setter, doc="Текст диагностики (совместимость со строковым error_message).")
@@ -0,0 +1,154 @@
+# === Metrics.py: замеры стадий RFM-анализа ===
+# Для каждой стадии (кодировка, чтение, очистка, оценки, график) записывает время, процессорное время,
+# число строк на входе и выходе и расход памяти. Записи возвращаются в результате RFM.main
+# под ключом 'metrics' и по желанию отдаются в хук — логгер или свою функцию сбора метрик.
+
+import logging
+import time
+import tracemalloc
+
+try:
+    import psutil
+except ImportError:  # Без psutil текущий RSS не узнать, останется только пиковый из resource
+    psutil = None
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Режимы замера памяти: 'rss' — память процесса (дёшево), 'tracemalloc' — точные пики Python-аллокаций
+# (заметно замедляет код), None — без памяти
+MEMORY_MODES = ('rss', 'tracemalloc', None)
+
+
+def current_rss_mb():
+    """Текущий RSS процесса в МБ (None, если узнать нельзя)."""
+    return psutil.Process().memory_info().rss / 2 ** 20 if psutil else None
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса за всё время работы в МБ (None, если узнать нельзя)."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # В Linux — килобайты
+
+
+def logging_hook(logger=None, level=logging.INFO):
+    """Хук, который пишет каждую стадию одной строкой в лог."""
+    logger = logger or logging.getLogger('RFM.metrics')
+
+    def hook(record):
+        memory = ""
+        if record.get('rss_delta_mb') is not None:
+            memory = f", RSS {record['rss_delta_mb']:+.1f} МБ"
+        elif record.get('peak_mb') is not None:
+            memory = f", пик {record['peak_mb']:.1f} МБ"
+        logger.log(level, f"RFM {record['stage']}: {record['seconds']:.3f} с (CPU {record['cpu_seconds']:.3f} с), "
+                          f"строк {record['rows_in']} → {record['rows_out']}{memory}")
+
+    return hook
+
+
+# === Класс Metrics ===
+# Сборщик замеров по стадиям
+class Metrics:
+    """Замеры стадий: metrics.run('clean_data', processor.clean_data, df, rows_in=len(df)) вызывает функцию
+       и записывает время, CPU, строки (rows_out — по shape результата) и память. После каждой стадии
+       запись отдаётся в hook(record). report() — список записей и итог."""
+
+    enabled = True
+
+    def __init__(self, hook=None, memory='rss'):
+        if memory not in MEMORY_MODES:
+            raise ValueError(f"memory должен быть одним из {MEMORY_MODES}")
+        self.hook = hook
+        self.memory = memory
+        self.records = []
+        self._started_tracing = False
+
+    def run(self, stage, function, *args, rows_in=None, **kwargs):
+        """Выполняет стадию и записывает её замеры. Исключение стадии тоже попадает в запись и пробрасывается."""
+        memory_before = self._memory_before()
+        started, cpu_started = time.perf_counter(), time.process_time()
+        error = None
+        value = None
+        try:
+            value = function(*args, **kwargs)
+            return value
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            shape = getattr(value, 'shape', None)
+            record = {'stage': stage, 'seconds': time.perf_counter() - started,
+                      'cpu_seconds': time.process_time() - cpu_started,
+                      'rows_in': rows_in, 'rows_out': shape[0] if shape else None}
+            record.update(self._memory_after(memory_before))
+            if error:
+                record['error'] = error
+            self.records.append(record)
+            if self.hook:
+                self.hook(record)
+
+    def report(self):
+        """Записи стадий и итог по всему прогону."""
+        self._stop_tracing()
+        total = {'seconds': sum(record['seconds'] for record in self.records),
+                 'cpu_seconds': sum(record['cpu_seconds'] for record in self.records)}
+        peaks = [record[key] for record in self.records for key in ('traced_peak_mb', 'peak_rss_mb') if record.get(key)]
+        total['peak_mb'] = max(peaks) if peaks else None
+        return {'stages': list(self.records), 'total': total}
+
+    def _memory_before(self):
+        if self.memory == 'tracemalloc':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+        if self.memory == 'rss':
+            return current_rss_mb()
+        return None
+
+    def _memory_after(self, before):
+        if self.memory == 'tracemalloc':
+            current, peak = tracemalloc.get_traced_memory()
+            # peak_mb — прирост над памятью на старте стадии, traced_peak_mb — абсолютный пик
+            return {'peak_mb': (peak - before) / 2 ** 20, 'traced_mb': current / 2 ** 20,
+                    'traced_peak_mb': peak / 2 ** 20}
+        if self.memory == 'rss':
+            rss = current_rss_mb()
+            return {'rss_mb': rss, 'rss_delta_mb': rss - before if rss is not None else None,
+                    'peak_rss_mb': peak_rss_mb()}
+        return {}
+
+    def _stop_tracing(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+# === Класс NullMetrics ===
+# Замеры выключены: стадия — это просто вызов функции
+class NullMetrics:
+    """Заглушка с тем же интерфейсом, что у Metrics: ничего не меряет и не выделяет."""
+
+    enabled = False
+
+    def run(self, stage, function, *args, rows_in=None, **kwargs):
+        return function(*args, **kwargs)
+
+    def report(self):
+        return None
+
+
+NULL_METRICS = NullMetrics()
+
+
+def resolve(metrics):
+    """Приводит аргумент metrics функции RFM.main к объекту: None/False — выключено, True — Metrics()."""
+    if metrics is None or metrics is False:
+        return NULL_METRICS
+    if metrics is True:
+        return Metrics()
+    return metrics
@@ -1,23 +1,230 @@
+import numpy as np
 import pandas as pd
-import chardet
+import codecs
+import json
 import re
 import csv
 import io
-import matplotlib.pyplot as plt
-import seaborn as sns
+import gzip
+import zipfile
+import threading
+import matplotlib
+matplotlib.use('Agg')  # Графики рисуем только в память — интерактивный бэкенд не нужен
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from datetime import datetime
 from dateutil.parser import parse as parse_date
+import chardet
+from chardet.universaldetector import UniversalDetector
 from word2number import w2n
 import os
+import sys
+import warnings
+from collections import Counter
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pandas.tseries.api import guess_datetime_format
+import pyarrow as pa
+import pyarrow.parquet as pq
+from Diagnostics import Diagnostics, message_property, FILE_SOURCE, ANALYSIS_SOURCE
+import Metrics
+
+# Сегменты клиентов в порядке вывода: от лучших к «спящим»
+SEGMENTS = ['VIP-клиенты', 'Лояльные клиенты', 'Новые покупатели', 'Рискующие клиенты', 'Спящие клиенты']
+# Меры для RFM-оценок: (столбец меры, столбец оценки, обратный порядок — для Recency меньше значит лучше)
+SCORE_COLUMNS = [('Recency', 'R_Score', True), ('Frequency', 'F_Score', False), ('Monetary', 'M_Score', False)]
+# Сводка по сегментам: столбец отчёта -> (столбец rfm, агрегат groupby). Новые показатели — например,
+# ('Recency', 'mean') или ('Monetary', lambda x: x.quantile(0.9)) — просто добавляются сюда
+SEGMENT_SUMMARY = {'Количество клиентов': ('Monetary', 'size'), 'Средний чек': ('Monetary', 'mean'),
+                   'Общий чек': ('Monetary', 'sum')}
+# Пресеты графиков: размер в дюймах и DPI. Telegram ужимает фото до 1280 px по длинной стороне,
+# так что больше рисовать незачем
+CHART_PRESETS = {'telegram': {'figsize': (12.8, 4.8), 'dpi': 100},
+                 'telegram_hd': {'figsize': (12.8, 4.8), 'dpi': 150}}
+# Параметры кодировщиков: PNG — без потерь с быстрым сжатием, WebP — заметно меньше по размеру
+CHART_ENCODERS = {'png': {'pil_kwargs': {'compress_level': 3}},
+                  'webp': {'pil_kwargs': {'quality': 90, 'method': 3}}}
+# Тема графиков: ставится один раз при создании ChartRenderer
+CHART_THEME = {'font.family': 'sans-serif', 'font.size': 10, 'axes.titlesize': 12, 'axes.grid': True,
+               'axes.grid.axis': 'x', 'axes.axisbelow': True, 'grid.color': '#e6e6e6',
+               'axes.edgecolor': '#cccccc', 'axes.spines.top': False, 'axes.spines.right': False}
+# Панели графика: (столбец сводки, подпись оси X, палитра, формат подписи столбика)
+CHART_PANELS = [('Количество клиентов', 'Клиентов', 'viridis', '{:.0f}'),
+                ('Средний чек', 'Руб.', 'magma', '{:.2f}'),
+                ('Общий чек', 'Руб.', 'GnBu_r', '{:.2f}')]
+# Сколько уникальных дат смотрим, чтобы угадать общий формат столбца
+DATE_FORMAT_SAMPLE_SIZE = 200
+# Сколько строк CSV держим в памяти за раз при потоковом чтении
+CSV_CHUNK_SIZE = 100_000
+# Параллельная очистка: меньше строк на процесс не делим. Запуск spawn-процесса заново импортирует pandas
+# и matplotlib, а чанк пересылается через pickle — на 150 тыс. строк пул был втрое медленнее одного процесса
+PARALLEL_MIN_CHUNK_ROWS = 500_000
+# Рабочие процессы запускаются заново, а не fork: вызывающий процесс (бот) может держать потоки torch
+# и блокировки, а fork после запуска потоков небезопасен
+PARALLEL_START_METHOD = 'spawn'
+# Сколько первых строк файла показываем в предпросмотре
+PREVIEW_ROWS = 5
+# Сигнатуры форматов: сжатые контейнеры распаковываются потоком, колоночные читаются через pyarrow
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK\x03\x04'
+COLUMNAR_MAGIC = {b'PAR1': 'parquet', b'ARROW1': 'feather'}
+# Расширения, которые принимает бот (формат всё равно определяется по содержимому)
+SUPPORTED_EXTENSIONS = ('.csv', '.csv.gz', '.gz', '.zip', '.parquet', '.feather', '.arrow')
+# Сколько байт файла смотрим при определении кодировки и какими блоками читаем
+ENCODING_SAMPLE_SIZE = 256 * 1024
+ENCODING_BLOCK_SIZE = 64 * 1024
+# Кодировка, если байты не UTF-8, а chardet не уверен: выгрузки из 1С и Excel чаще всего в cp1251
+ENCODING_FALLBACK = 'cp1251'
+ENCODING_MIN_CONFIDENCE = 0.5
+# Метки порядка байтов (BOM): UTF-32 проверяем раньше UTF-16, у них общий префикс
+ENCODING_BOMS = [(codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+                 (codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+# Значения, которые pd.read_csv по умолчанию считает пропусками
+CSV_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                 '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+# Компактные типы RFM-таблицы: оценки 1–5 — int8, суммы — float32, если копейки из него восстанавливаются
+SCORE_DTYPE = np.int8
+MONEY_DECIMALS = 2
+MONEY_TOLERANCE = 1e-6  # Насколько восстановленная из float32 сумма может отличаться от исходной
+
+def to_naive_datetime(dates):
+    """Приводит столбец дат к datetime64 без часовых поясов, сохраняя «настенное» время — как date() в clean_data."""
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        return dates.dt.tz_localize(None)
+    if not pd.api.types.is_datetime64_dtype(dates):
+        return pd.to_datetime(dates.map(lambda d: d.replace(tzinfo=None)))
+    return dates
+
+@contextmanager
+def open_source(source, decompress=True):
+    """Бинарный поток источника данных: путь к файлу, bytes или файловый объект с seek().
+       bytes оборачиваются в BytesIO без копирования; файловый объект после чтения возвращается
+       на исходную позицию, чтобы тот же источник можно было прочитать ещё раз.
+       gzip и zip (первый файл архива) распаковываются на лету, если decompress не выключен."""
+    with _open_raw(source) as raw:
+        if not decompress:
+            yield raw
+            return
+        start = raw.tell()
+        head = raw.read(len(ZIP_MAGIC))
+        raw.seek(start)
+        if head.startswith(GZIP_MAGIC):
+            with gzip.GzipFile(fileobj=raw, mode='rb') as stream:
+                yield stream
+        elif head.startswith(ZIP_MAGIC):
+            with zipfile.ZipFile(raw) as archive, archive.open(_archive_member(archive)) as stream:
+                yield stream
+        else:
+            yield raw
+
+@contextmanager
+def _open_raw(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(source)
+    elif hasattr(source, 'read'):
+        start = source.tell()
+        try:
+            yield source
+        finally:
+            source.seek(start)
+    else:
+        with open(source, 'rb') as file:
+            yield file
+
+def _archive_member(archive):
+    """Файл для анализа внутри zip: первый CSV, а если его нет — первый файл архива."""
+    members = [info for info in archive.infolist() if not info.is_dir() and not info.filename.startswith('__MACOSX/')]
+    if not members:
+        raise ValueError("архив пуст")
+    csv_members = [info for info in members if info.filename.lower().endswith('.csv')]
+    return (csv_members or members)[0]
+
+def detect_format(source):
+    """'parquet', 'feather' или 'csv' — по первым байтам (после распаковки gzip/zip).
+       Если файл не открывается, считаем его CSV: причину сообщит чтение."""
+    try:
+        with open_source(source) as file:
+            head = file.read(max(map(len, COLUMNAR_MAGIC)))
+    except Exception:
+        return 'csv'
+    for magic, file_format in COLUMNAR_MAGIC.items():
+        if head.startswith(magic):
+            return file_format
+    return 'csv'
+
+@contextmanager
+def text_stream(binary, encoding):
+    """Текстовое чтение бинарного потока; на выходе обёртка отсоединяется и сам поток не закрывает."""
+    text = io.TextIOWrapper(binary, encoding=encoding, errors='replace', newline='')
+    try:
+        yield text
+    finally:
+        text.detach()
+
+def preview(source, rows=PREVIEW_ROWS):
+    """Первые rows строк файла для показа пользователю (None, если показать нечего). Читается только начало файла."""
+    processor = FileProcessor()
+    chunks = processor.iter_table_chunks(source, chunksize=rows)
+    try:
+        return next(chunks, None)
+    finally:
+        chunks.close()
+
+def _convert_chunk(chunk, parse_dates, current_date):
+    """Рабочая часть параллельной очистки: convert_columns чанка в отдельном процессе со своим журналом."""
+    processor = FileProcessor()
+    processor.current_date = current_date
+    return processor.convert_columns(chunk, parse_dates), processor.diagnostics
+
+def compact_money(values):
+    """Суммы во float32, если после округления до копеек они восстанавливаются без потерь, иначе как есть."""
+    values = values.astype('float64')
+    compact = values.astype('float32')
+    restored = np.round(compact.to_numpy(dtype='float64'), MONEY_DECIMALS)
+    if np.all(np.abs(restored - values.to_numpy()) <= MONEY_TOLERANCE):
+        return compact
+    return values
+
+def measure_values(values):
+    """Значения меры как float64; суммы, сжатые compact_money до float32, возвращаются к точным копейкам."""
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        return np.round(values.astype('float64'), MONEY_DECIMALS)
+    return values.astype('float64', copy=False)
+
+def memory_report(frame):
+    """Память таблицы по столбцам: фактическая и в «широкой» раскладке (строки — object, числа — 64 бита)."""
+    columns = {}
+    for name, series in frame.items():
+        actual = int(series.memory_usage(index=False, deep=True))
+        if isinstance(series.dtype, pd.CategoricalDtype) and series.cat.categories.dtype == object:
+            # Как object: указатель на строку плюс сама строка для каждой ячейки
+            sizes = np.fromiter(map(sys.getsizeof, series.cat.categories), dtype=np.int64, count=len(series.cat.categories))
+            codes = series.cat.codes.to_numpy()
+            wide = 8 * len(series) + int(sizes[codes[codes >= 0]].sum())
+        elif series.dtype == object:
+            wide = actual
+        else:
+            wide = 8 * len(series)
+        columns[name] = {'dtype': str(series.dtype), 'bytes': actual, 'wide_bytes': wide}
+    total = sum(column['bytes'] for column in columns.values())
+    wide_total = sum(column['wide_bytes'] for column in columns.values())
+    return {'columns': columns, 'bytes': total, 'wide_bytes': wide_total,
+            'saved': 1 - total / wide_total if wide_total else 0.0}
 
 # === Класс для обработки файлов: от чтения до очистки данных ===
 class FileProcessor:
     """Класс для обработки файлов: чтение, определение кодировки и очистка данных для RFM-анализа.
        Превратит ваш CSV в чистый и готовый к анализу набор данных!"""
 
-    def __init__(self):
-        # Храним сообщения об ошибках, чтобы потом рассказать, где что пошло не так
-        self.error_message = ""
+    # Текст диагностики чтения и очистки — для кода, который ждёт строку
+    error_message = message_property(FILE_SOURCE)
+
+    def __init__(self, diagnostics=None):
+        # Храним сообщения об ошибках, чтобы потом рассказать, где что пошло не так (общий журнал с анализатором)
+        self.diagnostics = diagnostics or Diagnostics()
         # Словарь для распознавания столбцов — поддерживаем разные названия (рус/англ, синонимы)
         self.column_mappings = {
             'client_id': ['id', 'number', 'номер', 'client', 'клиент', 'buyer', 'покупатель', 'customerid', 'customer',
@@ -30,66 +237,273 @@ class FileProcessor:
         }
         # Сегодняшняя дата — нужна для расчёта Recency (как давно была покупка)
         self.current_date = datetime.now().date()
+        self.preview = None  # Первые строки файла из первого прочитанного чанка
 
-    def detect_encoding(self, file_path):
-        """Определяет кодировку файла, чтобы читать его без сюрпризов."""
+    def detect_encoding(self, source, sample_size=ENCODING_SAMPLE_SIZE):
+        """Определяет кодировку файла, чтобы читать его без сюрпризов.
+           Смотрит не больше sample_size байт: BOM, затем проверка UTF-8, затем статистика chardet.
+           Если выборка целиком из ASCII, решение принимается по окну с первого не-ASCII байта файла.
+           source — путь, bytes или файловый объект (см. open_source)."""
         try:
-            with open(file_path, 'rb') as file:
-                result = chardet.detect(file.read())  # Смотрим, что за кодировка
-            # Возвращаем найденную кодировку или utf-8, если ничего не вышло
-            return result['encoding'] or 'utf-8'
+            with open_source(source) as file:
+                # BOM однозначно говорит о кодировке — дальше можно не смотреть
+                start = file.tell()  # Файловый объект может быть уже частично прочитан — начинаем с его позиции
+                head = file.read(4)
+                for bom, bom_encoding in ENCODING_BOMS:
+                    if head.startswith(bom):
+                        return self._encoding_found(bom_encoding, 1.0, len(head))
+                file.seek(start)
+
+                detector = UniversalDetector()
+                utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+                utf8_valid, seen_non_ascii, examined = True, False, 0
+                while examined < sample_size:
+                    block = file.read(min(ENCODING_BLOCK_SIZE, sample_size - examined))
+                    if not block:
+                        break
+                    examined += len(block)
+                    # Сначала дешёвая проверка: не-ASCII байты, которые честно читаются как UTF-8
+                    if utf8_valid:
+                        try:
+                            utf8_decoder.decode(block)
+                        except UnicodeDecodeError:
+                            utf8_valid = False
+                        seen_non_ascii = seen_non_ascii or not block.isascii()
+                        if utf8_valid and seen_non_ascii:
+                            return self._encoding_found('utf-8', 0.99, examined)
+                    # Иначе копим статистику, пока chardet не станет уверен
+                    detector.feed(block)
+                    if detector.done:
+                        break
+                result = detector.close()
+
+                if utf8_valid and examined >= sample_size:
+                    # Выборка целиком из ASCII — это ещё ничего не говорит: кириллица может начаться дальше.
+                    # Пробегаем файл до первого не-ASCII байта и решаем по окну, которое с него начинается
+                    window, skipped = self._first_non_ascii(file, sample_size)
+                    if window:
+                        return self._encoding_from_window(window, examined + skipped)
+                    examined += skipped
+
+            if utf8_valid:
+                # Весь файл из ASCII — UTF-8 прочитает его без ошибок
+                return self._encoding_found('utf-8', result['confidence'] or 1.0, examined)
+            return self._encoding_guessed(result, examined)
         except Exception as e:
             # Если что-то пошло не так, записываем ошибку и возвращаем utf-8
-            self.error_message += f"• Ошибка определения кодировки: {e}\n"
+            self.diagnostics.note(f"• Ошибка определения кодировки: {e}\n")
             return 'utf-8'
 
-    def read_csv_robust(self, file_path, encoding):
-        """Читает CSV-файл, обрабатывая ошибки, чтобы ничего не сломалось."""
-        valid_rows = []  # Собираем сюда только хорошие строки
-        parsing_errors = []  # А сюда — все проблемы с парсингом
+    @staticmethod
+    def _first_non_ascii(file, sample_size):
+        """Читает файл блоками до первого не-ASCII байта. Возвращает (до sample_size байт начиная с него,
+           сколько байт пропущено); окно пустое, если до конца файла только ASCII."""
+        skipped = 0
+        while True:
+            block = file.read(ENCODING_BLOCK_SIZE)
+            if not block:
+                return b'', skipped
+            if block.isascii():
+                skipped += len(block)
+                continue
+            start = next(i for i, byte in enumerate(block) if byte >= 0x80)
+            window = block[start:]
+            return window + file.read(max(0, sample_size - len(window))), skipped + start
 
+    def _encoding_from_window(self, window, examined):
+        """Кодировка по окну, которое начинается с первого не-ASCII байта файла."""
         try:
-            with open(file_path, 'r', encoding=encoding, errors='replace') as file:
-                lines = file.readlines()  # Читаем файл построчно
-                if not lines:
-                    self.error_message += "• Файл пуст\n"  # Пустой файл? Это не дело!
-                    return None
-
-                # Берём первую строку как заголовок
-                header = lines[0].strip().split(',')
-                if len(header) < 2:
-                    self.error_message += "• Некорректный заголовок файла\n"
-                    return None
-                expected_cols = len(header)  # Запоминаем, сколько столбцов должно быть
-                valid_rows.append(header)  # Сохраняем заголовок
-
-                # Обрабатываем строки данных
-                for i, line in enumerate(lines[1:], start=2):
-                    try:
-                        reader = csv.reader([line], skipinitialspace=True)
-                        row = next(reader, [])  # Читаем строку как CSV
-                        # Проверяем, что строка подходит по количеству столбцов и не пустая
-                        if len(row) == expected_cols and any(row):
-                            valid_rows.append(row)
-                        else:
-                            parsing_errors.append(f"[{i}] некорректная структура")
-                    except Exception:
-                        parsing_errors.append(f"[{i}] ошибка парсинга")
-
-                if len(valid_rows) <= 2:
-                    self.error_message += "• Недостаточно данных для анализа\n"
-                    return None
-
-                if parsing_errors:
-                    self.error_message += f"• Пропущено строк: {len(parsing_errors)} (пример: {parsing_errors[0]})\n"
-
-                # Преобразуем валидные строки в DataFrame
-                csv_content = '\n'.join([','.join(row) for row in valid_rows])
-                return pd.read_csv(io.StringIO(csv_content), encoding=encoding, skipinitialspace=True)
+            # Перед окном только ASCII, так что UTF-8-последовательность начинается ровно с его начала;
+            # обрезанный хвост в конце окна не ошибка (final=False)
+            codecs.getincrementaldecoder('utf-8')().decode(window, final=False)
+            return self._encoding_found('utf-8', 0.99, examined + len(window))
+        except UnicodeDecodeError:
+            return self._encoding_guessed(chardet.detect(window), examined + len(window))
+
+    def _encoding_guessed(self, result, examined):
+        """Кодировка по ответу chardet для байтов, которые точно не UTF-8. Если chardet не уверен,
+           берём ENCODING_FALLBACK: UTF-8 на таких байтах всё равно упал бы посреди чтения."""
+        encoding, confidence = result.get('encoding'), result.get('confidence') or 0.0
+        if not encoding or confidence < ENCODING_MIN_CONFIDENCE or encoding.lower().replace('-', '') in ('utf8', 'ascii'):
+            encoding = ENCODING_FALLBACK
+        return self._encoding_found(encoding, confidence, examined)
+
+    def _encoding_found(self, encoding, confidence, examined):
+        """Запоминает выбранную кодировку и отмечает её в диагностике."""
+        self.encoding_info = {'encoding': encoding, 'confidence': confidence, 'bytes_examined': examined}
+        self.diagnostics.note(f"Кодировка: {encoding} (уверенность {confidence:.2f}, проверено байт: {examined})\n")
+        return encoding
+
+    def iter_csv_chunks(self, source, encoding, chunksize=CSV_CHUNK_SIZE):
+        """Читает CSV за один проход и отдаёт DataFrame-чанки по chunksize строк.
+           Индекс чанка — номера строк в файле; статистику чтения складывает в self.read_stats,
+           первые строки первого чанка — в self.preview."""
+        self.read_stats = {'rows': 0, 'skipped': 0, 'header': None}
+        self.preview = None
+
+        with open_source(source) as binary, text_stream(binary, encoding) as file:
+            reader = csv.reader(file, skipinitialspace=True)
+
+            # Заголовок разбираем тем же csv.reader — кавычки и запятые внутри имён не страшны
+            header = next(reader, None)
+            if header is None:
+                self.diagnostics.note("• Файл пуст\n")  # Пустой файл? Это не дело!
+                return
+            header = self._dedupe_header([name.strip() for name in header])
+            if len(header) < 2:
+                self.diagnostics.note("• Некорректный заголовок файла\n")
+                return
+            self.read_stats['header'] = header
+            expected_cols = len(header)  # Запоминаем, сколько столбцов должно быть
+
+            rows, lines = [], []  # Буфер текущего чанка — память ограничена chunksize
+            while True:
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    break
+                except csv.Error:
+                    self._skip_row(reader.line_num, "ошибка парсинга")
+                    continue
+                # Проверяем, что строка подходит по количеству столбцов и не пустая
+                if len(row) == expected_cols and any(row):
+                    rows.append(row)
+                    lines.append(reader.line_num)
+                    if len(rows) >= chunksize:
+                        yield self._rows_to_frame(rows, lines, header)
+                        rows, lines = [], []
+                else:
+                    self._skip_row(reader.line_num, "некорректная структура")
+            if rows:
+                yield self._rows_to_frame(rows, lines, header)
+
+    def _skip_row(self, line, reason):
+        """Учитывает пропущенную строку: считаем все, а примеры хранит диагностика."""
+        self.read_stats['skipped'] += 1
+        self.diagnostics.issue("Пропущено строк", reason, row=line)
+
+    def _rows_to_frame(self, rows, lines, header):
+        """Собирает чанк из строк; стандартные пропуски ('', 'NA', 'null'...) превращает в NaN."""
+        self.read_stats['rows'] += len(rows)
+        chunk = pd.DataFrame(rows, columns=header, index=lines, dtype=object)
+        chunk = chunk.where(~chunk.isin(CSV_NA_VALUES))
+        if self.preview is None:
+            self.preview = chunk.head(PREVIEW_ROWS)
+        return chunk
+
+    @staticmethod
+    def _dedupe_header(header):
+        """Называет пустые и повторяющиеся столбцы так же, как pd.read_csv ('Unnamed: 2', 'id.1')."""
+        seen = {}
+        result = []
+        for i, name in enumerate(header):
+            name = name or f"Unnamed: {i}"
+            if name in seen:
+                seen[name] += 1
+                name = f"{name}.{seen[name]}"
+            else:
+                seen[name] = 0
+            result.append(name)
+        return result
+
+    def check_read_stats(self):
+        """Подводит итоги чтения: мало строк, пропущенные строки. False — анализировать нечего."""
+        if self.read_stats['header'] is None:
+            return False  # Пустой файл или плохой заголовок — причина уже записана
+
+        if self.read_stats['rows'] <= 1:
+            self.diagnostics.note("• Недостаточно данных для анализа\n")
+            return False
+        return True
+
+    def read_csv_robust(self, source, encoding):
+        """Читает CSV-файл (путь, bytes или файловый объект), обрабатывая ошибки, чтобы ничего не сломалось."""
+        try:
+            chunks = list(self.iter_csv_chunks(source, encoding))
+            if not self.check_read_stats():
+                return None
+
+            df = pd.concat(chunks)  # Индекс — номера строк файла, по ним диагностика ссылается на строки
+            # Как и pd.read_csv, превращаем полностью числовые столбцы в числа
+            for column in df.columns:
+                numbers = pd.to_numeric(df[column], errors='coerce')
+                if numbers.notna().sum() == df[column].notna().sum():
+                    df[column] = numbers
+            return df
         except Exception as e:
-            self.error_message += f"• Ошибка чтения файла: {e}\n"
+            self.diagnostics.note(f"• Ошибка чтения файла: {e}\n")
             return None
 
+    def iter_columnar_chunks(self, source, file_format, chunksize=CSV_CHUNK_SIZE):
+        """Читает Parquet или Feather (Arrow IPC) по chunksize строк — только столбцы, которые узнаёт
+           find_columns. Типы файла сохраняются: числа остаются числами, даты — датами."""
+        self.read_stats = {'rows': 0, 'skipped': 0, 'header': None}
+        self.preview = None
+
+        with open_source(source) as file:
+            if file_format == 'parquet':
+                parquet = pq.ParquetFile(file)
+                names = parquet.schema_arrow.names
+                projection = self._projection(names)
+                batches = parquet.iter_batches(batch_size=chunksize, columns=projection)
+            else:
+                reader = pa.ipc.open_file(file)
+                names = reader.schema.names
+                projection = self._projection(names)
+                batches = (reader.get_batch(i).select(projection) for i in range(reader.num_record_batches))
+            self.diagnostics.note(f"Формат: {file_format}, прочитаны столбцы: {', '.join(projection)} из {len(names)}\n")
+            self.read_stats['header'] = names
+
+            client_column = self.find_columns(projection)['client_id']
+            for batch in batches:
+                for offset in range(0, batch.num_rows, chunksize):
+                    yield self._arrow_to_frame(batch.slice(offset, chunksize), client_column)
+
+    def _projection(self, names):
+        """Столбцы, которые стоит читать: узнанные find_columns (если не узнан ни один — все)."""
+        found = [column for column in self.find_columns(names).values() if column is not None]
+        return [name for name in names if name in found] or list(names)
+
+    def _arrow_to_frame(self, batch, client_column):
+        """Чанк из пакета Arrow; индекс продолжает нумерацию строк с 1, как номера строк в диагностике."""
+        if client_column is not None:
+            index = batch.schema.get_field_index(client_column)
+            # Числовые ID в pandas стали бы float ('79161234567.0'), поэтому сразу переводим их в строки
+            if pa.types.is_integer(batch.column(index).type):
+                batch = batch.set_column(index, client_column, batch.column(index).cast(pa.string()))
+        start = self.read_stats['rows'] + 1
+        chunk = batch.to_pandas(date_as_object=False)
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        self.read_stats['rows'] += len(chunk)
+        if self.preview is None:
+            self.preview = chunk.head(PREVIEW_ROWS)
+        return chunk
+
+    def read_columnar(self, source, file_format):
+        """Читает Parquet или Feather целиком (см. iter_columnar_chunks)."""
+        try:
+            chunks = list(self.iter_columnar_chunks(source, file_format))
+            if not self.check_read_stats():
+                return None
+            return pd.concat(chunks)
+        except Exception as e:
+            self.diagnostics.note(f"• Ошибка чтения файла: {e}\n")
+            return None
+
+    def read_table(self, source):
+        """Читает файл любого поддерживаемого формата: CSV (в том числе .gz и .zip), Parquet или Feather."""
+        file_format = detect_format(source)
+        if file_format != 'csv':
+            return self.read_columnar(source, file_format)
+        return self.read_csv_robust(source, self.detect_encoding(source))
+
+    def iter_table_chunks(self, source, chunksize=CSV_CHUNK_SIZE):
+        """Чанки файла любого поддерживаемого формата (см. read_table)."""
+        file_format = detect_format(source)
+        if file_format != 'csv':
+            return self.iter_columnar_chunks(source, file_format, chunksize)
+        return self.iter_csv_chunks(source, self.detect_encoding(source), chunksize)
+
     def normalize_phone(self, phone):
         """Приводит телефонные номера к единому формату (+7XXXXXXXXXX)."""
         if pd.isna(phone):
@@ -119,6 +533,84 @@ class FileProcessor:
             except (ValueError, NameError):
                 return None  # Не получилось? Ну и ладно, None!
 
+    def normalize_phone_series(self, series):
+        """Векторная версия normalize_phone: обрабатывает весь столбец за один проход."""
+        # Убираем пробелы, дефисы и скобки сразу во всём столбце
+        phones = series.astype(str).str.replace(r'[\s\-\(\)]', '', regex=True)
+        # Номера, начинающиеся с 8, переводим на +7
+        starts_with_8 = phones.str.startswith('8')
+        return phones.mask(starts_with_8, '+7' + phones.str[1:])
+
+    def text_to_number_series(self, series):
+        """Векторная версия text_to_number: числа через pd.to_numeric, слова — только для уникальных неудач."""
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            return series.astype('float64')  # Уже числа — ничего делать не нужно
+        text = series.astype(str).str.strip().str.lower()
+        numbers = pd.to_numeric(text, errors='coerce').astype('float64')
+        # Медленный путь (float + w2n) — только для значений, которые не распознал pd.to_numeric
+        failed = numbers.isna() & series.notna()
+        if failed.any():
+            failed_text = text[failed]
+            lookup = {value: self.text_to_number(value) for value in failed_text.unique()}
+            numbers[failed] = failed_text.map(lookup).astype('float64')
+        return numbers
+
+    def parse_date_series(self, series):
+        """Векторная версия parse_date_safe: каждая уникальная строка разбирается один раз.
+           Сначала pd.to_datetime с форматом, угаданным по выборке, dateutil — только для нераспознанных строк."""
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return series  # Даты уже типизированы (Parquet, Feather) — разбирать нечего
+        codes, uniques = pd.factorize(series)  # Пропуски получают код -1
+        text = pd.Series(uniques, dtype=object).astype(str)
+        parsed = np.full(len(text), None, dtype=object)
+        failed = np.zeros(len(text), dtype=bool)
+
+        date_format = self.infer_date_format(text)
+        if date_format:
+            fast = pd.to_datetime(text, format=date_format, errors='coerce')
+            parsed[fast.notna().to_numpy()] = list(fast.dropna())
+
+        # Медленный путь (dateutil) — только для уникальных строк, которые не подошли под формат
+        for position in np.flatnonzero(pd.isna(parsed)):
+            try:
+                parsed[position] = parse_date(text[position])
+            except (ValueError, TypeError, OverflowError):
+                failed[position] = True
+
+        # Как и apply, список дат превращается в datetime64, если это возможно
+        values = pd.Series(parsed.tolist(), dtype=None if len(parsed) else object)
+        dates = pd.Series(values.array.take(codes, allow_fill=True), index=series.index)
+
+        # Проблема учитывается для каждой строки, но примеров диагностика хранит лишь несколько
+        failed_rows = np.zeros(len(codes), dtype=bool)
+        failed_rows[codes >= 0] = failed[codes[codes >= 0]]
+        self.diagnostics.issue_rows("Некорректный формат даты", series[failed_rows].astype(str))
+        return dates
+
+    def infer_date_format(self, text):
+        """Угадывает общий формат дат по выборке уникальных строк. Берём только форматы, где pd.to_datetime
+           разбирает строку так же, как dateutil: полная дата с четырёхзначным годом, месяц раньше дня
+           (или месяц словом), без часового пояса. Иначе None — и всё разберёт dateutil."""
+        sample = text.iloc[:DATE_FORMAT_SAMPLE_SIZE]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # pandas предупреждает о порядке день/месяц — мы проверяем его сами
+            guesses = Counter(guess for guess in map(guess_datetime_format, sample) if guess)
+        if not guesses:
+            return None
+
+        date_format = guesses.most_common(1)[0][0]
+        month = next((directive for directive in ('%m', '%b', '%B') if directive in date_format), None)
+        if ('%d' not in date_format or '%Y' not in date_format or month is None or '%z' in date_format or
+                '%Z' in date_format or (month == '%m' and date_format.index('%m') > date_format.index('%d'))):
+            return None
+
+        # Контрольная проверка на выборке: формат должен давать те же даты, что и dateutil
+        fast = pd.to_datetime(sample, format=date_format, errors='coerce')
+        for value, date in zip(sample[fast.notna()], fast.dropna()):
+            if parse_date(value) != date:
+                return None
+        return date_format
+
     def parse_date_safe(self, date_str):
         """Безопасно парсит даты, не падая при ошибках."""
         if pd.isna(date_str):
@@ -126,67 +618,126 @@ class FileProcessor:
         try:
             return parse_date(str(date_str))  # Пробуем распознать дату
         except (ValueError, TypeError):
-            self.error_message += f"• Некорректный формат даты: {date_str}\n"
+            self.diagnostics.issue("Некорректный формат даты", date_str)
             return None
 
     def validate_columns(self, df):
         """Проверяет столбцы и переименовывает их для RFM-анализа."""
-        found_columns = {'client_id': None, 'recency': None, 'amount': None, 'frequency': None, 'date': None}
-        df_columns_clean = [col.strip().lower() for col in df.columns]  # Приводим названия к нижнему регистру
-
-        self.error_message += f"Обнаруженные столбцы: {', '.join(df.columns)}\n"
-
-        # Ищем подходящие столбцы по их возможным именам
-        for key, aliases in self.column_mappings.items():
-            for col, col_clean in zip(df.columns, df_columns_clean):
-                if col_clean in [alias.lower() for alias in aliases]:
-                    found_columns[key] = col
-                    break
+        self.diagnostics.note(f"Обнаруженные столбцы: {', '.join(df.columns)}\n")
+        found_columns = self.find_columns(df.columns)
 
         # Проверяем, есть ли обязательный client_id
         if found_columns['client_id'] is None:
-            self.error_message += "• Отсутствует столбец с ID клиента\n"
+            self.diagnostics.note("• Отсутствует столбец с ID клиента\n")
             return None
         # Проверяем, есть ли данные для Recency и Monetary
         if found_columns['date'] is None and (found_columns['recency'] is None or found_columns['amount'] is None):
-            self.error_message += "• Отсутствуют данные для Recency и Monetary\n"
+            self.diagnostics.note("• Отсутствуют данные для Recency и Monetary\n")
             return None
 
         # Переименовываем столбцы в стандартные имена
-        rename_dict = {v: k for k, v in found_columns.items() if v is not None}
-        self.error_message += f"Переименованные столбцы: {rename_dict}\n"
-        return df.rename(columns=rename_dict)[list(rename_dict.values())]
+        self.rename_dict = {v: k for k, v in found_columns.items() if v is not None}
+        self.diagnostics.note(f"Переименованные столбцы: {self.rename_dict}\n")
+        return self.apply_column_mapping(df)
 
-    def clean_data(self, df):
-        """Чистит данные: убирает пропуски, исправляет ошибки, приводит к нужному формату."""
+    def find_columns(self, columns):
+        """Какой столбец файла отвечает за каждое стандартное имя (None — такого нет)."""
+        found_columns = {'client_id': None, 'recency': None, 'amount': None, 'frequency': None, 'date': None}
+        columns_clean = [str(col).strip().lower() for col in columns]  # Приводим названия к нижнему регистру
+
+        # Ищем подходящие столбцы по их возможным именам
+        for key, aliases in self.column_mappings.items():
+            for col, col_clean in zip(columns, columns_clean):
+                if col_clean in [alias.lower() for alias in aliases]:
+                    found_columns[key] = col
+                    break
+        return found_columns
+
+    def apply_column_mapping(self, df):
+        """Переименовывает столбцы очередного чанка так же, как validate_columns сделал для первого."""
+        return df.rename(columns=self.rename_dict)[list(self.rename_dict.values())]
+
+    def convert_columns(self, df, parse_dates=None):
+        """Построчные преобразования без удаления строк и заполнения пропусков: телефоны, даты
+           (с расчётом Recency) и числа. Каждая строка обрабатывается независимо, поэтому годится и для чанков."""
+        if parse_dates is None:
+            parse_dates = 'date' in df.columns and 'recency' not in df.columns
+
+        if 'client_id' in df.columns:
+            df['client_id'] = self.normalize_phone_series(df['client_id'])
+
+        # Даты разбираем и сразу считаем по ним Recency; у строк с плохой датой Recency останется пустой
+        if parse_dates:
+            df['date'] = self.parse_date_series(df['date'])
+            valid_dates = df['date'].notna()
+            df['recency'] = np.nan
+            if valid_dates.any():
+                # Давность — разница дат без времени и часового пояса, одной векторной операцией
+                dates = to_naive_datetime(df.loc[valid_dates, 'date']).dt.normalize()
+                df.loc[valid_dates, 'recency'] = (pd.Timestamp(self.current_date) - dates).dt.days
+
+        for column in ('recency', 'amount', 'frequency'):
+            if column in df.columns:
+                df[column] = self.text_to_number_series(df[column])
+        return df
+
+    def clean_data(self, df, workers=None):
+        """Чистит данные: убирает пропуски, исправляет ошибки, приводит к нужному формату.
+           workers > 1 — построчные преобразования идут по чанкам в пуле процессов (см. convert_parallel);
+           медианы для пропусков считаются уже по всем строкам, поэтому результат тот же, что без пула."""
+        parse_dates = 'date' in df.columns and 'recency' not in df.columns
+        # Процессов не больше ядер: на одном ядре пул только добавил бы запуск и пересылку
+        n_chunks = min(workers or 1, os.cpu_count() or 1, len(df) // PARALLEL_MIN_CHUNK_ROWS)
+        if n_chunks > 1:
+            df = self.convert_parallel(df, parse_dates, n_chunks)
+        else:
+            df = self.convert_columns(df, parse_dates)
+        return self.finalize_columns(df, parse_dates)
+
+    def convert_parallel(self, df, parse_dates, n_chunks):
+        """convert_columns по n_chunks кускам строк в отдельных процессах. Куски склеиваются в исходном порядке,
+           а их журналы вливаются в общий — счётчики и примеры проблем те же, что при обработке целиком."""
+        bounds = np.linspace(0, len(df), n_chunks + 1).astype(int)
+        chunks = [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        context = multiprocessing.get_context(PARALLEL_START_METHOD)
+        with ProcessPoolExecutor(max_workers=n_chunks, mp_context=context) as pool:
+            results = list(pool.map(_convert_chunk, chunks, repeat(parse_dates), repeat(self.current_date)))
+
+        for _, diagnostics in results:
+            self.diagnostics.merge(diagnostics)
+        converted = pd.concat([chunk for chunk, _ in results])
+        if parse_dates and len({chunk['date'].dtype for chunk, _ in results}) > 1:
+            # Кусок без единой верной даты (или с другим часовым поясом) остался object — выводим тип
+            # по всем значениям сразу, как это сделал бы parse_date_series для целого столбца
+            converted['date'] = pd.Series(converted['date'].tolist(), index=converted.index)
+        return converted
+
+    def finalize_columns(self, df, parse_dates):
+        """Вторая часть очистки — по уже преобразованным столбцам: удаление плохих строк,
+           заполнение пропусков медианой и исправление отрицательных значений."""
         issues = []  # Храним список проблем, чтобы потом отчитаться
 
         # Обрабатываем ID клиентов
         if 'client_id' in df.columns:
             original_count = len(df)
-            df['client_id'] = df['client_id'].astype(str).apply(self.normalize_phone)
             invalid_ids = df['client_id'].isna().sum()
             if invalid_ids > 0:
                 issues.append(f"Удалено {invalid_ids} строк с некорректными ID")
             df = df.dropna(subset=['client_id'])
 
         # Обрабатываем даты и считаем Recency
-        if 'date' in df.columns and 'recency' not in df.columns:
+        if parse_dates:
             original_count = len(df)
-            df['date'] = df['date'].apply(self.parse_date_safe)
             invalid_dates = df['date'].isna().sum()
             if invalid_dates > 0:
                 issues.append(f"Удалено {invalid_dates} строк с некорректными датами")
             df = df.dropna(subset=['date'])
-            if len(df) > 0:
-                df['recency'] = df['date'].apply(lambda x: (self.current_date - x.date()).days)
             if len(df) < original_count:
                 issues.append(f"Удалено {original_count - len(df)} строк из-за проблем с датами")
 
         # Обрабатываем Recency (давность покупки)
         if 'recency' in df.columns:
             original_count = len(df)
-            df['recency'] = df['recency'].apply(self.text_to_number)
             invalid_recency = df['recency'].isna().sum()
             if invalid_recency > 0:
                 median_recency = df['recency'].median()
@@ -204,7 +755,6 @@ class FileProcessor:
         # Обрабатываем Monetary (сумма покупок)
         if 'amount' in df.columns:
             original_count = len(df)
-            df['amount'] = df['amount'].apply(self.text_to_number)
             invalid_amounts = df['amount'].isna().sum()
             if invalid_amounts > 0:
                 median_amount = df['amount'].median()
@@ -222,7 +772,6 @@ class FileProcessor:
         # Обрабатываем Frequency (частота покупок)
         if 'frequency' in df.columns:
             original_count = len(df)
-            df['frequency'] = df['frequency'].apply(self.text_to_number)
             invalid_freq = df['frequency'].isna().sum()
             if invalid_freq > 0:
                 median_freq = df['frequency'].median()
@@ -239,24 +788,160 @@ class FileProcessor:
 
         # Если были проблемы, записываем их в лог
         if issues:
-            self.error_message += "Проблемы в данных\n" + "\n".join([f"• {issue}" for issue in issues]) + "\n"
+            self.diagnostics.note("Проблемы в данных\n" + "\n".join([f"• {issue}" for issue in issues]) + "\n")
 
         if df.empty:
-            self.error_message += "• Данные пусты после очистки. Анализ невозможен\n"
+            self.diagnostics.note("• Данные пусты после очистки. Анализ невозможен\n")
+            return df
+
+        # Сразу сжимаем: ID клиента повторяется в каждой его покупке — храним коды категорий,
+        # а целые давность и частоту — в наименьшем целом типе. Суммы остаются float64: их ещё складывать
+        compact = {column: pd.to_numeric(df[column], downcast='integer')
+                   for column in ('recency', 'frequency') if column in df.columns}
+        if 'client_id' in df.columns:
+            compact['client_id'] = df['client_id'].astype('category')
+        return df.assign(**compact)
+
+# === Класс для RFM-оценок: квинтили считаются один раз и переиспользуются ===
+class RFMScorer:
+    """Обучаемая модель RFM-оценок: fit считает границы групп через np.percentile,
+       transform ставит оценки через np.searchsorted. Границы сериализуются (to_dict/save),
+       чтобы новых клиентов можно было оценить по сохранённой базе без пересчёта квинтилей."""
+
+    error_message = message_property(ANALYSIS_SOURCE)
+
+    def __init__(self, n_bins=5, edges=None, diagnostics=None):
+        self.n_bins = n_bins
+        # Границы групп для каждой меры: [e0, e1, ..., ek], группа i — это (e_i, e_{i+1}]
+        self.edges = edges or {}
+        self.diagnostics = diagnostics or Diagnostics()
+        self._duplicates_reported = False  # Сообщение о повторяющихся границах пишем один раз
+
+    def fit(self, rfm):
+        """Считает границы групп по всей выборке клиентов."""
+        self._fit(rfm)
+        return self
+
+    def transform(self, rfm):
+        """Проставляет R/F/M-оценки по сохранённым границам."""
+        for column, score, reverse in SCORE_COLUMNS:
+            rfm[score] = self.score(column, rfm[column])
+        return rfm
+
+    def fit_transform(self, rfm):
+        """fit + transform; Frequency внутри выборки оценивается по рангам, как pd.qcut(rank(method='first'))."""
+        frequency_ranks = self._fit(rfm)
+        rfm = self.transform(rfm)
+        rfm['F_Score'] = self._bin(frequency_ranks, self._rank_edges, reverse=False)
+        return rfm
+
+    def score(self, column, values):
+        """Оценки 1..k для одной меры: одна векторная операция searchsorted."""
+        column_reverse = {column_name: reverse for column_name, _, reverse in SCORE_COLUMNS}
+        return self._bin(measure_values(values), np.asarray(self.edges[column]), column_reverse[column])
+
+    def to_dict(self):
+        """Границы в виде, пригодном для JSON."""
+        return {'n_bins': self.n_bins, 'edges': {column: [float(e) for e in edges] for column, edges in self.edges.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Восстанавливает модель из to_dict()."""
+        return cls(n_bins=data['n_bins'], edges={column: np.asarray(edges) for column, edges in data['edges'].items()})
+
+    def save(self, path):
+        """Сохраняет границы в JSON-файл."""
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, path):
+        """Загружает границы из JSON-файла."""
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls.from_dict(json.load(file))
+
+    def _fit(self, rfm):
+        """Считает границы всех мер и возвращает ранги Frequency для fit_transform."""
+        self.edges = {}
+        self._duplicates_reported = False
+        frequency_ranks = None
+        for column, _, _ in SCORE_COLUMNS:
+            values = measure_values(rfm[column])
+            if column == 'Frequency':
+                # Частоту делим по рангам, чтобы одинаковые значения не схлопывали группы
+                frequency_ranks = rfm[column].rank(method='first').to_numpy()
+                self._rank_edges = self._quantile_edges(frequency_ranks, column, values)
+                self.edges[column] = self._rank_edges_to_values(self._rank_edges, values)
+            else:
+                self.edges[column] = self._quantile_edges(values, column, values)
+        return frequency_ranks
+
+    def _quantile_edges(self, values, column, raw_values):
+        """Квантильные границы по массиву значений (см. edges_from_quantiles)."""
+        return self.edges_from_quantiles(column, lambda n_bins: self._percentiles(values, n_bins),
+                                         len(np.unique(raw_values)))
+
+    def edges_from_quantiles(self, column, quantiles, unique_values):
+        """Границы групп по функции квантилей quantiles(n_bins) -> [e0..e_n] с тем же откатом, что был у pd.qcut:
+           при повторяющихся границах берём min(n_bins, unique_values) групп, а оставшиеся повторы дают пустые группы.
+           Функцией квантилей может быть и точный np.percentile, и приближённый скетч."""
+        edges = np.asarray(quantiles(self.n_bins), dtype='float64')
+        if np.all(np.diff(edges) > 0):
+            return edges
+
+        if not self._duplicates_reported:
+            self.diagnostics.note(f"• Недостаточно уникальных значений для разделения на группы\n", ANALYSIS_SOURCE)
+            self._duplicates_reported = True
+        n_bins = min(self.n_bins, unique_values)
+        if n_bins < 2:
+            self.diagnostics.note(f"• Невозможно разделить {column}: только {unique_values} значение\n", ANALYSIS_SOURCE)
+            return edges[[0, -1]]  # Одна группа — у всех оценка 1
+
+        edges = np.asarray(quantiles(n_bins), dtype='float64')
+        if not np.all(np.diff(edges) > 0):
+            self.diagnostics.note(f"• {column}: часть из {n_bins} групп пуста из-за повторяющихся значений\n", ANALYSIS_SOURCE)
+        return edges
+
+    @staticmethod
+    def _percentiles(values, n_bins):
+        """Границы n_bins равных по численности групп — те же вызовы, что делает pd.qcut."""
+        return np.percentile(values, np.linspace(0, 1, n_bins + 1) * 100)
+
+    @staticmethod
+    def _rank_edges_to_values(rank_edges, values):
+        """Переводит границы рангов в границы значений: граница — значение последнего клиента в группе."""
+        sorted_values = np.sort(values)
+        positions = np.clip(np.floor(rank_edges).astype(np.intp) - 1, 0, len(sorted_values) - 1)
+        return sorted_values[positions]
+
+    @staticmethod
+    def _bin(values, edges, reverse):
+        """Номер группы через searchsorted: группа i — (e_i, e_{i+1}], значения за краями — в крайние группы.
+           Оценки — int8: на миллионах клиентов это в 8 раз меньше памяти, чем int64."""
+        n_groups = len(edges) - 1
+        groups = np.clip(np.searchsorted(edges, values, side='left') - 1, 0, n_groups - 1)
+        # Для Recency порядок обратный: чем меньше давность, тем выше оценка
+        return (n_groups - groups if reverse else groups + 1).astype(SCORE_DTYPE)
 
-        return df
 
 # === Класс для RFM-анализа: превращаем данные в сегменты клиентов ===
 class RFMAnalyzer:
     """Класс для выполнения RFM-анализа и разделения клиентов на группы (VIP, лояльные и т.д.)."""
 
-    def __init__(self):
-        # Храним ошибки анализа, чтобы знать, где споткнулись
-        self.error_message = ""
+    error_message = message_property(ANALYSIS_SOURCE)
+
+    def __init__(self, diagnostics=None):
+        # Храним ошибки анализа, чтобы знать, где споткнулись (общий журнал с FileProcessor)
+        self.diagnostics = diagnostics or Diagnostics()
+        self.memory_report = None  # Память итоговой таблицы по столбцам (см. memory_report)
 
     def assign_segment(self, row):
         """Определяет сегмент клиента по его RFM-оценкам (Recency, Frequency, Monetary)."""
-        r, f, m = int(row['R_Score']), int(row['F_Score']), int(row['M_Score'])
+        return self.segment_for_scores(int(row['R_Score']), int(row['F_Score']), int(row['M_Score']))
+
+    @staticmethod
+    def segment_for_scores(r, f, m):
+        """Правила сегментации для одной тройки оценок; из них же собирается SEGMENT_LOOKUP."""
         rfm_sum = r + f + m  # Суммируем оценки для упрощения логики
 
         # Логика сегментации: кто VIP, а кто "спящий"?
@@ -276,6 +961,35 @@ class RFMAnalyzer:
             return 'Спящие клиенты' if (f + m) <= 4 else 'Рискующие клиенты'
         return 'Рискующие клиенты'  # По умолчанию — те, кто на грани
 
+    def aggregate_transactions(self, df, as_of_date=None):
+        """Сворачивает журнал транзакций в одну строку на клиента: Recency — по последней дате покупки,
+           Frequency — число покупок, Monetary — их сумма. Давность считается на дату as_of_date (по умолчанию сегодня)."""
+        as_of = pd.Timestamp(as_of_date or datetime.now().date()).normalize()
+
+        dates = to_naive_datetime(df['date'])
+
+        # Группируем по категориальным кодам клиентов — строки ID не копируются для каждой группы
+        clients = df['client_id'].astype('category')
+        aggregations = {'date': ('date', 'max')}
+        # Если в файле уже есть частота, суммируем её, иначе считаем число транзакций
+        aggregations['frequency'] = ('frequency', 'sum') if 'frequency' in df.columns else ('date', 'size')
+        if 'amount' in df.columns:
+            aggregations['amount'] = ('amount', 'sum')
+        customers = df.assign(date=dates).groupby(clients, observed=True, sort=False).agg(**aggregations)
+
+        customers['recency'] = (as_of - customers['date'].dt.normalize()).dt.days
+        future_purchases = (customers['recency'] < 0).sum()
+        if future_purchases > 0:
+            self.diagnostics.note(f"• Исправлено {future_purchases} клиентов с покупками позже {as_of.date()}\n",
+                                  ANALYSIS_SOURCE)
+            customers.loc[customers['recency'] < 0, 'recency'] = 0
+
+        self.diagnostics.note(f"Транзакции сгруппированы по клиентам: {len(df)} строк → {len(customers)} клиентов\n",
+                              ANALYSIS_SOURCE)
+        customers = customers.rename_axis('client_id').reset_index()
+        return customers[['client_id', 'date', 'recency', 'frequency'] +
+                         (['amount'] if 'amount' in customers.columns else [])]
+
     def analyze(self, df):
         """Проводит RFM-анализ: присваивает оценки и сегменты клиентам."""
         # Переименовываем столбцы для удобства
@@ -288,205 +1002,265 @@ class RFMAnalyzer:
         required_columns = ['Buyer', 'Recency', 'Monetary']
         missing_columns = [col for col in required_columns if col not in rfm.columns]
         if missing_columns:
-            self.error_message += f"• Анализ невозможен: отсутствуют столбцы {', '.join(missing_columns)}\n"
+            self.diagnostics.note(f"• Анализ невозможен: отсутствуют столбцы {', '.join(missing_columns)}\n", ANALYSIS_SOURCE)
             return None
 
-        # Оставляем только нужные столбцы
+        # Оставляем только нужные столбцы в компактных типах: давность и частота — наименьший целый тип,
+        # суммы — float32 без потери копеек (оценки и сводка читают их через measure_values)
         rfm = rfm[required_columns + ['Frequency'] if 'Frequency' in rfm.columns else required_columns]
+        rfm = rfm.assign(Recency=pd.to_numeric(rfm['Recency'], downcast='integer'),
+                         Frequency=pd.to_numeric(rfm['Frequency'], downcast='integer'),
+                         Monetary=compact_money(rfm['Monetary']))
 
-        # Присваиваем RFM-оценки (1–5) по квинтилям
-        try:
-            rfm['R_Score'] = pd.qcut(rfm['Recency'], 5, labels=[5, 4, 3, 2, 1], duplicates='drop')  # Чем меньше Recency, тем лучше
-            rfm['F_Score'] = pd.qcut(rfm['Frequency'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5],
-                                     duplicates='drop') if 'Frequency' in rfm.columns else 1
-            rfm['M_Score'] = pd.qcut(rfm['Monetary'], 5, labels=[1, 2, 3, 4, 5], duplicates='drop')
-        except ValueError as e:
-            self.error_message += f"• Недостаточно уникальных значений для разделения на группы\n"
-            # Если квинтили не получаются, пробуем меньше групп
-            for column, score in [('Recency', 'R_Score'), ('Frequency', 'F_Score'), ('Monetary', 'M_Score')]:
-                if column == 'Frequency' and column not in rfm.columns:
-                    rfm['F_Score'] = 1
-                    continue
-                unique_values = len(rfm[column].unique())
-                n_bins = min(5, unique_values)
-                if n_bins < 2:
-                    self.error_message += f"• Невозможно разделить {column}: только {unique_values} значение\n"
-                    rfm[score] = 1
-                else:
-                    try:
-                        if column == 'Recency':
-                            labels = list(range(n_bins, 0, -1))  # Для Recency — обратный порядок
-                        else:
-                            labels = list(range(1, n_bins + 1))
-                        if column == 'Frequency':
-                            rfm[score] = pd.qcut(rfm[column].rank(method='first'), n_bins, labels=labels,
-                                                 duplicates='drop')
-                        else:
-                            rfm[score] = pd.qcut(rfm[column], n_bins, labels=labels, duplicates='drop')
-                    except ValueError:
-                        self.error_message += f"• Ошибка разделения {column} на {n_bins} групп\n"
-                        rfm[score] = 1
+        # Присваиваем RFM-оценки (1–5) по квинтилям; границы остаются в self.scorer для новых клиентов
+        self.scorer = RFMScorer(diagnostics=self.diagnostics)
+        rfm = self.scorer.fit_transform(rfm)
 
         # Присваиваем сегменты каждому клиенту
-        rfm['Segment'] = rfm.apply(self.assign_segment, axis=1)
+        rfm['Segment'] = self.lookup_segments(rfm)
+        self.memory_report = memory_report(rfm)
         return rfm
 
+    def lookup_segments(self, rfm):
+        """Назначает сегменты всем клиентам сразу: выборка из SEGMENT_LOOKUP по трём столбцам оценок."""
+        r = np.asarray(rfm['R_Score'], dtype=np.intp) - 1
+        f = np.asarray(rfm['F_Score'], dtype=np.intp) - 1
+        m = np.asarray(rfm['M_Score'], dtype=np.intp) - 1
+        return pd.Categorical.from_codes(SEGMENT_LOOKUP[r, f, m], categories=SEGMENTS)
+
+# Таблица 5×5×5: код сегмента (индекс в SEGMENTS) для каждого сочетания R/F/M-оценок.
+# Собирается из правил segment_for_scores; tests/test_segments.py сверяет все 125 сочетаний
+# с исходными построчными правилами assign_segment
+SEGMENT_LOOKUP = np.array([[[SEGMENTS.index(RFMAnalyzer.segment_for_scores(r, f, m)) for m in range(1, 6)]
+                            for f in range(1, 6)] for r in range(1, 6)], dtype=np.int8)
+
+# === Класс для отрисовки графиков: одна заготовка фигуры на все загрузки ===
+class ChartRenderer:
+    """Рисует графики сегментов на заранее собранной фигуре: при каждом вызове меняются только
+       длины столбиков, подписи и пределы осей, а картинка кодируется сразу в память.
+       Фигура одна на процесс и пресет, поэтому отрисовка защищена блокировкой."""
+
+    _renderers = {}
+    _theme_applied = False
+    _lock = threading.Lock()
+
+    def __init__(self, preset='telegram'):
+        if not ChartRenderer._theme_applied:
+            matplotlib.rcParams.update(CHART_THEME)
+            ChartRenderer._theme_applied = True
+        self.preset = CHART_PRESETS[preset]
+        self.segments = None  # Сегменты, под которые собрана заготовка
+
+    @classmethod
+    def shared(cls, preset='telegram'):
+        """Общий рендерер для пресета — заготовка фигуры собирается один раз."""
+        with cls._lock:
+            if preset not in cls._renderers:
+                cls._renderers[preset] = cls(preset)
+            return cls._renderers[preset]
+
+    def render(self, summary, image_format='png'):
+        """Возвращает картинку графика (bytes) по сводке сегментов."""
+        with self._lock:
+            segments = [str(segment) for segment in summary.index]
+            if segments != self.segments:
+                self._build_template(segments)
+
+            for (column, _, _, label_format), ax, bars, labels in zip(CHART_PANELS, self.axes, self.bars, self.labels):
+                values = summary[column].to_numpy(dtype='float64')
+                for bar, label, value in zip(bars, labels, values):
+                    bar.set_width(value)
+                    label.xy = (value, label.xy[1])
+                    label.set_text(label_format.format(value))
+                # Запас справа, чтобы подписи не вылезали за ось
+                ax.set_xlim(0, max(values.max(), 1) * 1.35)
+
+            buffer = io.BytesIO()
+            self.figure.savefig(buffer, format=image_format, dpi=self.preset['dpi'], **CHART_ENCODERS[image_format])
+            return buffer.getvalue()
+
+    def _build_template(self, segments):
+        """Собирает фигуру с тремя панелями горизонтальных столбиков и пустыми подписями."""
+        self.figure = Figure(figsize=self.preset['figsize'])
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.subplots(1, 3, sharey=True)
+        self.bars, self.labels = [], []
+        positions = np.arange(len(segments))
+        for (column, xlabel, palette, _), ax in zip(CHART_PANELS, self.axes):
+            colors = matplotlib.colormaps[palette](np.linspace(0.15, 0.85, len(segments)))
+            self.bars.append(ax.barh(positions, np.zeros(len(segments)), color=colors, height=0.7))
+            self.labels.append([ax.annotate('', xy=(0, y), xytext=(3, 0), textcoords='offset points',
+                                            va='center', fontsize=9) for y in positions])
+            ax.set_title(column)
+            ax.set_xlabel(xlabel)
+        self.axes[0].set_yticks(positions, segments)
+        self.axes[0].set_ylabel('Сегмент')
+        self.axes[0].invert_yaxis()  # Первый сегмент — сверху, как в таблице
+        self.figure.tight_layout()
+        self.segments = segments
+
+
 # === Класс для визуализации и вывода результатов ===
 class ResultPresenter:
     """Класс для создания красивых таблиц, графиков и текстового описания RFM-анализа."""
 
-    def __init__(self):
+    def __init__(self, chart_format='png', chart_preset='telegram'):
         # Храним таблицу и текст результатов
         self.result_table = ""
         self.result_text = ""
-        self.plot_path = ""  # Путь к сохранённому графику
+        self.plot_path = ""  # Путь к сохранённому графику (только если его попросили сохранить на диск)
+        self.plot_bytes = b""  # Готовая картинка графика в формате chart_format
+        self.chart_format = chart_format
+        self.chart_preset = chart_preset
+        self.summary = None  # Сводка по сегментам (DataFrame), из которой строятся таблица, текст и график
 
-    def plot_rfm_segments(self, segment_dicts, output_file='rfm_segments.png'):
-        """Рисует три красивых графика: количество клиентов, средний и общий чек по сегментам."""
-        if not segment_dicts:
+    def plot_rfm_segments(self, summary, output_file=None):
+        """Рисует три графика (количество клиентов, средний и общий чек по сегментам) в память — self.plot_bytes.
+           Если передан output_file, картинка дополнительно сохраняется в папку Charts."""
+        if summary is None or summary.empty:
             self.result_text += "• Визуализация невозможна: нет данных\n"
             return
 
-        # Сохраняем график в папку Charts
-        output_file = os.path.join('Charts', os.path.basename(output_file))
-        self.plot_path = output_file
-
-        # Настраиваем стиль графиков — чтобы всё выглядело стильно
-        sns.set_theme(style="whitegrid", palette="muted")
-        plt.rcParams['font.family'] = 'Arial'
-        plt.rcParams['font.size'] = 12
-
-        # Создаём три подграфика рядом
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(18, 6), sharey=True)
-
-        segments = list(segment_dicts.keys())
-        counts = [segment_dicts[s]['Количество клиентов'] for s in segments]
-        avg_checks = [segment_dicts[s]['Средний чек'] for s in segments]
-        total_checks = [segment_dicts[s]['Общий чек'] for s in segments]
-
-        # График 1: Количество клиентов по сегментам
-        bar1 = sns.barplot(x=counts, y=segments, hue=segments, ax=ax1, palette='viridis', legend=False)
-        ax1.set_title('Количество клиентов', fontsize=14, pad=10)
-        ax1.set_xlabel('Клиентов', fontsize=12)
-        ax1.set_ylabel('Сегмент', fontsize=12)
-        for i, v in enumerate(counts):
-            bar1.text(v + 0.1, i, str(v), va='center', fontsize=10)  # Добавляем подписи
-
-        # График 2: Средний чек по сегментам
-        bar2 = sns.barplot(x=avg_checks, y=segments, hue=segments, ax=ax2, palette='magma', legend=False)
-        ax2.set_title('Средний чек', fontsize=14, pad=10)
-        ax2.set_xlabel('Руб.', fontsize=12)
-        ax2.set_ylabel('')
-        for i, v in enumerate(avg_checks):
-            bar2.text(v + 0.1, i, f"{v:.2f}", va='center', fontsize=10)
-
-        # График 3: Общий чек по сегментам
-        bar3 = sns.barplot(x=total_checks, y=segments, hue=segments, ax=ax3, palette='crest', legend=False)
-        ax3.set_title('Общий чек', fontsize=14, pad=10)
-        ax3.set_xlabel('Руб.', fontsize=12)
-        ax3.set_ylabel('')
-        for i, v in enumerate(total_checks):
-            bar3.text(v + 0.1, i, f"{v:.2f}", va='center', fontsize=10)
-
-        # Делаем графики компактными и сохраняем
-        plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
-        plt.close()
+        self.plot_bytes = ChartRenderer.shared(self.chart_preset).render(summary, self.chart_format)
+        if output_file:
+            self.plot_path = os.path.join('Charts', os.path.basename(output_file))
+            with open(self.plot_path, 'wb') as file:
+                file.write(self.plot_bytes)
 
     def generate_results(self, rfm, file_name):
         """Создаёт таблицу и текст с результатами RFM-анализа."""
-        segments = ['VIP-клиенты', 'Лояльные клиенты', 'Новые покупатели', 'Рискующие клиенты', 'Спящие клиенты']
-        segment_dicts = {}
-
-        # Собираем статистику по каждому сегменту
-        for segment in segments:
-            segment_data = rfm[rfm['Segment'] == segment]
-            count = len(segment_data)
-            avg_amount = segment_data['Monetary'].mean() if count > 0 else 0
-            total_amount = segment_data['Monetary'].sum() if count > 0 else 0
-
-            segment_dicts[segment] = {
-                'Количество клиентов': count,
-                'Средний чек': float(round(avg_amount, 2)),
-                'Общий чек': float(round(total_amount, 2))
-            }
+        self.render_results(self.summarize(rfm), file_name)
+
+    @staticmethod
+    def summarize(rfm, aggregations=None):
+        """Сводка по сегментам за один groupby: строки — все SEGMENTS (пустые тоже), столбцы — из aggregations.
+           Пустые сегменты получают 0, денежные показатели округляются до копеек."""
+        aggregations = aggregations or SEGMENT_SUMMARY
+        segments = pd.Categorical(rfm['Segment'], categories=SEGMENTS)
+        # Меры берём во float64: суммы float32 складывались бы с потерей копеек
+        measures = pd.DataFrame({column: measure_values(rfm[column]) for column, _ in aggregations.values()},
+                                index=rfm.index)
+        summary = measures.groupby(segments, observed=False).agg(**aggregations)
+        summary = summary.fillna(0).round(2)
+        summary.index.name = 'Сегмент'
+        return summary
+
+    def render_results(self, summary, file_name):
+        """Рисует таблицу, текст и график по одной сводке сегментов (см. summarize)."""
+        self.summary = summary
 
         # Формируем таблицу результатов
-        result_df = pd.DataFrame.from_dict(segment_dicts, orient='index').reset_index()
-        result_df.columns = ['Сегмент', 'Количество клиентов', 'Средний чек', 'Общий чек']
-        self.result_table = result_df.to_string(index=False)
+        self.result_table = summary.reset_index().to_string(index=False)
 
         # Пишем текстовое описание — всё по полочкам
-        self.result_text = f"\nРезультаты RFM-анализа\n\n"
-        for segment, data in segment_dicts.items():
-            self.result_text += f"{segment}:\n"
-            self.result_text += f"  Клиентов: {data['Количество клиентов']}\n"
-            self.result_text += f"  Средний чек: {data['Средний чек']:.2f} руб.\n"
-            self.result_text += f"  Общий чек: {data['Общий чек']:.2f} руб.\n\n"
+        lines = ["", "Результаты RFM-анализа", ""]
+        for segment, data in summary.iterrows():
+            lines += [f"{segment}:",
+                      f"  Клиентов: {int(data['Количество клиентов'])}",
+                      f"  Средний чек: {data['Средний чек']:.2f} руб.",
+                      f"  Общий чек: {data['Общий чек']:.2f} руб.", ""]
+        self.result_text = "\n".join(lines) + "\n"
 
         # Создаём графики для наглядности
-        self.plot_rfm_segments(segment_dicts, output_file=f'rfm_segments_{file_name.replace(".csv", "")}.png')
+        self.plot_rfm_segments(summary)
 
 # === Главная функция: собираем всё воедино ===
-def main(file_path):
-    """Основная функция: читает файл, чистит данные, проводит RFM-анализ и выдаёт результаты."""
-    processor = FileProcessor()  # Создаём обработчик файлов
-    analyzer = RFMAnalyzer()    # Создаём анализатор RFM
+def main(source, as_of_date=None, chunksize=None, memory_limit_mb=None, metrics=None, workers=None):
+    """Основная функция: читает файл, чистит данные, проводит RFM-анализ и выдаёт результаты.
+       source — путь к файлу, bytes или файловый объект: загрузку можно анализировать прямо из памяти.
+       Форматы: CSV (в том числе .csv.gz и .zip), Parquet и Feather.
+       as_of_date — дата, на которую считается давность покупок в журнале транзакций (по умолчанию сегодня).
+       chunksize включает потоковый режим для файлов больше памяти (см. RFMChunked), memory_limit_mb — его лимит памяти.
+       metrics — замеры стадий (Metrics.Metrics или True); их отчёт возвращается под ключом 'metrics'.
+       workers — сколько процессов использовать для очистки больших файлов (см. FileProcessor.clean_data)."""
+    metrics = Metrics.resolve(metrics)
+    if chunksize:
+        from RFMChunked import ChunkedRFM  # Импорт здесь: RFMChunked сам опирается на классы этого модуля
+        chunked = ChunkedRFM(chunksize=chunksize, memory_limit_mb=memory_limit_mb, as_of_date=as_of_date)
+        result = metrics.run('chunked', chunked.run, source)
+        return {**result, 'metrics': metrics.report()}
+
+    diagnostics = Diagnostics()  # Общий журнал сообщений для обработчика и анализатора
+    processor = FileProcessor(diagnostics)  # Создаём обработчик файлов
+    analyzer = RFMAnalyzer(diagnostics)    # Создаём анализатор RFM
     presenter = ResultPresenter()  # Создаём визуализатор результатов
 
     # Начинаем анализ файла
-    processor.error_message = f"\n Анализ файла:\n"
-    encoding = processor.detect_encoding(file_path)  # Определяем кодировку
-    df = processor.read_csv_robust(file_path, encoding)  # Читаем CSV
+    diagnostics.note(f"\n Анализ файла:\n")
+    file_format = detect_format(source)
+    if file_format == 'csv':
+        encoding = metrics.run('detect_encoding', processor.detect_encoding, source)  # Определяем кодировку
+        df = metrics.run('read_csv', processor.read_csv_robust, source, encoding)  # Читаем CSV
+    else:
+        df = metrics.run('read_columnar', processor.read_columnar, source, file_format)  # Parquet или Feather
     if df is None:
         return {
-            'errors': processor.error_message,
+            'errors': diagnostics.render(),
             'corrections': "",
             'plot_path': "",
             'result_text': "",
-            'result_table': ""
+            'result_table': "",
+            'preview': processor.preview,
+            'metrics': metrics.report()
         }
 
     # Проверяем и чистим данные
-    df = processor.validate_columns(df)
+    df = metrics.run('validate_columns', processor.validate_columns, df, rows_in=len(df))
     if df is None:
         return {
-            'errors': processor.error_message,
+            'errors': diagnostics.render(),
             'corrections': "",
             'plot_path': "",
             'result_text': "",
-            'result_table': ""
+            'result_table': "",
+            'preview': processor.preview,
+            'metrics': metrics.report()
         }
 
-    df = processor.clean_data(df)
+    df = metrics.run('clean_data', processor.clean_data, df, workers=workers, rows_in=len(df))
     if df.empty:
         return {
-            'errors': processor.error_message,
-            'corrections': processor.error_message,
+            'errors': diagnostics.render(),
+            'corrections': diagnostics.render(FILE_SOURCE),
             'plot_path': "",
             'result_text': "",
-            'result_table': ""
+            'result_table': "",
+            'preview': processor.preview,
+            'metrics': metrics.report()
         }
 
+    # Журнал транзакций с датами сворачиваем в одну строку на клиента
+    if 'date' in df.columns and pd.api.types.is_datetime64_any_dtype(df['date']):
+        df = metrics.run('aggregate', analyzer.aggregate_transactions, df, as_of_date, rows_in=len(df))
+
     # Проводим RFM-анализ
-    rfm = analyzer.analyze(df)
+    rfm = metrics.run('analyze', analyzer.analyze, df, rows_in=len(df))
     if rfm is None:
         return {
-            'errors': processor.error_message + analyzer.error_message,
-            'corrections': processor.error_message,
+            'errors': diagnostics.render(),
+            'corrections': diagnostics.render(FILE_SOURCE),
             'plot_path': "",
             'result_text': "",
-            'result_table': ""
+            'result_table': "",
+            'preview': processor.preview,
+            'metrics': metrics.report()
         }
 
     # Генерируем красивые результаты
-    presenter.generate_results(rfm, file_path)
+    metrics.run('results', presenter.generate_results, rfm, source, rows_in=len(rfm))
     return {
-        'errors': processor.error_message + analyzer.error_message,
-        'corrections': processor.error_message,
+        'errors': diagnostics.render(),
+        'corrections': diagnostics.render(FILE_SOURCE),
         'plot_path': presenter.plot_path,
+        'plot_bytes': presenter.plot_bytes,
         'result_text': presenter.result_text,
-        'result_table': presenter.result_table
+        'result_table': presenter.result_table,
+        'summary': presenter.summary,
+        'diagnostics': diagnostics.summary(),
+        'rows_read': processor.read_stats['rows'],
+        'memory': analyzer.memory_report,
+        'preview': processor.preview,
+        'metrics': metrics.report()
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+# === RFMBatch.py: пакетный RFM-анализ из командной строки ===
+# Прогоняет RFM.main по множеству файлов параллельно (по процессу на файл) и сохраняет
+# сводки по каждому файлу и общую сводку в CSV или Parquet.
+#
+# Пример:
+#   python RFMBatch.py exports/ "archive/*.csv" -o results --format parquet --workers 8
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import RFM
+
+OUTPUT_FORMATS = ('csv', 'parquet')
+
+
+def collect_files(inputs, pattern=None):
+    """Раскрывает каталоги и шаблоны в отсортированный список файлов без повторов.
+       Из каталога берутся файлы с расширениями RFM.SUPPORTED_EXTENSIONS, либо подходящие под pattern, если он задан."""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item) and pattern:
+            files.extend(glob.glob(os.path.join(item, pattern)))
+        elif os.path.isdir(item):
+            files.extend(entry.path for entry in os.scandir(item)
+                         if entry.is_file() and entry.name.lower().endswith(RFM.SUPPORTED_EXTENSIONS))
+        else:
+            files.extend(glob.glob(item) or ([item] if os.path.isfile(item) else []))
+    return sorted(set(os.path.abspath(path) for path in files))
+
+
+def analyze_file(file_path, as_of_date=None, chunksize=None, memory_limit_mb=None):
+    """Анализ одного файла в рабочем процессе. Любая ошибка остаётся внутри записи о файле."""
+    started = time.perf_counter()
+    record = {'file': file_path, 'status': 'ok', 'rows': 0, 'seconds': 0.0, 'error': '', 'summary': None}
+    try:
+        result = RFM.main(file_path, as_of_date=as_of_date, chunksize=chunksize, memory_limit_mb=memory_limit_mb)
+        if result.get('summary') is None:
+            # Анализ не состоялся — в отчёт идёт первая строка с «•» из диагностики
+            problems = [line for line in result.get('errors', '').splitlines() if line.startswith('•')]
+            record.update(status='failed', error=problems[0] if problems else 'анализ не выполнен')
+        else:
+            record.update(rows=result.get('rows_read', 0), summary=result['summary'].reset_index())
+    except Exception as e:
+        record.update(status='error', error=f"{type(e).__name__}: {e}")
+    record['seconds'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def write_table(df, path, output_format):
+    """Пишет таблицу в CSV (UTF-8 с BOM — чтобы Excel понял кириллицу) или Parquet."""
+    if output_format == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def output_name(file_path, used):
+    """Имя выходного файла по имени входного; одинаковые имена из разных каталогов получают номер."""
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    name, counter = stem, 1
+    while name in used:
+        counter += 1
+        name = f"{stem}_{counter}"
+    used.add(name)
+    return name
+
+
+def run_batch(files, output_dir, output_format='csv', workers=None, as_of_date=None, chunksize=None,
+              memory_limit_mb=None, log=print):
+    """Обрабатывает файлы в пуле процессов и сохраняет результаты. Возвращает отчёт (DataFrame) по файлам."""
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    records, summaries, used_names = [], [], set()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze_file, path, as_of_date, chunksize, memory_limit_mb): path for path in files}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                record = future.result()
+            except Exception as e:  # Упал сам рабочий процесс — файл помечаем, остальные продолжают
+                record = {'file': futures[future], 'status': 'error', 'rows': 0, 'seconds': 0.0,
+                          'error': f"{type(e).__name__}: {e}", 'summary': None}
+
+            summary = record.pop('summary')
+            if summary is not None:
+                name = output_name(record['file'], used_names)
+                write_table(summary, os.path.join(output_dir, f"{name}_rfm.{output_format}"), output_format)
+                summaries.append(summary.assign(file=record['file']))
+            records.append(record)
+            log(f"[{done}/{len(files)}] {record['status']:6} {record['seconds']:8.2f} с  {record['file']}"
+                + (f"  — {record['error']}" if record['error'] else ""))
+
+    elapsed = time.perf_counter() - started
+    # Порядок завершения случаен — в отчётах сортируем по имени файла
+    report = pd.DataFrame(records, columns=['file', 'status', 'rows', 'seconds', 'error']).sort_values('file')
+    write_table(report, os.path.join(output_dir, f"batch_report.{output_format}"), output_format)
+    if summaries:
+        combined = pd.concat(summaries, ignore_index=True).sort_values('file', kind='stable')
+        combined = combined[['file'] + [column for column in combined.columns if column != 'file']]
+        combined['Сегмент'] = combined['Сегмент'].astype(str)
+        write_table(combined, os.path.join(output_dir, f"rfm_summary.{output_format}"), output_format)
+
+    ok = int((report['status'] == 'ok').sum())
+    total_rows = int(report['rows'].sum())
+    log(f"Готово: {ok} из {len(files)} файлов за {elapsed:.2f} с — "
+        f"{len(files) / elapsed:.2f} файлов/с, {total_rows / elapsed:,.0f} строк/с")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный RFM-анализ файлов (CSV, gzip, zip, Parquet, Feather).")
+    parser.add_argument('inputs', nargs='+', help="файлы, каталоги или шаблоны (например, 'exports/*.csv')")
+    parser.add_argument('-o', '--output-dir', default='rfm_results', help="куда сохранять результаты")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv', help="формат выходных таблиц")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="число процессов (по умолчанию — по числу ядер)")
+    parser.add_argument('--pattern', default=None,
+                        help="какие файлы брать из каталогов (по умолчанию — все поддерживаемые форматы)")
+    parser.add_argument('--as-of', default=None, help="дата расчёта давности, ГГГГ-ММ-ДД (по умолчанию сегодня)")
+    parser.add_argument('--chunksize', type=int, default=None, help="потоковый режим: строк в чанке")
+    parser.add_argument('--memory-limit-mb', type=int, default=None, help="потоковый режим: лимит памяти на файл")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = collect_files(args.inputs, args.pattern)
+    if not files:
+        print("Файлы не найдены", file=sys.stderr)
+        return 1
+    report = run_batch(files, args.output_dir, args.format, args.workers, args.as_of, args.chunksize,
+                       args.memory_limit_mb)
+    return 0 if (report['status'] == 'ok').all() else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# === RFMBenchmark.py: замеры скорости и памяти RFM-анализа ===
+# Генератор реалистичных «грязных» журналов транзакций и прогон RFM.main по стадиям
+# с результатами в JSON — чтобы сравнивать запуски между собой и ловить регрессии.
+#
+# Пример:
+#   python RFMBenchmark.py --sizes 10k 1M --encodings utf-8 cp1251 --output bench.json
+#   python RFMBenchmark.py --sizes 10k 1M --baseline bench.json --threshold 0.2
+#   python RFMBenchmark.py --sizes 1M --workers 1 4 16   # ускорение параллельной очистки по числу ядер
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import RFM
+from Metrics import Metrics
+
+# --- Настройки генератора ---
+GENERATOR_CHUNK_ROWS = 500_000  # Файл пишется кусками — 10M строк не держим в памяти целиком
+CLIENTS_PER_ROW = 0.05  # Клиентов в среднем на строку журнала (20 покупок на клиента)
+DATE_RANGE_DAYS = 730
+# Грязные значения: числа словами, мусор, отрицательные и пустые суммы, плохие даты
+DIRTY_AMOUNTS = ['five', 'twenty one', 'one hundred', 'abc', '', '-15', 'NULL', '1 000']
+DIRTY_DATES = ['bad date', '', '31/31/2024', '2024-13-01', 'вчера']
+# Столбцы: латиница для UTF-8, кириллица — чтобы проверить однобайтовые кодировки
+COLUMN_NAMES = {'latin': ['client', 'amount', 'date'], 'cyrillic': ['клиент', 'сумма', 'дата']}
+# Стадии RFM.main в порядке выполнения
+STAGES = ['detect_encoding', 'read_csv', 'validate_columns', 'clean_data', 'aggregate', 'analyze', 'results']
+# Порог регрессии по умолчанию: на 20% медленнее или тяжелее базового запуска
+DEFAULT_THRESHOLD = 0.2
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000, '250000' -> 250000."""
+    text = str(text).strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if multiplier > 1 else text) * multiplier)
+
+
+def format_phones(numbers, rng):
+    """Один и тот же номер в разных написаниях: 8 (916) ..., +7 916 ..., 8916..., +7-916-..."""
+    digits = pd.Series(numbers).astype(str).str.zfill(7)
+    a, b, c = digits.str[:3], digits.str[3:5], digits.str[5:]
+    variants = ['8 (916) ' + a + '-' + b + '-' + c, '+7 916 ' + a + ' ' + b + ' ' + c, '8916' + digits,
+                '+7-916-' + a + '-' + b + '-' + c]
+    choice = rng.integers(0, len(variants), len(numbers))
+    return np.select([choice == i for i in range(len(variants))], [variant.to_numpy() for variant in variants])
+
+
+def generate_transactions(path, rows, dirty_ratio=0.05, encoding='utf-8', seed=0, as_of_date='2025-01-01'):
+    """Пишет детерминированный CSV-журнал транзакций: телефоны в разных форматах, суммы (иногда словами),
+       даты за два года до as_of_date. Доля dirty_ratio значений в каждом столбце испорчена."""
+    clients = max(1, int(rows * CLIENTS_PER_ROW))
+    columns = COLUMN_NAMES['latin' if encoding.lower().startswith('utf') else 'cyrillic']
+    end = np.datetime64(as_of_date, 'D')
+    written = 0
+    with open(path, 'w', encoding=encoding, newline='') as file:
+        file.write(','.join(columns) + '\n')
+        for part, start in enumerate(range(0, rows, GENERATOR_CHUNK_ROWS)):
+            n = min(GENERATOR_CHUNK_ROWS, rows - start)
+            rng = np.random.default_rng([seed, part])  # Свой поток на кусок — результат не зависит от размера куска
+            # Покупатели распределены неравномерно: у «хвоста» мало покупок, у ядра — много
+            numbers = (rng.pareto(1.2, n) * clients / 10).astype(np.int64) % clients
+            amounts = np.round(rng.lognormal(7, 1, n), 2).astype(str).astype(object)
+            dates = (end - rng.integers(0, DATE_RANGE_DAYS, n).astype('timedelta64[D]')).astype(str).astype(object)
+
+            dirty = rng.random((2, n)) < dirty_ratio
+            amounts[dirty[0]] = rng.choice(DIRTY_AMOUNTS, dirty[0].sum())
+            dates[dirty[1]] = rng.choice(DIRTY_DATES, dirty[1].sum())
+
+            chunk = pd.DataFrame({columns[0]: format_phones(numbers, rng), columns[1]: amounts, columns[2]: dates})
+            chunk.to_csv(file, header=False, index=False)
+            written += n
+    return written
+
+
+def run_pipeline(file_path, as_of_date=None, measure_memory=True, workers=None):
+    """Прогоняет RFM.main с замерами стадий и возвращает время (и пик памяти) каждой стадии.
+       Пик памяти стадии — прирост над памятью на её старте, общий пик — максимум по стадиям."""
+    metrics = Metrics(memory='tracemalloc' if measure_memory else None)
+    result = RFM.main(file_path, as_of_date=as_of_date, metrics=metrics, workers=workers)
+    report = result['metrics']
+    stages = {}
+    for record in report['stages']:
+        stages[record['stage']] = {'seconds': record['seconds'], 'cpu_seconds': record['cpu_seconds']}
+        if measure_memory:
+            stages[record['stage']]['peak_mb'] = record['peak_mb']
+    return {'rows': result.get('rows_read', 0), 'ok': bool(result['result_text']), 'stages': stages,
+            'seconds': report['total']['seconds'], 'peak_mb': report['total']['peak_mb']}
+
+
+def run_case(rows, dirty_ratio, encoding, repeat=3, seed=0, workdir=None, measure_memory=True, workers=None):
+    """Генерирует файл и прогоняет его repeat раз; в результат идёт медиана по каждой стадии.
+       tracemalloc в разы замедляет Python-код, поэтому память меряется отдельным, последним прогоном."""
+    with tempfile.TemporaryDirectory(dir=workdir) as directory:
+        path = os.path.join(directory, f'bench_{rows}_{encoding}.csv')
+        generate_transactions(path, rows, dirty_ratio, encoding, seed)
+        runs = [run_pipeline(path, '2025-01-01', False, workers) for _ in range(repeat)]
+        memory_run = run_pipeline(path, '2025-01-01', True, workers) if measure_memory else None
+
+    def median(values):
+        values = [value for value in values if value is not None]
+        return float(np.median(values)) if values else None
+
+    stages = {}
+    for name in STAGES:
+        measured = [run['stages'][name] for run in runs if name in run['stages']]
+        if measured:
+            stages[name] = {key: median([m.get(key) for m in measured]) for key in measured[0]}
+            if memory_run and name in memory_run['stages']:
+                stages[name]['peak_mb'] = memory_run['stages'][name]['peak_mb']
+    # Число процессов входит в имя, только если задано, — имена прежних запусков для сравнения не меняются
+    name = f'rows={rows},dirty={dirty_ratio},encoding={encoding}' + (f',workers={workers}' if workers else '')
+    return {'name': name, 'rows': rows, 'dirty_ratio': dirty_ratio,
+            'encoding': encoding, 'workers': workers, 'repeat': repeat, 'ok': all(run['ok'] for run in runs), 'stages': stages,
+            'seconds': median([run['seconds'] for run in runs]), 'peak_mb': memory_run['peak_mb'] if memory_run else None,
+            'rows_per_second': rows / median([run['seconds'] for run in runs])}
+
+
+def add_speedups(cases):
+    """Ускорение каждого случая относительно того же файла с одним процессом: всего прогона и стадии clean_data."""
+    single = {(case['rows'], case['dirty_ratio'], case['encoding']): case for case in cases if case['workers'] == 1}
+    for case in cases:
+        base = single.get((case['rows'], case['dirty_ratio'], case['encoding']))
+        if base is None or not case['workers']:
+            continue
+        case['speedup'] = base['seconds'] / case['seconds']
+        if 'clean_data' in case['stages'] and 'clean_data' in base['stages']:
+            case['clean_speedup'] = base['stages']['clean_data']['seconds'] / case['stages']['clean_data']['seconds']
+        case['efficiency'] = case['speedup'] / min(case['workers'], os.cpu_count() or 1)
+
+
+def environment():
+    """Окружение запуска — чтобы сравнивать результаты с одной и той же машины."""
+    return {'timestamp': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'numpy': np.__version__,
+            'pandas': pd.__version__}
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Сравнивает результаты с базовыми: регрессия — время или пик памяти стадии (или всего прогона)
+       выросли больше чем на threshold. Возвращает список регрессий."""
+    baseline_cases = {case['name']: case for case in baseline.get('cases', [])}
+    regressions = []
+    for case in results['cases']:
+        base = baseline_cases.get(case['name'])
+        if base is None:
+            continue
+        pairs = [('total', case, base)] + [(name, case['stages'][name], base['stages'][name])
+                                           for name in case['stages'] if name in base.get('stages', {})]
+        for stage, current, previous in pairs:
+            for metric in ('seconds', 'peak_mb'):
+                old, new = previous.get(metric), current.get(metric)
+                if old and new and new > old * (1 + threshold):
+                    regressions.append({'case': case['name'], 'stage': stage, 'metric': metric,
+                                        'baseline': old, 'current': new, 'change': new / old - 1})
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк RFM-анализа на синтетических данных.")
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k'], help="число строк: 10k, 1M, 10M...")
+    parser.add_argument('--dirty', type=float, nargs='+', default=[0.05], help="доля испорченных значений")
+    parser.add_argument('--encodings', nargs='+', default=['utf-8'], help="кодировки файлов (utf-8, cp1251, utf-16...)")
+    parser.add_argument('--repeat', type=int, default=3, help="прогонов на случай (берётся медиана)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[None],
+                        help="процессов для очистки; с 1 в списке считается ускорение относительно одного ядра")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="не замерять память (tracemalloc замедляет прогон)")
+    parser.add_argument('--workdir', default=None, help="где создавать временные файлы")
+    parser.add_argument('--output', default=None, help="куда записать JSON с результатами")
+    parser.add_argument('--baseline', default=None, help="JSON прошлого запуска для сравнения")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="допустимое ухудшение (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {'environment': environment(), 'cases': []}
+    for size in args.sizes:
+        for dirty_ratio in args.dirty:
+            for encoding in args.encodings:
+                for workers in args.workers:
+                    case = run_case(parse_size(size), dirty_ratio, encoding, args.repeat, args.seed, args.workdir,
+                                    not args.no_memory, workers)
+                    results['cases'].append(case)
+                    print(f"{case['name']}: {case['seconds']:.2f} с, {case['rows_per_second']:,.0f} строк/с"
+                          + (f", пик {case['peak_mb']:.1f} МБ" if case['peak_mb'] is not None else ""), file=sys.stderr)
+
+    add_speedups(results['cases'])
+    for case in results['cases']:
+        if 'speedup' in case:
+            print(f"{case['name']}: ускорение {case['speedup']:.2f}× (очистка {case.get('clean_speedup', 0):.2f}×), "
+                  f"эффективность {case['efficiency']:.0%}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            results['regressions'] = compare(results, json.load(file), args.threshold)
+        for regression in results['regressions']:
+            print(f"РЕГРЕССИЯ {regression['case']} / {regression['stage']} / {regression['metric']}: "
+                  f"{regression['baseline']:.3f} -> {regression['current']:.3f} ({regression['change']:+.0%})",
+                  file=sys.stderr)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output)
+    else:
+        print(output)
+    return 1 if results.get('regressions') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# === RFMCache.py: кэш результатов RFM-анализа ===
+# Повторная загрузка того же файла с теми же параметрами не запускает анализ заново:
+# результат (вместе с готовой картинкой графика) берётся с диска по хешу содержимого файла.
+
+import os
+import pickle
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import xxhash
+
+import Metrics
+import RFM
+
+# --- Настройки кэша ---
+CACHE_DIR = 'rfm_cache'
+CACHE_MAX_BYTES = 256 * 1024 * 1024  # Общий размер записей на диске; сверх него вытесняем давно не читанные
+CACHE_TTL_SECONDS = 24 * 60 * 60  # Сколько живёт запись
+# Меняется вместе с форматом результата или логикой анализа — старые записи тогда просто не находятся
+CACHE_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+# === Класс ResultCache ===
+# Дисковый кэш с вытеснением LRU по размеру и сроком жизни
+class ResultCache:
+    """Кэш результатов RFM.main на локальном диске: одна запись — один pickle-файл с именем-ключом.
+       Ключ — xxh3-128 от байтов файла и параметров анализа. Время последнего чтения хранится в mtime
+       файла записи, по нему и вытесняются записи, когда их общий размер превышает max_bytes.
+       Записи старше ttl_seconds считаются промахом и удаляются."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_path, **params):
+        """Ключ записи: хеш содержимого файла плюс параметры анализа (включая дату расчёта давности).
+           file_path — путь, bytes или файловый объект, как у RFM.main."""
+        digest = xxhash.xxh3_128()
+        with RFM.open_source(file_path, decompress=False) as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        digest.update(repr((CACHE_VERSION, sorted(params.items()))).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Результат по ключу или None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                entry = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self._count('misses')
+            return None
+
+        if time.time() - entry['created'] > self.ttl_seconds:
+            self._remove(path)
+            self._count('expired')
+            self._count('misses')
+            return None
+
+        os.utime(path)  # Отмечаем чтение — запись становится «свежей» для LRU
+        self._count('hits')
+        return entry['result']
+
+    def put(self, key, result):
+        """Сохраняет результат и при необходимости вытесняет старые записи."""
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump({'created': time.time(), 'result': result}, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))  # Атомарно: читатель не увидит недописанную запись
+        except OSError:
+            self._remove(temp_path)
+            return
+        self._count('stores')
+        self.evict()
+
+    def evict(self):
+        """Удаляет просроченные записи, затем самые давно читанные, пока размер не уложится в max_bytes."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.pkl'):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            # mtime не старше создания, так что давно не читанная запись старше TTL точно просрочена
+            if total <= self.max_bytes and now - mtime <= self.ttl_seconds:
+                continue
+            self._remove(path)
+            total -= size
+            self._count('evictions')
+
+    def info(self):
+        """Статистика: попадания, промахи, доля попаданий, число и объём записей."""
+        sizes = [entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.name.endswith('.pkl')]
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {**self.stats, 'hit_ratio': self.stats['hits'] / lookups if lookups else 0.0,
+                'entries': len(sizes), 'bytes': sum(sizes)}
+
+    def clear(self):
+        """Удаляет все записи."""
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                self._remove(entry.path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_default_cache = None
+
+
+def default_cache():
+    """Общий кэш процесса (создаётся при первом обращении)."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
+
+
+def main(file_path, as_of_date=None, chunksize=None, memory_limit_mb=None, cache=None, metrics=None, workers=None):
+    """RFM.main с кэшем: при попадании результат возвращается без анализа, иначе считается и сохраняется.
+       Сохраняются только успешные результаты — ошибки могут быть временными. Замеры metrics
+       не кэшируются: в отчёт попадает поиск в кэше и, при промахе, стадии анализа.
+       workers в ключ не входит: параллельная очистка даёт тот же результат."""
+    cache = cache or default_cache()
+    metrics = Metrics.resolve(metrics)
+    # Давность зависит от даты расчёта, поэтому «сегодня» тоже входит в ключ
+    as_of = str(as_of_date or datetime.now().date())
+
+    def lookup():
+        # Хеширование файла и чтение записи с диска — одна стадия: обе входят в цену попадания
+        key = cache.make_key(file_path, as_of_date=as_of, chunksize=chunksize, memory_limit_mb=memory_limit_mb)
+        return key, cache.get(key)
+
+    key, result = metrics.run('cache_lookup', lookup)
+    if result is not None:
+        return {**result, 'metrics': metrics.report(), 'cache_hit': True}
+
+    result = RFM.main(file_path, as_of_date=as_of, chunksize=chunksize, memory_limit_mb=memory_limit_mb,
+                      metrics=metrics, workers=workers)
+    if result.get('result_text'):
+        cache.put(key, {name: value for name, value in result.items() if name != 'metrics'})
+    return {**result, 'cache_hit': False}
@@ -0,0 +1,430 @@
+# === RFMChunked.py: RFM-анализ файлов, которые не помещаются в память ===
+# Файл читается чанками, покупки копятся в агрегатах по клиентам (со сбросом на диск, если
+# они перерастают лимит памяти), а границы квинтилей R/F/M считаются по скетчам KLL.
+
+import glob
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from Diagnostics import Diagnostics, FILE_SOURCE, ANALYSIS_SOURCE
+from RFM import (FileProcessor, RFMAnalyzer, RFMScorer, ResultPresenter, SEGMENTS, SCORE_COLUMNS, CSV_CHUNK_SIZE,
+                 to_naive_datetime)
+
+# --- Настройки потокового режима ---
+# Лимит памяти под агрегаты клиентов (МБ) и число хеш-разделов при сбросе на диск
+DEFAULT_MEMORY_LIMIT_MB = 256
+SPILL_PARTITIONS = 16
+# Раздел, который и после слияния не влезает в лимит, делится заново с другим ключом хеша — не глубже стольких уровней
+MAX_SPILL_DEPTH = 2
+# Точность скетча: ошибка ранга ≈ 2.446 / k^0.9433 (≈1.65% при k=200, 99% доверия)
+SKETCH_K = 200
+
+# Как сливать частичные агрегаты клиентов из разных чанков
+AGGREGATE_OPERATIONS = {'rows': 'sum', 'last_date': 'max', 'recency': 'min', 'recency_missing': 'sum',
+                        'frequency': 'sum', 'frequency_missing': 'sum', 'amount': 'sum', 'amount_missing': 'sum'}
+# Ошибки чтения и разбора файла; всё остальное — ошибка самого анализа, её не выдаём за плохой файл
+# (ParserError, UnicodeDecodeError и ошибки pyarrow — подклассы ValueError и OSError)
+READ_ERRORS = (OSError, ValueError, EOFError, zipfile.BadZipFile)
+
+
+# === Класс QuantileSketch ===
+# Приближённые квантили за O(k·log(n/k)) памяти
+class QuantileSketch:
+    """Скетч KLL: хранит выборку значений по уровням, элемент уровня h «весит» 2^h.
+       Скетчи можно сливать (merge), а ошибка ранга любого квантиля не превышает rank_error()
+       с вероятностью 99%. Пока значений меньше k, квантили точные."""
+
+    def __init__(self, k=SKETCH_K, seed=None):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        """Добавляет пачку значений (NaN пропускаются)."""
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        """Вливает в скетч другой скетч с тем же k."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def quantiles(self, qs):
+        """Приближённые квантили; 0 и 1 — точные минимум и максимум."""
+        qs = np.asarray(qs, dtype='float64')
+        if not self.count:
+            return np.full(qs.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items_), 2.0 ** level) for level, items_ in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, cumulative = items[order], np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, qs * cumulative[-1], side='left')
+        result = items[np.clip(positions, 0, len(items) - 1)]
+        result[qs <= 0] = self.min
+        result[qs >= 1] = self.max
+        return result
+
+    def quantile(self, q):
+        """Один приближённый квантиль."""
+        return float(self.quantiles([q])[0])
+
+    def unique_count(self):
+        """Число различных значений в скетче (точное, пока значений меньше k)."""
+        return len(np.unique(np.concatenate(self.levels)))
+
+    def rank_error(self):
+        """Нормированная ошибка ранга (доля от числа значений) для этого k."""
+        return 0.0 if self.count <= self.k else 2.446 / self.k ** 0.9433
+
+    def _capacity(self, level):
+        """Вместимость уровня: верхний держит k элементов, каждый ниже — в 2/3 раза меньше."""
+        depth = len(self.levels)
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (depth - level - 1))))
+
+    def _compress(self):
+        """Переполненные уровни уплотняются: из отсортированных элементов на уровень выше уходит каждый второй."""
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                # При нечётном числе один элемент остаётся на своём уровне
+                keep, items = (items[-1:], items[:-1]) if len(items) % 2 else (np.empty(0), items)
+                offset = self._rng.integers(2)
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[offset::2]])
+                self.levels[level] = keep
+            level += 1
+
+
+# === Класс CustomerAggregates ===
+# Агрегаты клиентов с ограниченной памятью
+class CustomerAggregates:
+    """Копит частичные агрегаты клиентов из чанков и периодически сливает их.
+       Если агрегаты перерастают половину memory_limit_mb, они сбрасываются на диск
+       в partitions хеш-разделов по client_id; каждый раздел потом сливается отдельно.
+       per_row=True — строки не сворачиваются (индекс — номер строки файла), только копятся и сбрасываются."""
+
+    def __init__(self, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, partitions=SPILL_PARTITIONS, per_row=False):
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.partitions = partitions
+        self.per_row = per_row
+        self.pending = []  # Частичные агрегаты в памяти (индекс — client_id)
+        self.pending_bytes = 0
+        self.spill_dir = None
+        self.spill_count = 0
+
+    @property
+    def spilled(self):
+        return self.spill_dir is not None
+
+    def add(self, frame):
+        """Добавляет агрегаты очередного чанка."""
+        self.pending.append(frame)
+        self.pending_bytes += frame.memory_usage(index=True, deep=True).sum()
+        if self.pending_bytes > self.memory_limit / 2:
+            merged = self._combine(self.pending)
+            merged_bytes = merged.memory_usage(index=True, deep=True).sum()
+            if merged_bytes > self.memory_limit / 2:
+                self._spill(merged)
+                self.pending, self.pending_bytes = [], 0
+            else:
+                self.pending, self.pending_bytes = [merged], merged_bytes
+
+    def iter_partitions(self):
+        """Отдаёт окончательные агрегаты по разделам (без сброса — один раздел из памяти)."""
+        if not self.spilled:
+            if self.pending:
+                yield self._combine(self.pending)
+            return
+        if self.pending:
+            self._spill(self._combine(self.pending))
+            self.pending, self.pending_bytes = [], 0
+        yield from self._iter_directory(self.spill_dir, depth=0)
+
+    def _iter_directory(self, directory, depth):
+        """Сливает разделы каталога по одному файлу. Если раздел перерастает половину лимита,
+           он делится заново (другой ключ хеша, подкаталог), а не собирается в памяти целиком."""
+        for partition in range(self.partitions):
+            paths = sorted(glob.glob(os.path.join(directory, f'part-{partition:03d}-*.pkl')))
+            if not paths:
+                continue
+            merged = None
+            for number, path in enumerate(paths):
+                frame = pd.read_pickle(path)
+                merged = frame if merged is None else self._combine([merged, frame])
+                if (depth < MAX_SPILL_DEPTH and number + 1 < len(paths)
+                        and merged.memory_usage(index=True, deep=True).sum() > self.memory_limit / 2):
+                    merged = None
+                    yield from self._iter_directory(self._resplit(directory, partition, paths, depth + 1), depth + 1)
+                    break
+            if merged is not None:
+                yield merged
+
+    def cleanup(self):
+        """Удаляет временные файлы."""
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+    def _resplit(self, directory, partition, paths, depth):
+        """Делит файлы раздела на подразделы по хешу с ключом уровня depth; возвращает их каталог."""
+        subdirectory = os.path.join(directory, f'split-{partition:03d}')
+        os.makedirs(subdirectory)
+        for path in paths:
+            self._spill(pd.read_pickle(path), subdirectory, depth)
+            os.remove(path)
+        return subdirectory
+
+    def _spill(self, frame, directory=None, depth=0):
+        """Раскладывает агрегаты по хеш-разделам client_id в отдельные файлы."""
+        if directory is None:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix='rfm_spill_')
+            directory = self.spill_dir
+        # На каждом уровне деления свой ключ хеша (16 символов), иначе подразделы повторили бы раздел
+        hash_key = f'rfm-spill-{depth:06d}' if depth else '0123456789123456'
+        partition_ids = pd.util.hash_array(frame.index.to_numpy(dtype=object), hash_key=hash_key) % self.partitions
+        for partition, part in frame.groupby(partition_ids, sort=False):
+            part.to_pickle(os.path.join(directory, f'part-{partition:03d}-{self.spill_count:05d}.pkl'))
+        self.spill_count += 1
+
+    def _combine(self, frames):
+        """Сливает частичные агрегаты одного и того же клиента (построчные — просто склеивает)."""
+        frame = pd.concat(frames) if len(frames) > 1 else frames[0]
+        if self.per_row:
+            return frame
+        operations = {column: AGGREGATE_OPERATIONS[column] for column in frame.columns}
+        return frame.groupby(level=0, sort=False).agg(operations)
+
+
+# === Класс ChunkedRFM ===
+# Потоковый RFM-анализ с ограниченной памятью
+class ChunkedRFM:
+    """RFM-анализ за один проход по файлу. Пик памяти задаётся настройками — примерно chunksize строк
+       плюс memory_limit_mb под агрегаты клиентов, — а не размером файла.
+       Файл с датами сворачивается по клиентам, как aggregate_transactions в RFM.main; файл без дат,
+       как и в RFM.main, оценивается построчно — каждая строка отдельная запись.
+       Пока агрегаты помещаются в память, квинтили точные, как в RFM.main. После сброса на диск
+       квинтили берутся из скетчей KLL (ошибка ранга — см. QuantileSketch.rank_error),
+       а медианы для заполнения пропусков — всегда из скетчей. После сброса равные Frequency уже не
+       разводятся по порядку строк, как rank(method='first') в RFM.main, — при частых повторах
+       (например, без столбца частоты) оценки F заметно расходятся."""
+
+    def __init__(self, chunksize=CSV_CHUNK_SIZE, memory_limit_mb=None, partitions=SPILL_PARTITIONS,
+                 sketch_k=SKETCH_K, as_of_date=None):
+        self.chunksize = chunksize
+        self.memory_limit_mb = memory_limit_mb or DEFAULT_MEMORY_LIMIT_MB
+        self.partitions = partitions
+        self.sketch_k = sketch_k
+        self.as_of = pd.Timestamp(as_of_date or datetime.now().date()).normalize()
+        self.diagnostics = Diagnostics()
+        self.processor = FileProcessor(self.diagnostics)
+        self.analyzer = RFMAnalyzer(self.diagnostics)
+        self.presenter = ResultPresenter()
+
+    def run(self, file_path):
+        """Проводит анализ и возвращает результат в том же виде, что и RFM.main."""
+        processor = self.processor
+        self.diagnostics.clear()
+        self.diagnostics.note(f"\n Анализ файла:\n")
+        store = None
+        self.value_sketches = {}
+        self.issues = {'invalid_dates': 0, 'negative_recency': 0, 'negative_amount': 0, 'negative_frequency': 0}
+        chunks = processor.iter_table_chunks(file_path, self.chunksize)
+        try:
+            while True:
+                # Ловим только ошибки чтения: сбой в агрегации — не «плохой файл», он должен быть виден
+                try:
+                    chunk = next(chunks, None)
+                except READ_ERRORS as e:
+                    self.diagnostics.note(f"• Ошибка чтения файла: {e}\n")
+                    return self._result()
+                if chunk is None:
+                    break
+                if store is None:
+                    chunk = processor.validate_columns(chunk)
+                    if chunk is None:
+                        return self._result()
+                    self.parse_dates = 'date' in chunk.columns and 'recency' not in chunk.columns
+                    # Без дат RFM.main не сворачивает строки по клиентам — и мы не сворачиваем
+                    store = CustomerAggregates(self.memory_limit_mb, self.partitions, per_row=not self.parse_dates)
+                else:
+                    chunk = processor.apply_column_mapping(chunk)
+                store.add(self._aggregate_chunk(chunk, per_row=store.per_row))
+            if store is None or not processor.check_read_stats():
+                return self._result()
+            return self._finish(store, file_path)
+        finally:
+            chunks.close()
+            if store is not None:
+                store.cleanup()
+
+    def _aggregate_chunk(self, chunk, per_row=False):
+        """Чистит чанк построчно и сворачивает его в частичные агрегаты по клиентам.
+           per_row=True — без свёртки: строка с ID клиента остаётся записью с индексом — номером строки файла."""
+        chunk = self.processor.convert_columns(chunk, self.parse_dates)
+        part = {'client_id': chunk['client_id'], 'rows': 1}
+        if self.parse_dates:
+            invalid_dates = chunk['date'].isna()
+            self.issues['invalid_dates'] += int(invalid_dates.sum())
+            chunk = chunk[~invalid_dates]
+            part = {'client_id': chunk['client_id'], 'rows': 1, 'last_date': to_naive_datetime(chunk['date'])}
+
+        for column in ('recency', 'frequency', 'amount'):
+            if column not in chunk.columns or (column == 'recency' and self.parse_dates):
+                continue
+            values = chunk[column]
+            missing = values.isna()
+            # Медиану для пропусков считаем по исходным значениям, до исправления отрицательных
+            self.value_sketches.setdefault(column, QuantileSketch(self.sketch_k)).update(values[~missing])
+            self.issues[f'negative_{column}'] += int((values < 0).sum())
+            part[column] = values.clip(lower=0)
+            part[f'{column}_missing'] = missing.astype('int64')
+
+        frame = pd.DataFrame(part)
+        if per_row:
+            # Как finalize_columns: строки без ID клиента выбрасываются
+            return frame[frame['client_id'].notna()].drop(columns='client_id')
+        operations = {column: AGGREGATE_OPERATIONS[column] for column in frame.columns if column != 'client_id'}
+        return frame.groupby('client_id', sort=False).agg(operations)
+
+    def _finish(self, store, file_path):
+        """Достраивает R/F/M по агрегатам, считает квинтили и сегменты."""
+        medians = {column: sketch.quantile(0.5) for column, sketch in self.value_sketches.items()}
+        self._report_issues(medians)
+
+        rfm_sketches = {column: QuantileSketch(self.sketch_k) for column, _, _ in SCORE_COLUMNS}
+        finals = []
+        customers_total, rows_total = 0, self.processor.read_stats['rows']
+        for partition, aggregates in enumerate(store.iter_partitions()):
+            customers = self._customers(aggregates, medians)
+            if 'amount' not in customers.columns:
+                self.diagnostics.note("• Анализ невозможен: отсутствуют столбцы Monetary\n", ANALYSIS_SOURCE)
+                return self._result()
+            customers_total += len(customers)
+            if store.spilled:
+                # Раздел уже на диске — сохраняем итог рядом и держим в памяти только скетчи
+                for column, measure in (('Recency', 'recency'), ('Frequency', 'frequency'), ('Monetary', 'amount')):
+                    rfm_sketches[column].update(customers[measure])
+                path = os.path.join(store.spill_dir, f'final-{partition:03d}.pkl')
+                customers.to_pickle(path)
+                finals.append(path)
+            else:
+                finals.append(customers)
+
+        self.diagnostics.note(f"Потоковый режим: {rows_total} строк → {customers_total} клиентов, "
+                              f"сброс на диск: {'да' if store.spilled else 'нет'}\n")
+        if not customers_total:
+            self.diagnostics.note("• Данные пусты после очистки. Анализ невозможен\n")
+            return self._result()
+
+        if not store.spilled:
+            # Всё поместилось в память — считаем точно, как RFM.main
+            rfm = self.analyzer.analyze(finals[0])
+            self.presenter.generate_results(rfm, file_path)
+            return self._result(done=True)
+
+        # Квинтили — по скетчам, затем второй проход по разделам: оценки, сегменты и суммы
+        scorer = RFMScorer(diagnostics=self.diagnostics)
+        for column, _, _ in SCORE_COLUMNS:
+            sketch = rfm_sketches[column]
+            scorer.edges[column] = scorer.edges_from_quantiles(
+                column, lambda n_bins, sketch=sketch: sketch.quantiles(np.linspace(0, 1, n_bins + 1)),
+                sketch.unique_count())
+        self.diagnostics.note(f"Квинтили посчитаны приближённо: ошибка ранга до "
+                              f"{rfm_sketches['Monetary'].rank_error():.2%}\n", ANALYSIS_SOURCE)
+
+        counts = np.zeros(len(SEGMENTS))
+        totals = np.zeros(len(SEGMENTS))
+        for path in finals:
+            customers = pd.read_pickle(path).rename(
+                columns={'recency': 'Recency', 'frequency': 'Frequency', 'amount': 'Monetary'})
+            rfm = scorer.transform(customers)
+            codes = np.asarray(self.analyzer.lookup_segments(rfm).codes)
+            counts += np.bincount(codes, minlength=len(SEGMENTS))
+            totals += np.bincount(codes, weights=rfm['Monetary'].to_numpy(), minlength=len(SEGMENTS))
+
+        # Та же сводка, что даёт ResultPresenter.summarize, только собранная из сумм по разделам
+        summary = pd.DataFrame({'Количество клиентов': counts.astype('int64'),
+                                'Средний чек': np.divide(totals, counts, out=np.zeros_like(totals), where=counts > 0),
+                                'Общий чек': totals}, index=pd.CategoricalIndex(SEGMENTS, categories=SEGMENTS, name='Сегмент'))
+        self.presenter.render_results(summary.round(2), file_path)
+        return self._result(done=True)
+
+    def _customers(self, aggregates, medians):
+        """Окончательные Recency/Frequency/Monetary клиентов: пропуски заполняются медианами строк."""
+        customers = pd.DataFrame(index=aggregates.index)
+        if self.parse_dates:
+            customers['recency'] = (self.as_of - aggregates['last_date'].dt.normalize()).dt.days.clip(lower=0)
+        elif 'recency' in aggregates.columns:
+            fill = max(medians.get('recency', np.nan), 0)
+            recency = aggregates['recency']
+            customers['recency'] = recency.where(aggregates['recency_missing'] == 0, np.fmin(recency, fill))
+
+        # В построчном режиме пропуск остаётся NaN (при свёртке sum его уже пропустил) — обнуляем до добавления медианы
+        if 'frequency' in aggregates.columns:
+            customers['frequency'] = (aggregates['frequency'].fillna(0) +
+                                      aggregates['frequency_missing'] * max(medians.get('frequency', np.nan), 0))
+        else:
+            customers['frequency'] = aggregates['rows']  # Без столбца частоты — число покупок
+        if 'amount' in aggregates.columns:
+            customers['amount'] = (aggregates['amount'].fillna(0) +
+                                   aggregates['amount_missing'] * max(medians.get('amount', np.nan), 0))
+
+        customers = customers.dropna()
+        return customers.rename_axis('client_id').reset_index()
+
+    def _report_issues(self, medians):
+        """Пишет сводку проблем в данных — как clean_data, но по всему файлу сразу."""
+        issues = []
+        if self.issues['invalid_dates']:
+            issues.append(f"Удалено {self.issues['invalid_dates']} строк с некорректными датами")
+        names = {'recency': ('Recency', 'отрицательной давностью'), 'amount': ('Monetary', 'отрицательными суммами'),
+                 'frequency': ('Frequency', 'отрицательной частотой')}
+        for column, sketch in self.value_sketches.items():
+            title, negative_text = names[column]
+            missing = self.processor.read_stats['rows'] - self.issues['invalid_dates'] - sketch.count
+            if missing > 0:
+                issues.append(f"Заполнено {missing} пропусков в {title} медианой (≈{medians[column]})")
+            if self.issues[f'negative_{column}']:
+                issues.append(f"Исправлено {self.issues[f'negative_{column}']} строк с {negative_text}")
+        if issues:
+            self.diagnostics.note("Проблемы в данных\n" + "\n".join([f"• {issue}" for issue in issues]) + "\n")
+
+    def _result(self, done=False):
+        """Результат в формате RFM.main."""
+        return {
+            'errors': self.diagnostics.render(),
+            'corrections': self.diagnostics.render(FILE_SOURCE),
+            'plot_path': self.presenter.plot_path if done else "",
+            'plot_bytes': self.presenter.plot_bytes if done else b"",
+            'result_text': self.presenter.result_text if done else "",
+            'result_table': self.presenter.result_table if done else "",
+            'summary': self.presenter.summary if done else None,
+            'diagnostics': self.diagnostics.summary(),
+            'rows_read': self.processor.read_stats['rows'] if done else 0,
+            'preview': self.processor.preview
+        }
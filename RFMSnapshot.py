@@ -0,0 +1,253 @@
+# === RFMSnapshot.py: инкрементальный RFM-анализ по снимкам ===
+# Снимок хранит агрегаты клиентов (дата последней покупки, число покупок, сумма), их оценки и границы квинтилей.
+# Новый файл с транзакциями (дельта) вливается в снимок: оценки пересчитываются только у клиентов из дельты
+# по сохранённым границам, а вся таблица переоценивается лишь при явном refit или когда группы заметно
+# разъехались по численности (см. SNAPSHOT_DRIFT_TOLERANCE).
+
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from Diagnostics import Diagnostics, FILE_SOURCE, ANALYSIS_SOURCE
+from RFM import (FileProcessor, RFMAnalyzer, RFMScorer, ResultPresenter, SEGMENTS, SCORE_COLUMNS, SCORE_DTYPE,
+                 measure_values)
+
+# Папка для снимков пользователей бота
+SNAPSHOT_DIR = 'snapshots'
+# Границы переучиваются, когда доля клиентов хотя бы в одной группе R/F/M ушла от доли на момент
+# обучения больше чем на столько (0.05 — на 5 процентных пунктов)
+SNAPSHOT_DRIFT_TOLERANCE = 0.05
+
+
+# === Класс RFMSnapshot ===
+# Агрегаты и оценки клиентов между загрузками
+class RFMSnapshot:
+    """Снимок RFM-анализа: таблица клиентов (индекс — client_id) со столбцами last_date, Frequency, Monetary,
+       оценками R/F/M и сегментом, плюс границы квинтилей, дата их обучения и численность групп.
+       Первый файл анализируется точно, как в RFM.main. Клиенты из дельт оцениваются по сохранённым границам
+       значений, как новые клиенты в RFMScorer.transform; границы давности привязаны к датам — с течением
+       времени они сдвигаются вместе с давностью всех клиентов, и оценки остальных клиентов не меняются.
+       Давность не хранится: она считается по last_date на нужную дату (см. recency)."""
+
+    def __init__(self, customers=None, scorer=None, as_of=None, edges_as_of=None, score_counts=None, fit_shares=None):
+        self.customers = customers
+        self.scorer = scorer
+        self.as_of = as_of
+        self.edges_as_of = edges_as_of if edges_as_of is not None else as_of  # Дата, на которую обучены границы
+        self.score_counts = score_counts  # Мера -> число клиентов в каждой группе при текущих границах
+        self.fit_shares = fit_shares  # Мера -> доли групп сразу после обучения границ
+        self.diagnostics = Diagnostics()
+        self.processor = FileProcessor(self.diagnostics)
+        self.analyzer = RFMAnalyzer(self.diagnostics)
+        self.presenter = ResultPresenter()
+        if customers is not None and score_counts is None:
+            self._count_scores()
+            self.fit_shares = self.shares()
+
+    @property
+    def empty(self):
+        return self.customers is None or self.customers.empty
+
+    def update(self, file_path, as_of_date=None, refit=False):
+        """Вливает файл транзакций в снимок (пустой снимок он создаёт) и возвращает результат в формате RFM.main.
+           refit=True после слияния переучивает границы по всем клиентам."""
+        self.diagnostics.clear()
+        self.diagnostics.note(f"\n Анализ файла:\n")
+        as_of = pd.Timestamp(as_of_date or datetime.now().date()).normalize()
+        delta = self.read_transactions(file_path, as_of)
+        if delta is None:
+            return self._result()
+
+        if self.empty:
+            self._build(delta, as_of)
+        else:
+            self._apply(delta, as_of, refit)
+        if self.customers is None:
+            return self._result()
+
+        self.presenter.generate_results(self.customers, file_path)
+        return self._result(done=True)
+
+    def read_transactions(self, file_path, as_of):
+        """Читает и чистит файл транзакций и сворачивает его по клиентам (client_id, date, frequency, amount)."""
+        processor = self.processor
+        df = processor.read_table(file_path)
+        if df is None:
+            return None
+        df = processor.validate_columns(df)
+        if df is None:
+            return None
+        df = processor.clean_data(df)
+        if df.empty:
+            return None
+
+        # Снимок держится на дате последней покупки — без дат давность не обновить
+        if 'date' not in df.columns or not pd.api.types.is_datetime64_any_dtype(df['date']):
+            self.diagnostics.note("• Инкрементальный анализ невозможен: в файле нет столбца с датами покупок\n",
+                                  ANALYSIS_SOURCE)
+            return None
+        if 'amount' not in df.columns:
+            self.diagnostics.note("• Анализ невозможен: отсутствуют столбцы Monetary\n", ANALYSIS_SOURCE)
+            return None
+        delta = self.analyzer.aggregate_transactions(df, as_of).set_index('client_id')
+        delta.index = delta.index.astype(object)  # Категориальный индекс не пережил бы слияния со снимком
+        return delta
+
+    @staticmethod
+    def recency(customers, as_of):
+        """Давность покупок клиентов на дату as_of, в днях."""
+        return (as_of - customers['last_date'].dt.normalize()).dt.days.clip(lower=0)
+
+    def scorer_as_of(self, as_of):
+        """Сохранённые границы на дату as_of: границы давности сдвинуты на дни, прошедшие с обучения."""
+        edges = dict(self.scorer.edges)
+        edges['Recency'] = np.asarray(edges['Recency'], dtype='float64') + (as_of - self.edges_as_of).days
+        return RFMScorer(self.scorer.n_bins, edges, self.diagnostics)
+
+    def shares(self):
+        """Доли клиентов по группам каждой меры при текущих границах."""
+        return {column: counts / max(counts.sum(), 1) for column, counts in self.score_counts.items()}
+
+    def drift(self):
+        """Насколько группы разъехались с момента обучения границ: наибольший сдвиг доли группы."""
+        shares = self.shares()
+        return max(float(np.abs(shares[column] - self.fit_shares[column]).max()) for column in shares)
+
+    def _build(self, delta, as_of):
+        """Первый снимок: точный анализ, как в RFM.main."""
+        rfm = self.analyzer.analyze(delta.reset_index())
+        if rfm is None:
+            return
+        # Снимок дополняется и суммируется — меры храним в полных типах, а не в компактных из analyze
+        customers = rfm.assign(Buyer=rfm['Buyer'].astype(object), Monetary=measure_values(rfm['Monetary']),
+                               Frequency=rfm['Frequency'].astype(np.result_type(rfm['Frequency'].dtype, np.int64)))
+        customers = customers.set_index('Buyer').drop(columns='Recency')
+        customers['last_date'] = delta['date']
+        self.customers = customers.rename_axis('client_id')
+        self.scorer = self.analyzer.scorer
+        self.as_of = self.edges_as_of = as_of
+        self._count_scores()
+        self.fit_shares = self.shares()
+
+    def _apply(self, delta, as_of, refit=False):
+        """Вливает агрегаты дельты в снимок и оценивает только клиентов из дельты — O(размер дельты),
+           пока границы не пришлось переучить."""
+        customers = self.customers
+        old_count = len(customers)
+        known = delta.index.isin(customers.index)
+
+        # Новые клиенты дописываются в конец, у старых складываются покупки и обновляется последняя дата
+        new_customers = delta.loc[~known]
+        if len(new_customers):
+            customers = pd.concat([customers, pd.DataFrame({
+                'last_date': new_customers['date'], 'Frequency': 0, 'Monetary': 0.0}, index=new_customers.index)])
+        changed = customers.index.get_indexer(delta.index)
+        columns = [customers.columns.get_loc(column) for column in ('last_date', 'Frequency', 'Monetary')]
+        last_date, frequency, monetary = (customers.iloc[changed, column] for column in columns)
+        customers.iloc[changed, columns[0]] = np.maximum(last_date.to_numpy(), delta['date'].to_numpy())
+        customers.iloc[changed, columns[1]] = frequency.to_numpy() + delta['frequency'].to_numpy()
+        customers.iloc[changed, columns[2]] = monetary.to_numpy() + delta['amount'].to_numpy()
+
+        # Оценки клиентов из дельты — по сохранённым границам; численность групп правим на разницу
+        rows = customers.iloc[changed]
+        measures = pd.DataFrame({'Recency': self.recency(rows, as_of), 'Frequency': rows['Frequency'],
+                                 'Monetary': rows['Monetary']})
+        scored = self.scorer_as_of(as_of).transform(measures)
+        was_known = changed < old_count
+        for column, score, _ in SCORE_COLUMNS:
+            n_bins = len(self.score_counts[column])
+            old_scores = customers[score].to_numpy()[changed[was_known]].astype(np.intp)
+            new_scores = scored[score].to_numpy()
+            self.score_counts[column] = (self.score_counts[column]
+                                         - np.bincount(old_scores - 1, minlength=n_bins)[:n_bins]
+                                         + np.bincount(new_scores.astype(np.intp) - 1, minlength=n_bins)[:n_bins])
+            if len(new_customers):
+                # concat дополнил строки новых клиентов NaN и сделал столбец float64 — возвращаем int8
+                customers[score] = customers[score].fillna(0).astype(SCORE_DTYPE)
+            customers.iloc[changed, customers.columns.get_loc(score)] = new_scores
+        if not isinstance(customers['Segment'].dtype, pd.CategoricalDtype):
+            customers['Segment'] = pd.Categorical(customers['Segment'], categories=SEGMENTS)
+        customers.iloc[changed, customers.columns.get_loc('Segment')] = self.analyzer.lookup_segments(scored)
+
+        self.customers, self.as_of = customers, as_of
+        self.diagnostics.note(f"Снимок обновлён: {len(delta)} клиентов в дельте, из них новых {len(new_customers)}; "
+                              f"пересчитано оценок: {len(changed)} из {len(customers)}\n", ANALYSIS_SOURCE)
+
+        drift = self.drift()
+        if refit or drift > SNAPSHOT_DRIFT_TOLERANCE:
+            reason = "по запросу" if refit else f"группы разъехались на {drift:.1%}"
+            self.refit(as_of)
+            self.diagnostics.note(f"Границы квинтилей переучены ({reason}): переоценены все {len(customers)} клиентов\n",
+                                  ANALYSIS_SOURCE)
+
+    def refit(self, as_of=None):
+        """Переучивает границы по всем клиентам на дату as_of и переоценивает всю таблицу — как RFM.main."""
+        as_of = as_of if as_of is not None else self.as_of
+        customers = self.customers
+        measures = pd.DataFrame({'Recency': self.recency(customers, as_of), 'Frequency': customers['Frequency'],
+                                 'Monetary': customers['Monetary']})
+        scorer = RFMScorer(diagnostics=self.diagnostics)
+        scored = scorer.fit_transform(measures)
+        for _, score, _ in SCORE_COLUMNS:
+            customers[score] = scored[score].to_numpy()
+        customers['Segment'] = self.analyzer.lookup_segments(scored)
+        self.scorer, self.as_of, self.edges_as_of = scorer, as_of, as_of
+        self._count_scores()
+        self.fit_shares = self.shares()
+
+    def _count_scores(self):
+        """Численность групп по столбцам оценок — полный проход, только при сборке, загрузке и переобучении."""
+        self.score_counts = {}
+        for column, score, _ in SCORE_COLUMNS:
+            n_bins = max(len(self.scorer.edges[column]) - 1, 1)
+            scores = self.customers[score].to_numpy().astype(np.intp)
+            self.score_counts[column] = np.bincount(scores - 1, minlength=n_bins)[:n_bins]
+
+    def save(self, path):
+        """Сохраняет снимок: таблицу клиентов, границы квинтилей и дату расчёта."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        pd.to_pickle({'customers': self.customers, 'edges': self.scorer.to_dict(), 'as_of': self.as_of,
+                      'edges_as_of': self.edges_as_of, 'score_counts': self.score_counts,
+                      'fit_shares': self.fit_shares}, path)
+
+    @classmethod
+    def load(cls, path):
+        """Загружает снимок; если файла нет — возвращает пустой снимок."""
+        if not os.path.exists(path):
+            return cls()
+        data = pd.read_pickle(path)
+        # Снимки прежнего формата хранили давность и переучивали границы на каждой дельте
+        customers = data['customers'].drop(columns='Recency', errors='ignore')
+        return cls(customers, RFMScorer.from_dict(data['edges']), data['as_of'], data.get('edges_as_of'),
+                   data.get('score_counts'), data.get('fit_shares'))
+
+    def _result(self, done=False):
+        """Результат в формате RFM.main."""
+        return {
+            'errors': self.diagnostics.render(),
+            'corrections': self.diagnostics.render(FILE_SOURCE),
+            'plot_path': self.presenter.plot_path if done else "",
+            'plot_bytes': self.presenter.plot_bytes if done else b"",
+            'result_text': self.presenter.result_text if done else "",
+            'result_table': self.presenter.result_table if done else "",
+            'summary': self.presenter.summary if done else None,
+            'diagnostics': self.diagnostics.summary(),
+            'preview': self.processor.preview
+        }
+
+
+def snapshot_path(user_id):
+    """Путь к снимку пользователя бота."""
+    return os.path.join(SNAPSHOT_DIR, f'rfm_{user_id}.pkl')
+
+
+def main(file_path, snapshot_file, as_of_date=None, refit=False):
+    """Вливает файл транзакций в снимок snapshot_file (создаёт его при первом вызове) и сохраняет снимок.
+       refit=True заодно переучивает границы квинтилей по всем клиентам."""
+    snapshot = RFMSnapshot.load(snapshot_file)
+    result = snapshot.update(file_path, as_of_date, refit)
+    if not snapshot.empty:
+        snapshot.save(snapshot_file)
+    return result
@@ -0,0 +1,124 @@
+# === VectorIndex.py: поиск рекомендаций в памяти процесса ===
+# Векторы каталога лежат в матрице NumPy (или memmap из .npy), ближайшие рекомендации ищутся
+# без базы данных. Модуль зависит только от NumPy: модель и PostgreSQL остаются в VectorSearch.py.
+
+import io
+import json
+import os
+
+import numpy as np
+
+
+# === Функция vector_literals ===
+# Текстовая запись векторов для pgvector
+def vector_literals(embeddings):
+    """Строки вида '[0.1,0.2,...]' для столбца VECTOR; форматирование — одним вызовом numpy на всю пачку."""
+    buffer = io.StringIO()
+    np.savetxt(buffer, embeddings, fmt='%.9g', delimiter=',')  # 9 знаков — float32 без потерь
+    return [f"[{line}]" for line in buffer.getvalue().splitlines()]
+
+# === Класс NumpyVectorIndex ===
+# Поиск рекомендаций в памяти процесса
+class NumpyVectorIndex:
+    """Нормированные векторы каталога в непрерывной матрице float32 (или memmap из .npy) и массивы
+       номеров строк по (язык, сегмент) и по языку. Ближайшие k — одно умножение матрицы на вектор
+       и argpartition. На нормированных векторах порядок совпадает с ORDER BY embedding <-> в pgvector."""
+
+    def __init__(self, rows, embeddings):
+        if len(rows) != len(embeddings):
+            raise ValueError("Число строк каталога и векторов не совпадает")
+        self.rows = [tuple(row) for row in rows]  # (segment, language, recommendation)
+        self.embeddings = embeddings
+        masks = {}
+        for position, (segment, language, _) in enumerate(self.rows):
+            masks.setdefault((language, segment), []).append(position)
+            masks.setdefault((language, None), []).append(position)
+        self.masks = {key: np.asarray(positions, dtype=np.intp) for key, positions in masks.items()}
+
+    @staticmethod
+    def normalize(embeddings):
+        """Построчно делит на L2-норму; нулевые векторы оставляет как есть."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        return np.ascontiguousarray(embeddings / np.where(norms > 0, norms, 1), dtype=np.float32)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Индекс из path (.npy) и описания строк рядом (.json). Возвращает (индекс, метаданные)."""
+        with open(os.path.splitext(path)[0] + '.json', 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        embeddings = np.load(path, mmap_mode='r' if mmap else None)
+        return cls(meta.pop('rows'), embeddings), meta
+
+    def save(self, path, **meta):
+        """Пишет матрицу в .npy и строки с метаданными (хеш каталога, версия модели) в .json.
+           Файлы подменяются через os.replace: открытый memmap прежнего индекса остаётся целым."""
+        meta_path = os.path.splitext(path)[0] + '.json'
+        with open(path + '.tmp', 'wb') as file:
+            np.save(file, np.ascontiguousarray(self.embeddings, dtype=np.float32))
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({**meta, 'rows': self.rows}, file, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def search(self, query_embedding, lang, segment=None, limit=3):
+        """Ближайшие рекомендации в том же виде, что и search_recommendations: (segment, recommendation, embedding)."""
+        positions = self.top_k(query_embedding, lang, segment, limit)
+        literals = vector_literals(np.asarray(self.embeddings[positions])) if len(positions) else []
+        return [(self.rows[i][0], self.rows[i][2], literal) for i, literal in zip(positions, literals)]
+
+    def top_k(self, query_embedding, lang, segment=None, limit=3):
+        """Номера строк k ближайших, по убыванию сходства."""
+        candidates = self.masks.get((lang, segment or None))
+        if candidates is None or limit <= 0:
+            return np.empty(0, dtype=np.intp)
+        scores = self.scores(query_embedding, candidates)
+        k = min(limit, len(candidates))
+        if k < len(candidates):
+            best = np.argpartition(-scores, k - 1)[:k]  # k лучших без полной сортировки
+        else:
+            best = np.arange(len(candidates))
+        return candidates[best[np.argsort(-scores[best], kind='stable')]]
+
+    def scores(self, query_embedding, positions):
+        """Косинусное сходство запроса со строками positions."""
+        query = self.normalize(np.asarray(query_embedding).reshape(1, -1))[0]
+        if len(positions) == len(self.rows):
+            return self.embeddings @ query
+        return self.embeddings[positions] @ query
+
+    def __len__(self):
+        return len(self.rows)
+
+
+# === Функция parity_query ===
+# Шаблонный запрос бота для сверки бэкендов
+def parity_query(lang, segment):
+    """Тот же запрос, что строит бот для сегмента (для языка без сегмента — про всех клиентов)."""
+    subject = segment.lower() if segment else 'clients'
+    return f"{'Рекомендации для' if lang == 'ru' else 'Recommendations for'} {subject} in a mass-market retail"
+
+# === Функция compare_backends ===
+# Сверка NumpyVectorIndex с другим бэкендом поиска
+def compare_backends(index, embed, sql_search, limit=3, tolerance=1e-4):
+    """Прогоняет parity_query по каждому (язык, сегмент) индекса и по каждому языку без сегмента через
+       sql_search(query_embedding, lang, segment, limit) -> строки (segment, recommendation, ...) и через индекс.
+       embed(query) — вектор запроса. Совпадением считается одинаковое сходство найденного на каждой позиции
+       (с точностью tolerance): рекомендации с равным сходством бэкенды могут вернуть в разном порядке.
+       Возвращает число проверенных запросов и список расхождений."""
+    positions = {(row[1], row[0], row[2]): i for i, row in enumerate(index.rows)}
+    checked, mismatches = 0, []
+    for lang, segment in sorted(index.masks, key=lambda key: (key[0], key[1] or '')):
+        query_embedding = embed(parity_query(lang, segment))
+        expected = index.top_k(query_embedding, lang, segment, limit)
+        rows = sql_search(query_embedding, lang, segment, limit)
+        found = [positions.get((lang, row[0], row[1])) for row in rows]
+        checked += 1
+        same = None not in found and len(found) == len(expected)
+        if same:
+            sql_scores = index.scores(query_embedding, np.asarray(found, dtype=np.intp))
+            same = np.allclose(sql_scores, index.scores(query_embedding, expected), atol=tolerance, rtol=0)
+        if not same:
+            mismatches.append({'lang': lang, 'segment': segment, 'sql': [row[1] for row in rows],
+                               'numpy': [index.rows[i][2] for i in expected]})
+    return {'checked': checked, 'mismatches': mismatches}
@@ -2,9 +2,23 @@
 # Этот файл отвечает за подключение к базе данных PostgreSQL, загрузку модели для создания
 # векторных представлений текста и поиск рекомендаций на основе запросов пользователя.
 
+import csv
+import hashlib
+import io
+import json
 import logging
+import os
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+import numpy as np
+from cachetools import LRUCache, TTLCache
 from sentence_transformers import SentenceTransformer
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from VectorIndex import NumpyVectorIndex, compare_backends, vector_literals
 from datetime import datetime
 import pytz
 from huggingface_hub import login
@@ -29,10 +43,67 @@ DB_PARAMS = {
     "port": 5432
 }
 
+# --- Параметры пула соединений ---
+# Соединения переиспользуются между запросами поиска: рукопожатие TCP и авторизация — только при создании
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+POOL_TIMEOUT_SECONDS = 10  # Сколько ждать свободного соединения, прежде чем сдаться
+HEALTH_CHECK_IDLE_SECONDS = 30  # Соединение, простоявшее дольше, проверяется запросом SELECT 1
+
+# --- Подготовленные запросы поиска ---
+# Готовятся один раз на соединение (PREPARE), дальше выполняются через EXECUTE без повторного разбора
+SEARCH_STATEMENTS = {
+    'find_by_segment': ("(text, text, vector, int)", """
+        SELECT segment, recommendation, embedding
+        FROM recommendations
+        WHERE segment = $1 AND language = $2
+        ORDER BY embedding <-> $3 LIMIT $4
+    """),
+    'find_all_segments': ("(text, vector, int)", """
+        SELECT segment, recommendation, embedding
+        FROM recommendations
+        WHERE language = $1
+        ORDER BY embedding <-> $2 LIMIT $3
+    """),
+}
+
+# --- Параметры кеша поиска ---
+# Запросы бота — шаблоны по (сегмент, язык), поэтому одни и те же векторы и строки нужны снова и снова
+EMBEDDING_CACHE_SIZE = 1024  # Векторов запросов в LRU
+RESULT_CACHE_SIZE = 4096  # Результатов поиска
+RESULT_CACHE_TTL_SECONDS = 10 * 60  # Страховка на случай пересборки таблицы другим процессом
+
+# --- Параметры каталога рекомендаций ---
+# Файл каталога (CSV: segment, language, recommendation) и размеры пачек при его загрузке
+RECOMMENDATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recommendations.csv')
+RECOMMENDATION_FIELDS = ('segment', 'language', 'recommendation')
+EMBEDDING_BATCH_SIZE = 256  # Текстов за один проход модели
+COPY_PAGE_SIZE = 5000  # Строк за один COPY в базу
+
+# --- Параметры модели и индекса рекомендаций ---
+# Версия модели хранится в базе вместе с хешем каталога: при её смене векторы пересчитываются.
+# EMBEDDING_REVISION увеличивается, если меняется способ получения векторов при той же модели
+# (2 — векторы нормируются: L2-расстояние pgvector и скалярное произведение в NumpyVectorIndex упорядочивают одинаково)
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+EMBEDDING_REVISION = 2
+MODEL_VERSION = f"{MODEL_NAME}#{EMBEDDING_REVISION}"
+# Новая таблица собирается рядом с рабочей и подменяет её переименованием в одной транзакции
+SHADOW_TABLE = 'recommendations_shadow'
+OLD_TABLE = 'recommendations_old'
+META_TABLE = 'recommendations_meta'
+
+# --- Бэкенд поиска ---
+# 'postgres' — pgvector в базе; 'numpy' — NumpyVectorIndex в памяти процесса, база не нужна
+SEARCH_BACKENDS = ('postgres', 'numpy')
+SEARCH_BACKEND = 'postgres'
+# Матрица векторов каталога и описание её строк; матрица открывается через memmap
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recommendations_index.npy')
+INDEX_MMAP = True
+
 # --- Загрузка модели SentenceTransformer ---
 # Попытка загрузки модели для создания векторных представлений текста
 try:
-    model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+    model = SentenceTransformer(MODEL_NAME)
     logger.info("Модель SentenceTransformer успешно загружена.")
 except Exception as e:
     logger.error(f"Ошибка загрузки модели SentenceTransformer: {e}")
@@ -50,144 +121,580 @@ def get_db_connection():
         logger.error(f"Ошибка подключения к базе данных: {e}")
         raise
 
+# === Класс ConnectionPool ===
+# Потокобезопасный пул соединений с проверкой здоровья и статистикой
+class ConnectionPool:
+    """Обёртка над psycopg2.pool.ThreadedConnectionPool. Семафор ограничивает число выданных соединений:
+       при исчерпании пула запрос ждёт до timeout секунд, а не падает с PoolError. Перед выдачей соединение
+       проверяется: закрытое или сломанное заменяется, а долго простоявшее — проверяется запросом SELECT 1."""
+
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT_SECONDS, **db_params):
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size, **(db_params or DB_PARAMS))
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self.timeout = timeout
+        self.min_size, self.max_size = min_size, max_size
+        self._last_used = {}  # id(соединения) -> время возврата в пул
+        self._prepared = set()  # id соединений, где уже выполнен PREPARE
+        self.stats = {'borrows': 0, 'in_use': 0, 'max_in_use': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                      'health_checks': 0, 'replaced': 0, 'timeouts': 0}
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула на время блока with. После ошибки соединения оно закрывается, а не возвращается."""
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count('timeouts')
+            raise psycopg2.pool.PoolError(f"Нет свободных соединений за {self.timeout} с")
+        waited = time.perf_counter() - started
+        conn, broken = None, False
+        try:
+            conn = self._borrow()
+            with self._lock:
+                self.stats['borrows'] += 1
+                self.stats['in_use'] += 1
+                self.stats['max_in_use'] = max(self.stats['max_in_use'], self.stats['in_use'])
+                self.stats['wait_seconds'] += waited
+                self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                self._release(conn, broken)
+            self._slots.release()
+
+    def prepare(self, conn):
+        """Готовит запросы SEARCH_STATEMENTS на соединении (один раз за его жизнь)."""
+        if id(conn) in self._prepared:
+            return
+        with conn.cursor() as cur:
+            for name, (types, query) in SEARCH_STATEMENTS.items():
+                cur.execute(f"PREPARE {name} {types} AS {query}")
+        conn.commit()
+        self._prepared.add(id(conn))
+
+    def info(self):
+        """Статистика пула: выдачи, занятые соединения, ожидание свободного соединения, замены сломанных."""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['avg_wait_seconds'] = stats['wait_seconds'] / stats['borrows'] if stats['borrows'] else 0.0
+        stats['min_size'], stats['max_size'] = self.min_size, self.max_size
+        return stats
+
+    def close(self):
+        self._pool.closeall()
+
+    def _borrow(self):
+        """Исправное соединение из пула. Замена сломанного проходит ту же проверку: после перезапуска сервера
+           в пуле могут быть мертвы все простаивающие соединения, поэтому попыток на одну больше размера пула."""
+        for _ in range(self.max_size + 1):
+            conn = self._pool.getconn()
+            if self._healthy(conn):
+                return conn
+            self._count('replaced')
+            self._discard(conn)
+        raise psycopg2.OperationalError(f"Нет исправных соединений после {self.max_size + 1} попыток")
+
+    def _healthy(self, conn):
+        """Дешёвая проверка по состоянию соединения; запрос к серверу — только после долгого простоя."""
+        if conn.closed or conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0.0) < HEALTH_CHECK_IDLE_SECONDS:
+            return True
+        self._count('health_checks')
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release(self, conn, broken):
+        if broken or conn.closed:
+            self._discard(conn)
+            return
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()  # Не оставляем открытых транзакций и блокировок у соединений в пуле
+        self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn)
+
+    def _discard(self, conn):
+        self._prepared.discard(id(conn))
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# === Функция get_pool ===
+# Общий пул соединений модуля
+def get_pool():
+    """Пул соединений для поиска (создаётся при первом обращении)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+# === Класс SearchCache ===
+# Двухуровневый кеш поиска: текст запроса -> вектор, вектор и фильтры -> строки
+class SearchCache:
+    """LRU векторов по нормализованному тексту запроса и TTL-кеш результатов по
+       (хеш вектора, язык, сегмент, limit). Результаты сбрасываются при пересборке таблицы
+       (clear_results); TTL ограничивает устаревание, если таблицу пересобрал другой процесс."""
+
+    def __init__(self, embedding_size=EMBEDDING_CACHE_SIZE, result_size=RESULT_CACHE_SIZE,
+                 result_ttl=RESULT_CACHE_TTL_SECONDS):
+        self.embeddings = LRUCache(maxsize=embedding_size)
+        self.results = TTLCache(maxsize=result_size, ttl=result_ttl)
+        self._lock = threading.Lock()  # cachetools не потокобезопасен
+        self.stats = {'embedding_hits': 0, 'embedding_misses': 0, 'result_hits': 0, 'result_misses': 0,
+                      'invalidations': 0}
+
+    @staticmethod
+    def normalize(query):
+        """Запросы, отличающиеся только пробелами или формой записи Unicode, дают один ключ."""
+        return " ".join(unicodedata.normalize('NFC', query).split())
+
+    @staticmethod
+    def result_key(embedding, lang, segment, limit):
+        return hashlib.sha1(embedding.tobytes()).hexdigest(), lang, segment, limit
+
+    def embedding(self, query):
+        """Вектор запроса (float32, только для чтения): из кеша или model.encode нормализованного текста."""
+        text = self.normalize(query)
+        with self._lock:
+            vector = self.embeddings.get(text)
+            self.stats['embedding_hits' if vector is not None else 'embedding_misses'] += 1
+        if vector is None:
+            # Кодируем вне блокировки: модель не должна останавливать попадания в других потоках
+            vector = np.asarray(model.encode(text), dtype=np.float32)
+            vector.flags.writeable = False
+            with self._lock:
+                self.embeddings[text] = vector
+        return vector
+
+    def get_results(self, key):
+        with self._lock:
+            rows = self.results.get(key)
+            self.stats['result_hits' if rows is not None else 'result_misses'] += 1
+        return rows
+
+    def put_results(self, key, rows):
+        with self._lock:
+            self.results[key] = tuple(rows)
+
+    def clear_results(self):
+        """Сбрасывает результаты; векторы запросов от содержимого таблицы не зависят и остаются."""
+        with self._lock:
+            self.results.clear()
+            self.stats['invalidations'] += 1
+
+    def info(self):
+        """Статистика: попадания и промахи обоих уровней, доли попаданий, число записей."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['embedding_entries'], stats['result_entries'] = len(self.embeddings), len(self.results)
+        for level in ('embedding', 'result'):
+            lookups = stats[f'{level}_hits'] + stats[f'{level}_misses']
+            stats[f'{level}_hit_ratio'] = stats[f'{level}_hits'] / lookups if lookups else 0.0
+        return stats
+
+
+search_cache = SearchCache()
+
+# === Каталог рекомендаций по умолчанию ===
+# Используется, если файла каталога RECOMMENDATIONS_FILE нет
+DEFAULT_RECOMMENDATIONS = [
+    # --- Рекомендации для VIP-клиентов (русский) ---
+    {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Запустите программу лояльности с кэшбэком для VIP-клиентов, предлагая 5–10% возврата на каждую покупку.'},
+    {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Предлагайте эксклюзивные купоны на популярные товары только для VIP-клиентов.'},
+    {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Отправьте push-уведомления с персонализированными предложениями для VIP-клиентов.'},
+    {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Организуйте розыгрыш подарочных карт среди VIP-клиентов.'},
+    {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Предоставьте приоритетную поддержку через чат для VIP-клиентов.'},
+    {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Создайте флеш-распродажи для VIP-клиентов с доступом к товарам по сниженным ценам.'},
+    # --- Рекомендации для VIP-клиентов (английский) ---
+    {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Launch a loyalty program with 5–10% cashback for VIP customers to encourage frequent purchases.'},
+    {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Offer exclusive coupons on popular products only for VIP customers.'},
+    {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Send personalized push notifications with offers tailored to VIP customers.'},
+    {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Organize a gift card raffle for VIP customers to boost engagement.'},
+    {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Provide priority support via chat for VIP customers.'},
+    {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Create flash sales for VIP customers with access to discounted products.'},
+
+    # --- Рекомендации для лояльных клиентов (русский) ---
+    {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Внедрите накопительную систему баллов, где клиенты зарабатывают бонусы за каждую покупку.'},
+    {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Отправьте email с предложением бесплатной доставки на следующий заказ.'},
+    {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Создайте реферальную программу с бонусами за приглашение друзей.'},
+    {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Проводите акции “2+1” для лояльных клиентов.'},
+    {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Добавьте персонализированные рекомендации товаров на сайте.'},
+    {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Организуйте опрос о предпочтениях с бонусом за участие.'},
+    # --- Рекомендации для лояльных клиентов (английский) ---
+    {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Introduce a points-based loyalty system where customers earn bonuses for each purchase.'},
+    {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Send an email offering free shipping on the next order.'},
+    {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Create a referral program with bonuses for inviting friends.'},
+    {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Run “2+1” promotions for loyal customers.'},
+    {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Add personalized product recommendations on the website.'},
+    {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Conduct a survey on preferences with a bonus for participation.'},
+
+    # --- Рекомендации для новых покупателей (русский) ---
+    {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Отправьте приветственный email с 10% скидкой на первый заказ.'},
+    {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Предложите бесплатный пробник популярного продукта при первой покупке.'},
+    {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Запустите рекламу в соцсетях с акцентом на бестселлеры.'},
+    {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Добавьте всплывающее окно с подпиской на рассылку в обмен на купон.'},
+    {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Упростите процесс регистрации и оформления заказа.'},
+    {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Создайте видеогид по магазину для новых покупателей.'},
+    # --- Рекомендации для новых покупателей (английский) ---
+    {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Send a welcome email with a 10% discount on the first order.'},
+    {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Offer a free sample of a popular product with the first purchase.'},
+    {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Launch social media ads focusing on bestsellers.'},
+    {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Add a pop-up for newsletter subscription in exchange for a coupon.'},
+    {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Simplify the registration and checkout process.'},
+    {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Create a video guide for the store for new customers.'},
+
+    # --- Рекомендации для рискующих клиентов (русский) ---
+    {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Отправьте email с напоминанием о брошенной корзине и 5% скидкой.'},
+    {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Запустите SMS-кампанию с ограниченным по времени предложением.'},
+    {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Предложите бонусные баллы за покупку в течение недели.'},
+    {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Проведите ретаргетинг в соцсетях для рискующих клиентов.'},
+    {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Отправьте письмо с рекомендациями дополняющих товаров.'},
+    {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Улучшите клиентскую поддержку для оперативного решения вопросов.'},
+    # --- Рекомендации для рискующих клиентов (английский) ---
+    {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Send an email reminding about an abandoned cart with a 5% discount.'},
+    {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Launch an SMS campaign with a time-limited offer.'},
+    {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Offer bonus points for a purchase within a week.'},
+    {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Run retargeting ads on social media for at-risk customers.'},
+    {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Send an email with recommendations for complementary products.'},
+    {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Improve customer support to quickly resolve issues.'},
+
+    # --- Рекомендации для спящих клиентов (русский) ---
+    {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Запустите email-кампанию “Мы скучаем!” с 15% скидкой.'},
+    {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Отправьте опрос о причинах ухода с купоном за ответ.'},
+    {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Проведите кампанию в соцсетях с новыми товарами.'},
+    {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Предложите бесплатную доставку при заказе в течение месяца.'},
+    {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Создайте серию писем с историями о бренде.'},
+    {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Добавьте спящих клиентов в программу лояльности с бонусом.'},
+    # --- Рекомендации для спящих клиентов (английский) ---
+    {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Launch a “We miss you!” email campaign with a 15% discount.'},
+    {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Send a survey about why they stopped buying with a coupon for responding.'},
+    {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Run a social media campaign highlighting new products.'},
+    {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Offer free shipping for orders placed within a month.'},
+    {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Create a series of emails with stories about your brand.'},
+    {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Add lost customers to a loyalty program with a return bonus.'},
+]
+
+# === Функция load_recommendations ===
+# Загружает каталог рекомендаций из файла
+def load_recommendations(path=RECOMMENDATIONS_FILE):
+    """Каталог рекомендаций из CSV (столбцы segment, language, recommendation; UTF-8).
+       Если файла нет, возвращает DEFAULT_RECOMMENDATIONS."""
+    if not os.path.exists(path):
+        logger.info(f"Файл каталога {path} не найден, используются рекомендации по умолчанию")
+        return DEFAULT_RECOMMENDATIONS
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        rows = list(csv.DictReader(file))
+    recommendations = [{field: (row.get(field) or '').strip() for field in RECOMMENDATION_FIELDS} for row in rows]
+    recommendations = [rec for rec in recommendations if all(rec.values())]
+    if len(recommendations) < len(rows):
+        logger.warning(f"Пропущено {len(rows) - len(recommendations)} неполных строк каталога {path}")
+    logger.info(f"Загружено {len(recommendations)} рекомендаций из {path}")
+    return recommendations
+
+# === Функция embed_texts ===
+# Векторные представления для списка текстов
+def embed_texts(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    """Векторы текстов одним пакетным вызовом model.encode; одинаковые тексты кодируются один раз."""
+    unique_texts = list(dict.fromkeys(texts))
+    embeddings = model.encode(unique_texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False,
+                              normalize_embeddings=True)
+    positions = {text: i for i, text in enumerate(unique_texts)}
+    return embeddings[[positions[text] for text in texts]]
+
+# === Функция content_hash ===
+# Хеш одной рекомендации
+def content_hash(rec):
+    """Хеш рекомендации по всем её полям: изменённая рекомендация — это новая запись."""
+    payload = json.dumps([rec[field] for field in RECOMMENDATION_FIELDS], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# === Функция catalogue_hash ===
+# Хеш всего каталога
+def catalogue_hash(hashes):
+    """Хеш каталога по хешам записей; от порядка строк в файле не зависит."""
+    return hashlib.sha256('\n'.join(sorted(hashes)).encode('utf-8')).hexdigest()
+
+# === Функция create_recommendations_table ===
+# Создаёт таблицу рекомендаций с заданным именем
+def create_recommendations_table(cur, table):
+    """Таблица рекомендаций: рабочая и теневая устроены одинаково."""
+    cur.execute(f"""
+        CREATE TABLE {table} (
+            id SERIAL PRIMARY KEY,
+            segment TEXT,
+            language TEXT,
+            recommendation TEXT,
+            content_hash TEXT NOT NULL,
+            embedding VECTOR(384)
+        );
+    """)
+
+# === Функция copy_recommendations ===
+# Загружает рекомендации с векторами в таблицу
+def copy_recommendations(cur, table, recommendations, hashes, embeddings):
+    """COPY рекомендаций пачками по COPY_PAGE_SIZE, чтобы не собирать весь CSV в памяти."""
+    for start in range(0, len(recommendations), COPY_PAGE_SIZE):
+        end = start + COPY_PAGE_SIZE
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for rec, row_hash, embedding in zip(recommendations[start:end], hashes[start:end],
+                                            vector_literals(embeddings[start:end])):
+            writer.writerow([rec['segment'], rec['language'], rec['recommendation'], row_hash, embedding])
+        buffer.seek(0)
+        cur.copy_expert(f"COPY {table} (segment, language, recommendation, content_hash, embedding) "
+                        f"FROM STDIN WITH (FORMAT csv)", buffer)
+
+# === Функция read_index_state ===
+# Что сейчас лежит в базе
+def read_index_state(cur):
+    """Хеш каталога и версия модели, с которыми собрана рабочая таблица, и есть ли в ней хеши записей."""
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {META_TABLE} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    cur.execute(f"SELECT key, value FROM {META_TABLE}")
+    state = dict(cur.fetchall())
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'recommendations'
+    """)
+    columns = {row[0] for row in cur.fetchall()}
+    state['table_exists'] = bool(columns)
+    state['has_hashes'] = 'content_hash' in columns
+    return state
+
+_index = None  # NumpyVectorIndex, когда SEARCH_BACKEND == 'numpy'
+
+
+# === Функция build_index ===
+# Индекс по каталогу рекомендаций
+def build_index(recommendations):
+    """NumpyVectorIndex по каталогу (повторы отбрасываются): векторы считает embed_texts."""
+    unique = list({content_hash(rec): rec for rec in recommendations}.values())
+    rows = [tuple(rec[field] for field in RECOMMENDATION_FIELDS) for rec in unique]
+    embeddings = embed_texts([rec['recommendation'] for rec in unique])
+    return NumpyVectorIndex(rows, NumpyVectorIndex.normalize(embeddings))
+
+# === Функция load_index ===
+# Индекс каталога для бэкенда 'numpy'
+def load_index(recommendations=None, path=INDEX_FILE, mmap=INDEX_MMAP):
+    """NumpyVectorIndex по каталогу. Если сохранённый индекс собран по тому же каталогу и той же модели,
+       он открывается с диска без кодирования; иначе собирается заново и сохраняется."""
+    if recommendations is None:
+        recommendations = load_recommendations()
+    expected = {'catalogue_hash': catalogue_hash({content_hash(rec) for rec in recommendations}),
+                'model_version': MODEL_VERSION}
+    if os.path.exists(path):
+        try:
+            index, meta = NumpyVectorIndex.load(path, mmap)
+            if meta == expected:
+                logger.info(f"Индекс рекомендаций загружен из {path}: {len(index)} записей")
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Сохранённый индекс {path} не прочитан, собираем заново: {e}")
+    started = time.perf_counter()
+    index = build_index(recommendations)
+    index.save(path, **expected)
+    logger.info(f"Индекс рекомендаций собран: {len(index)} записей за {time.perf_counter() - started:.1f} с")
+    return NumpyVectorIndex.load(path, mmap)[0] if mmap else index
+
 # === Функция init_recommendations ===
 # Инициализирует таблицу рекомендаций в базе данных
-def init_recommendations():
-    """Инициализация таблицы рекомендаций с векторными представлениями."""
-    # --- Создание таблицы рекомендаций ---
-    # Создаёт таблицу с предопределёнными рекомендациями для разных сегментов клиентов
-    recommendations = [
-        # --- Рекомендации для VIP-клиентов (русский) ---
-        {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Запустите программу лояльности с кэшбэком для VIP-клиентов, предлагая 5–10% возврата на каждую покупку.'},
-        {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Предлагайте эксклюзивные купоны на популярные товары только для VIP-клиентов.'},
-        {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Отправьте push-уведомления с персонализированными предложениями для VIP-клиентов.'},
-        {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Организуйте розыгрыш подарочных карт среди VIP-клиентов.'},
-        {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Предоставьте приоритетную поддержку через чат для VIP-клиентов.'},
-        {'segment': 'VIP-клиенты', 'language': 'ru', 'recommendation': 'Создайте флеш-распродажи для VIP-клиентов с доступом к товарам по сниженным ценам.'},
-        # --- Рекомендации для VIP-клиентов (английский) ---
-        {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Launch a loyalty program with 5–10% cashback for VIP customers to encourage frequent purchases.'},
-        {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Offer exclusive coupons on popular products only for VIP customers.'},
-        {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Send personalized push notifications with offers tailored to VIP customers.'},
-        {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Organize a gift card raffle for VIP customers to boost engagement.'},
-        {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Provide priority support via chat for VIP customers.'},
-        {'segment': 'VIP Customers', 'language': 'en', 'recommendation': 'Create flash sales for VIP customers with access to discounted products.'},
-
-        # --- Рекомендации для лояльных клиентов (русский) ---
-        {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Внедрите накопительную систему баллов, где клиенты зарабатывают бонусы за каждую покупку.'},
-        {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Отправьте email с предложением бесплатной доставки на следующий заказ.'},
-        {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Создайте реферальную программу с бонусами за приглашение друзей.'},
-        {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Проводите акции “2+1” для лояльных клиентов.'},
-        {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Добавьте персонализированные рекомендации товаров на сайте.'},
-        {'segment': 'Лояльные клиенты', 'language': 'ru', 'recommendation': 'Организуйте опрос о предпочтениях с бонусом за участие.'},
-        # --- Рекомендации для лояльных клиентов (английский) ---
-        {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Introduce a points-based loyalty system where customers earn bonuses for each purchase.'},
-        {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Send an email offering free shipping on the next order.'},
-        {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Create a referral program with bonuses for inviting friends.'},
-        {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Run “2+1” promotions for loyal customers.'},
-        {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Add personalized product recommendations on the website.'},
-        {'segment': 'Loyal Customers', 'language': 'en', 'recommendation': 'Conduct a survey on preferences with a bonus for participation.'},
-
-        # --- Рекомендации для новых покупателей (русский) ---
-        {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Отправьте приветственный email с 10% скидкой на первый заказ.'},
-        {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Предложите бесплатный пробник популярного продукта при первой покупке.'},
-        {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Запустите рекламу в соцсетях с акцентом на бестселлеры.'},
-        {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Добавьте всплывающее окно с подпиской на рассылку в обмен на купон.'},
-        {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Упростите процесс регистрации и оформления заказа.'},
-        {'segment': 'Новые покупатели', 'language': 'ru', 'recommendation': 'Создайте видеогид по магазину для новых покупателей.'},
-        # --- Рекомендации для новых покупателей (английский) ---
-        {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Send a welcome email with a 10% discount on the first order.'},
-        {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Offer a free sample of a popular product with the first purchase.'},
-        {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Launch social media ads focusing on bestsellers.'},
-        {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Add a pop-up for newsletter subscription in exchange for a coupon.'},
-        {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Simplify the registration and checkout process.'},
-        {'segment': 'New Customers', 'language': 'en', 'recommendation': 'Create a video guide for the store for new customers.'},
-
-        # --- Рекомендации для рискующих клиентов (русский) ---
-        {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Отправьте email с напоминанием о брошенной корзине и 5% скидкой.'},
-        {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Запустите SMS-кампанию с ограниченным по времени предложением.'},
-        {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Предложите бонусные баллы за покупку в течение недели.'},
-        {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Проведите ретаргетинг в соцсетях для рискующих клиентов.'},
-        {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Отправьте письмо с рекомендациями дополняющих товаров.'},
-        {'segment': 'Рискующие клиенты', 'language': 'ru', 'recommendation': 'Улучшите клиентскую поддержку для оперативного решения вопросов.'},
-        # --- Рекомендации для рискующих клиентов (английский) ---
-        {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Send an email reminding about an abandoned cart with a 5% discount.'},
-        {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Launch an SMS campaign with a time-limited offer.'},
-        {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Offer bonus points for a purchase within a week.'},
-        {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Run retargeting ads on social media for at-risk customers.'},
-        {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Send an email with recommendations for complementary products.'},
-        {'segment': 'At-Risk Customers', 'language': 'en', 'recommendation': 'Improve customer support to quickly resolve issues.'},
-
-        # --- Рекомендации для спящих клиентов (русский) ---
-        {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Запустите email-кампанию “Мы скучаем!” с 15% скидкой.'},
-        {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Отправьте опрос о причинах ухода с купоном за ответ.'},
-        {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Проведите кампанию в соцсетях с новыми товарами.'},
-        {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Предложите бесплатную доставку при заказе в течение месяца.'},
-        {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Создайте серию писем с историями о бренде.'},
-        {'segment': 'Спящие клиенты', 'language': 'ru', 'recommendation': 'Добавьте спящих клиентов в программу лояльности с бонусом.'},
-        # --- Рекомендации для спящих клиентов (английский) ---
-        {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Launch a “We miss you!” email campaign with a 15% discount.'},
-        {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Send a survey about why they stopped buying with a coupon for responding.'},
-        {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Run a social media campaign highlighting new products.'},
-        {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Offer free shipping for orders placed within a month.'},
-        {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Create a series of emails with stories about your brand.'},
-        {'segment': 'Lost Customers', 'language': 'en', 'recommendation': 'Add lost customers to a loyalty program with a return bonus.'},
-    ]
-    # --- Работа с базой данных ---
-    # Создаёт таблицу и заполняет её рекомендациями и их векторными представлениями
+def init_recommendations(recommendations=None, force=False, backend=None):
+    """Инициализация таблицы рекомендаций с векторными представлениями.
+       recommendations — список словарей segment/language/recommendation (по умолчанию — load_recommendations()).
+       Если каталог и модель не менялись, ничего не делает. Иначе собирает новую таблицу рядом с рабочей:
+       неизменённые записи копируются в базе вместе с векторами, модель кодирует только новые и изменённые,
+       а затем таблицы меняются местами переименованием — поиск не видит пустой или недостроенной таблицы.
+       force=True пересчитывает все векторы. backend='numpy' (по умолчанию — SEARCH_BACKEND) вместо таблицы
+       готовит NumpyVectorIndex, и поиск работает без базы."""
+    global _index
+    backend = backend or SEARCH_BACKEND
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f"backend должен быть одним из {SEARCH_BACKENDS}")
+    if recommendations is None:
+        recommendations = load_recommendations()
+    if backend == 'numpy':
+        if force and os.path.exists(INDEX_FILE):
+            os.remove(INDEX_FILE)
+        _index = load_index(recommendations)
+        search_cache.clear_results()
+        return
+    _index = None
+    started = time.perf_counter()
+
+    # Повторы одной и той же рекомендации ничего не добавляют к поиску
+    unique = {}
+    for rec in recommendations:
+        unique.setdefault(content_hash(rec), rec)
+    if len(unique) < len(recommendations):
+        logger.info(f"В каталоге {len(recommendations) - len(unique)} повторов, они пропущены")
+    hashes = list(unique)
+    new_catalogue_hash = catalogue_hash(hashes)
+
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Создаём таблицу рекомендаций
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS recommendations (
-                    id SERIAL PRIMARY KEY,
-                    segment TEXT,
-                    language TEXT,
-                    recommendation TEXT,
-                    embedding VECTOR(384)
-                );
-            """)
-            # Очищаем таблицу перед добавлением новых данных
-            cur.execute("TRUNCATE TABLE recommendations")
-            # Добавляем рекомендации и их векторы
-            for rec in recommendations:
-                embedding = model.encode(rec['recommendation']).tolist()
-                cur.execute("INSERT INTO recommendations (segment, language, recommendation, embedding) VALUES (%s, %s, %s, %s)",
-                            (rec['segment'], rec['language'], rec['recommendation'], embedding))
+            # Два одновременно стартующих бота не должны собирать таблицу параллельно
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('recommendations_rebuild'))")
+            state = read_index_state(cur)
+            if (not force and state['table_exists'] and state.get('catalogue_hash') == new_catalogue_hash
+                    and state.get('model_version') == MODEL_VERSION):
+                conn.commit()
+                logger.info(f"Каталог рекомендаций и модель не менялись ({len(hashes)} записей) — пересборка не нужна")
+                return
+
+            # Векторы неизменённых записей годятся, только если они посчитаны той же моделью
+            kept = set()
+            if not force and state['has_hashes'] and state.get('model_version') == MODEL_VERSION:
+                cur.execute("SELECT DISTINCT content_hash FROM recommendations WHERE content_hash = ANY(%s)", (hashes,))
+                kept = {row[0] for row in cur.fetchall()}
+            changed = [row_hash for row_hash in hashes if row_hash not in kept]
+
+            # --- Теневая таблица ---
+            # Собирается, пока рабочая продолжает отвечать на запросы
+            cur.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+            create_recommendations_table(cur, SHADOW_TABLE)
+            if kept:
+                cur.execute(f"""
+                    INSERT INTO {SHADOW_TABLE} (segment, language, recommendation, content_hash, embedding)
+                    SELECT DISTINCT ON (content_hash) segment, language, recommendation, content_hash, embedding
+                    FROM recommendations WHERE content_hash = ANY(%s)
+                """, (list(kept),))
+            if changed:
+                changed_recs = [unique[row_hash] for row_hash in changed]
+                embeddings = embed_texts([rec['recommendation'] for rec in changed_recs])
+                copy_recommendations(cur, SHADOW_TABLE, changed_recs, changed, embeddings)
+
+            # --- Подмена ---
+            # Переименования и метаданные — в одной транзакции: читатели видят либо старую, либо новую таблицу
+            cur.execute(f"DROP TABLE IF EXISTS {OLD_TABLE}")
+            if state['table_exists']:
+                cur.execute(f"ALTER TABLE recommendations RENAME TO {OLD_TABLE}")
+            cur.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO recommendations")
+            cur.execute(f"DROP TABLE IF EXISTS {OLD_TABLE}")
+            cur.execute(f"""
+                INSERT INTO {META_TABLE} (key, value) VALUES ('catalogue_hash', %s), ('model_version', %s)
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+            """, (new_catalogue_hash, MODEL_VERSION))
             conn.commit()
-        logger.info("Таблица рекомендаций инициализирована")
+        search_cache.clear_results()  # Прежние результаты ссылаются на старую таблицу
+        logger.info(f"Таблица рекомендаций пересобрана: {len(hashes)} записей, из них заново закодировано "
+                    f"{len(changed)}, за {time.perf_counter() - started:.1f} с")
+
+# === Функция search_recommendations ===
+# Векторный поиск по готовому вектору запроса
+def search_recommendations(conn, query_embedding, lang, segment=None, limit=3):
+    """Ближайшие рекомендации через подготовленные запросы SEARCH_STATEMENTS."""
+    get_pool().prepare(conn)
+    vector = vector_literals(np.asarray([query_embedding], dtype=np.float32))[0]
+    with conn.cursor() as cur:
+        # Если указан сегмент, ищем рекомендации только для него
+        if segment:
+            cur.execute("EXECUTE find_by_segment (%s, %s, %s, %s)", (segment, lang, vector, limit))
+        else:
+            # Ищем рекомендации для всех сегментов
+            cur.execute("EXECUTE find_all_segments (%s, %s, %s)", (lang, vector, limit))
+        results = cur.fetchall()
+    conn.rollback()  # Только чтение — закрываем транзакцию, соединение вернётся в пул чистым
+    return results
 
 # === Функция find_recommendations ===
 # Выполняет векторный поиск рекомендаций по запросу пользователя
 def find_recommendations(query, lang, segment=None, limit=3):
-    """Поиск рекомендаций по векторному сходству с учетом языка."""
+    """Поиск рекомендаций по векторному сходству с учетом языка. Векторы запросов и результаты
+       берутся из search_cache, если такой запрос уже был."""
     # --- Векторный поиск ---
     # Преобразует запрос в вектор и ищет наиболее подходящие рекомендации
-    query_embedding = model.encode(query).tolist()
+    query_embedding = search_cache.embedding(query)
+    key = search_cache.result_key(query_embedding, lang, segment, limit)
+    cached = search_cache.get_results(key)
+    if cached is not None:
+        return list(cached)
 
     # Логируем первые элементы вектора для отладки
-    logger.info(f"Вектор запроса (первые 5 элементов): {query_embedding[:5]}...")
+    logger.info(f"Вектор запроса (первые 5 элементов): {query_embedding[:5].tolist()}...")
+    if _index is not None:
+        results = _index.search(query_embedding, lang, segment, limit)
+        search_cache.put_results(key, results)
+        return results
     try:
-        with get_db_connection() as conn:
+        with get_pool().connection() as conn:
+            results = search_recommendations(conn, query_embedding, lang, segment, limit)
+    except (psycopg2.Error, psycopg2.pool.PoolError) as e:
+        logger.error(f"Ошибка при поиске рекомендаций: {e}")
+        return []  # Ошибку не кешируем — следующий вызов снова пойдёт в базу
+    search_cache.put_results(key, results)
+    return results
+
+# === Функция benchmark_search ===
+# Задержка поиска: новое соединение на каждый запрос против пула
+def benchmark_search(query="удержание клиентов", lang='ru', segment=None, iterations=200):
+    """p50/p99 задержки поиска (мс) без кодирования запроса: 'direct' — как раньше, psycopg2.connect
+       и обычный запрос на каждый вызов; 'pooled' — соединение из пула и подготовленный запрос."""
+    query_embedding = model.encode(query).tolist()
+    where, params = ("segment = %s AND language = %s", (segment, lang)) if segment else ("language = %s", (lang,))
+    plain_query = (f"SELECT segment, recommendation, embedding FROM recommendations WHERE {where} "
+                   f"ORDER BY embedding <-> %s::vector LIMIT %s")
+
+    def direct():
+        conn = get_db_connection()
+        try:
             with conn.cursor() as cur:
-                # Если указан сегмент, ищем рекомендации только для него
-                if segment:
-                    cur.execute("""
-                        SELECT segment, recommendation, embedding 
-                        FROM recommendations 
-                        WHERE segment = %s AND language = %s
-                        ORDER BY embedding <-> %s::vector LIMIT %s
-                    """, (segment, lang, query_embedding, limit))
-                else:
-                    # Ищем рекомендации для всех сегментов
-                    cur.execute("""
-                        SELECT segment, recommendation, embedding 
-                        FROM recommendations 
-                        WHERE language = %s
-                        ORDER BY embedding <-> %s::vector LIMIT %s
-                    """, (lang, query_embedding, limit))
-                results = cur.fetchall()
+                cur.execute(plain_query, params + (query_embedding, 3))
+                cur.fetchall()
+        finally:
+            conn.close()
 
-        return results
-    except psycopg2.Error as e:
-        logger.error(f"Ошибка при поиске рекомендаций: {e}")
-        return []
+    def pooled():
+        with get_pool().connection() as conn:
+            search_recommendations(conn, query_embedding, lang, segment)
+
+    report = {}
+    for name, function in (('direct', direct), ('pooled', pooled)):
+        function()  # Прогрев: пул создаёт соединения и готовит запросы
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            function()
+            latencies.append((time.perf_counter() - started) * 1000)
+        report[name] = {'p50_ms': float(np.percentile(latencies, 50)), 'p99_ms': float(np.percentile(latencies, 99))}
+    report['pool'] = get_pool().info()
+    return report
+
+# === Функция check_parity ===
+# Сверка NumpyVectorIndex с поиском в PostgreSQL
+def check_parity(index=None, limit=3, tolerance=1e-4):
+    """compare_backends для индекса и pgvector: шаблонные запросы бота через базу и через индекс."""
+    if index is None:
+        index = _index if _index is not None else load_index()
+    with get_pool().connection() as conn:
+        return compare_backends(
+            index, search_cache.embedding,
+            lambda query_embedding, lang, segment, limit: search_recommendations(conn, query_embedding, lang, segment, limit),
+            limit, tolerance)
+
+
+if __name__ == "__main__":
+    # Замер задержки поиска до и после пула: python VectorSearch.py
+    # Сверка индекса в памяти с базой: python VectorSearch.py parity
+    import sys
+    logging.basicConfig(level=logging.WARNING)
+    if sys.argv[1:] == ['parity']:
+        parity = check_parity()
+        print(json.dumps(parity, ensure_ascii=False, indent=2))
+        sys.exit(1 if parity['mismatches'] else 0)
+    print(json.dumps(benchmark_search(), ensure_ascii=False, indent=2))
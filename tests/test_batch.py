@@ -0,0 +1,37 @@
+# === Тесты сбора файлов для пакетного анализа (RFMBatch.collect_files) ===
+import os
+
+import RFMBatch
+
+SUPPORTED = ['a.csv', 'b.csv.gz', 'c.zip', 'd.parquet', 'e.feather', 'f.arrow', 'G.CSV', 'h.gz']
+IGNORED = ['notes.txt', 'report.xlsx', 'archive.tar', 'csv']
+
+
+def make_tree(root):
+    for name in SUPPORTED + IGNORED:
+        (root / name).write_bytes(b'')
+    (root / 'nested.csv').mkdir()  # Каталог с «расширением» — не файл
+    (root / 'nested.csv' / 'inner.csv').write_bytes(b'')
+
+
+def names(files):
+    return [os.path.basename(path) for path in files]
+
+
+def test_directory_collects_supported_formats(tmp_path):
+    make_tree(tmp_path)
+    assert names(RFMBatch.collect_files([str(tmp_path)])) == sorted(SUPPORTED)
+
+
+def test_pattern_overrides_extensions(tmp_path):
+    make_tree(tmp_path)
+    assert names(RFMBatch.collect_files([str(tmp_path)], pattern='*.parquet')) == ['d.parquet']
+    assert names(RFMBatch.collect_files([str(tmp_path)], pattern='*.txt')) == ['notes.txt']
+
+
+def test_files_and_globs_are_deduplicated(tmp_path):
+    make_tree(tmp_path)
+    files = RFMBatch.collect_files([str(tmp_path / 'a.csv'), str(tmp_path / '*.zip'), str(tmp_path),
+                                    str(tmp_path / 'missing.csv')])
+    assert names(files) == sorted(SUPPORTED)
+    assert all(os.path.isabs(path) for path in files)
@@ -0,0 +1,25 @@
+# === Тесты кэша результатов (RFMCache) ===
+import time
+
+import Metrics
+import RFMCache
+
+
+def test_cache_lookup_metric_covers_disk_read(tmp_path, monkeypatch):
+    path = tmp_path / 'data.csv'
+    path.write_text("customer,date,amount\n" + "".join(f"{i % 40},2024-0{i % 9 + 1}-10,{i}.5\n" for i in range(400)))
+    cache = RFMCache.ResultCache(cache_dir=str(tmp_path / 'cache'))
+    first = RFMCache.main(str(path), as_of_date='2025-01-01', cache=cache, metrics=Metrics.Metrics(memory=None))
+    assert not first['cache_hit']
+
+    original_get = cache.get
+
+    def slow_get(key):
+        time.sleep(0.2)  # Медленный диск: время чтения записи должно попасть в стадию cache_lookup
+        return original_get(key)
+
+    monkeypatch.setattr(cache, 'get', slow_get)
+    second = RFMCache.main(str(path), as_of_date='2025-01-01', cache=cache, metrics=Metrics.Metrics(memory=None))
+    assert second['cache_hit']
+    [record] = second['metrics']['stages']
+    assert record['stage'] == 'cache_lookup' and record['seconds'] >= 0.2
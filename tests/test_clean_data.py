@@ -0,0 +1,64 @@
+# === Тесты параллельной очистки (FileProcessor.clean_data с workers) против однопроцессной ===
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import RFM
+
+
+def dirty_frame(rng, rows, with_dates):
+    """Сырые строки, как после чтения CSV: текстовые суммы, пропуски, отрицательные значения, мусор в датах."""
+    amounts = np.char.add(rng.integers(-50, 5000, rows).astype(str), '.50').astype(object)
+    amounts[rng.choice(rows, rows // 20, replace=False)] = ''
+    amounts[rng.choice(rows, rows // 50, replace=False)] = 'abc'
+    frame = pd.DataFrame({'client_id': rng.integers(0, rows // 3, rows).astype(str).astype(object), 'amount': amounts})
+    frame.loc[rng.choice(rows, rows // 40, replace=False), 'client_id'] = None
+    if with_dates:
+        dates = (pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 360, rows), unit='D')).strftime('%d.%m.%Y')
+        frame['date'] = dates.to_numpy(dtype=object)
+        frame.loc[rng.choice(rows, rows // 30, replace=False), 'date'] = '32.13.2024'
+    else:
+        recency = rng.integers(-10, 365, rows).astype(str).astype(object)
+        recency[rng.choice(rows, rows // 25, replace=False)] = None
+        frame['recency'] = recency
+        frame['frequency'] = rng.integers(1, 20, rows).astype(str)
+    return frame
+
+
+def clean(frame, workers):
+    processor = RFM.FileProcessor()
+    processor.current_date = date(2025, 1, 1)
+    cleaned = processor.clean_data(frame.copy(), workers=workers)
+    return cleaned, processor.diagnostics.render(), processor.diagnostics.render(RFM.FILE_SOURCE)
+
+
+@pytest.mark.parametrize('with_dates', [True, False])
+def test_parallel_clean_matches_serial(monkeypatch, with_dates):
+    frame = dirty_frame(np.random.default_rng(7), 3000, with_dates)
+    serial = clean(frame, workers=1)
+
+    calls = []
+    original = RFM.FileProcessor.convert_parallel
+
+    def spy(self, df, parse_dates, n_chunks):
+        calls.append(n_chunks)
+        return original(self, df, parse_dates, n_chunks)
+
+    # Порог и число ядер подменяем, чтобы маленький кадр пошёл через пул даже на одноядерной машине
+    monkeypatch.setattr(RFM, 'PARALLEL_MIN_CHUNK_ROWS', 1000)
+    monkeypatch.setattr(RFM.os, 'cpu_count', lambda: 4)
+    monkeypatch.setattr(RFM.FileProcessor, 'convert_parallel', spy)
+    parallel = clean(frame, workers=2)
+
+    assert calls == [2]
+    pd.testing.assert_frame_equal(parallel[0], serial[0])
+    assert parallel[1:] == serial[1:]
+    assert 'Проблемы в данных' in serial[1]  # Журнал не пустой — сравнение что-то проверяет
+
+
+def test_small_frame_stays_serial(monkeypatch):
+    monkeypatch.setattr(RFM.FileProcessor, 'convert_parallel', lambda *args: pytest.fail('пул для маленького кадра'))
+    cleaned, _, _ = clean(dirty_frame(np.random.default_rng(8), 3000, True), workers=8)
+    assert not cleaned.empty
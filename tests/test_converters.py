@@ -0,0 +1,46 @@
+# === Тесты векторных преобразований FileProcessor против построчных text_to_number / normalize_phone ===
+import numpy as np
+import pandas as pd
+import pytest
+
+import RFM
+
+DIRTY_NUMBERS = ['1 234,50', '1234,50', '₽1.234', '1.234₽', '—', '-', '', ' ', 'abc', 'nan', 'NaN', 'None',
+                 '-15', '-0', '-1.5e3', ' 42 ', '+7', '1_000', '0x10', 'inf', '-Infinity', '1e400', '١٢',
+                 'two', 'Twenty One', 'minus two', 'два', 'True', 'false', None, np.nan, 12, -3.5, 0]
+DIRTY_PHONES = ['+7 (912) 345-67-89', '8 912 345 67 89', '8(912)3456789', '89123456789', '+79123456789',
+                '7 912 345 67 89', '+7 912 345', '8', '88005553535', ' 8-800-555-35-35 ', '\t8 912 345 67 89',
+                'client-42', 'ivan@example.com', '', None, np.nan, 89123456789, 79123456789.0]
+
+
+@pytest.fixture
+def processor():
+    return RFM.FileProcessor()
+
+
+@pytest.mark.parametrize('value', DIRTY_NUMBERS, ids=repr)
+def test_text_to_number_series_matches_scalar(processor, value):
+    series = pd.Series(['7', value, value], dtype=object)
+    expected = series.apply(processor.text_to_number).astype('float64')
+    pd.testing.assert_series_equal(processor.text_to_number_series(series), expected)
+
+
+def test_text_to_number_series_whole_column(processor):
+    series = pd.Series(DIRTY_NUMBERS * 3, dtype=object)
+    expected = series.apply(processor.text_to_number).astype('float64')
+    pd.testing.assert_series_equal(processor.text_to_number_series(series), expected)
+
+
+@pytest.mark.parametrize('series', [pd.Series([1, -2, 3]), pd.Series([1.5, np.nan, -0.0]), pd.Series([True, False])],
+                         ids=['int', 'float', 'bool'])
+def test_text_to_number_series_typed_columns(processor, series):
+    expected = series.apply(processor.text_to_number).astype('float64')
+    pd.testing.assert_series_equal(processor.text_to_number_series(series), expected)
+
+
+@pytest.mark.parametrize('value', DIRTY_PHONES, ids=repr)
+def test_normalize_phone_series_matches_scalar(processor, value):
+    # Как в исходном clean_data: столбец сначала приводится к строкам, потом normalize_phone по значениям
+    series = pd.Series([value, '8 900 000 00 00'], dtype=object)
+    expected = series.astype(str).apply(processor.normalize_phone)
+    pd.testing.assert_series_equal(processor.normalize_phone_series(series), expected)
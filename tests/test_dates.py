@@ -0,0 +1,87 @@
+# === Тесты разбора дат (parse_date_series) против построчного parse_date_safe ===
+import numpy as np
+import pandas as pd
+import pytest
+
+import RFM
+
+ISO = ['2024-01-05', '2024-02-29', '2023-12-31', '2024-07-14']
+SINGLE_FORMATS = {
+    'iso': ISO,
+    'iso_time': ['2024-01-05 10:15:00', '2024-02-29 23:59:59', '2023-12-31 00:00:01'],
+    'iso_t': ['2024-01-05T10:15:00', '2024-03-01T08:00:00'],
+    'us_slash': ['01/05/2024', '12/31/2023', '02/29/2024'],
+    'dotted': ['05.01.2024', '31.12.2023', '29.02.2024'],  # dateutil читает 05.01 как 1 мая — так же и формат
+    'month_name': ['5 March 2024', '12 January 2023', '30 November 2024'],
+    'month_abbr': ['Mar 5, 2024', 'Jan 12, 2023', 'Nov 30, 2024'],
+    'two_digit_year': ['01/05/24', '12/31/23'],
+    'timezone': ['2024-01-05T10:00:00+03:00', '2024-01-06T10:00:00+03:00'],
+}
+BAD = ['not a date', '32.13.2024', '2024-13-01', '', 'N/A', None, np.nan]
+
+
+def baseline(series):
+    processor = RFM.FileProcessor()
+    return series.apply(processor.parse_date_safe), processor.diagnostics
+
+
+def vectorized(series):
+    processor = RFM.FileProcessor()
+    return processor.parse_date_series(series), processor.diagnostics
+
+
+def assert_same_dates(result, expected):
+    assert len(result) == len(expected)
+    for got, want in zip(result, expected):
+        if pd.isna(want):
+            assert pd.isna(got)
+        else:
+            assert pd.Timestamp(got) == pd.Timestamp(want)
+            assert pd.Timestamp(got).tzinfo == pd.Timestamp(want).tzinfo
+
+
+def issue_counts(diagnostics):
+    return {item['category']: (item['count'], [example['value'] for example in item['examples']])
+            for item in diagnostics.summary()}
+
+
+@pytest.mark.parametrize('values', SINGLE_FORMATS.values(), ids=SINGLE_FORMATS.keys())
+@pytest.mark.parametrize('with_bad', [False, True], ids=['clean', 'with_bad'])
+def test_single_format_column_matches_baseline(values, with_bad):
+    series = pd.Series((values * 50) + (BAD if with_bad else []), dtype=object)
+    (expected, expected_log), (result, result_log) = baseline(series), vectorized(series)
+    assert_same_dates(result, expected)
+    assert issue_counts(result_log) == issue_counts(expected_log)
+
+
+def test_iso_column_uses_fast_path(monkeypatch):
+    calls = []
+    monkeypatch.setattr(RFM, 'parse_date', lambda text: calls.append(text) or pytest.fail('dateutil на ISO'))
+    processor = RFM.FileProcessor()
+    monkeypatch.setattr(processor, 'infer_date_format', lambda text: '%Y-%m-%d')
+    dates = processor.parse_date_series(pd.Series(ISO * 10))
+    assert dates.dtype == 'datetime64[ns]' and not calls
+
+
+@pytest.mark.parametrize('date_format', ['%Y-%m-%d', '%m/%d/%Y', '%d %B %Y'])
+def test_infer_date_format(date_format):
+    text = pd.Series(pd.date_range('2024-01-01', periods=40, freq='7D').strftime(date_format))
+    assert RFM.FileProcessor().infer_date_format(text) == date_format
+
+
+@pytest.mark.parametrize('values', [['05/01/2024', '31/12/2023', '29/02/2024'], ['01/05/24', '12/31/23'],
+                                    ['2024-01-05T10:00:00+03:00']], ids=['day_first', 'two_digit_year', 'timezone'])
+def test_infer_date_format_rejects_ambiguous(values):
+    assert RFM.FileProcessor().infer_date_format(pd.Series(values)) is None
+
+
+def test_mixed_formats_fall_back_per_value():
+    # Большинство — ISO (быстрый путь), остальные форматы и мусор разбирает dateutil по одному
+    rng = np.random.default_rng(11)
+    values = ISO * 40 + SINGLE_FORMATS['us_slash'] * 5 + SINGLE_FORMATS['month_name'] * 5 + \
+        SINGLE_FORMATS['dotted'] * 5 + BAD * 3
+    series = pd.Series(rng.permutation(np.array(values, dtype=object)), index=rng.permutation(len(values)) + 10)
+    (expected, expected_log), (result, result_log) = baseline(series), vectorized(series)
+    assert result.index.equals(series.index)
+    assert_same_dates(result, expected)
+    assert issue_counts(result_log) == issue_counts(expected_log)
@@ -0,0 +1,54 @@
+# === Тесты компактных типов RFM-таблицы (int8-оценки, float32-суммы, категории) ===
+import numpy as np
+import pandas as pd
+import pytest
+
+import RFM
+
+
+@pytest.fixture
+def customers():
+    rng = np.random.default_rng(4)
+    n = 5000
+    return pd.DataFrame({'client_id': [f'c{i}' for i in range(n)], 'recency': rng.integers(0, 400, n),
+                         'frequency': rng.integers(1, 30, n), 'amount': rng.gamma(2, 800, n).round(2)})
+
+
+def test_compact_money_round_trips_kopecks():
+    values = pd.Series([0.01, 19.99, 1234.56, 99999.99])
+    compact = RFM.compact_money(values)
+    assert compact.dtype == np.float32
+    np.testing.assert_array_equal(RFM.measure_values(compact), values.to_numpy())
+
+
+def test_compact_money_keeps_float64_when_lossy():
+    values = pd.Series([123456789.01, 0.5])  # Копейки такой суммы float32 не удержит
+    assert RFM.compact_money(values).dtype == np.float64
+
+
+def test_compact_scores_match_float64_qcut(customers):
+    rfm = RFM.RFMAnalyzer().analyze(customers)
+    for _, score, _ in RFM.SCORE_COLUMNS:
+        assert rfm[score].dtype == RFM.SCORE_DTYPE
+    assert rfm['Monetary'].dtype == np.float32
+    assert isinstance(rfm['Segment'].dtype, pd.CategoricalDtype)
+
+    # Эталон — исходные pd.qcut по мерам во float64
+    wide = customers.astype({'recency': 'float64', 'frequency': 'float64', 'amount': 'float64'})
+    expected = {
+        'R_Score': pd.qcut(wide['recency'], 5, labels=[5, 4, 3, 2, 1]).astype(int),
+        'F_Score': pd.qcut(wide['frequency'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5]).astype(int),
+        'M_Score': pd.qcut(wide['amount'], 5, labels=[1, 2, 3, 4, 5]).astype(int),
+    }
+    for score, values in expected.items():
+        np.testing.assert_array_equal(rfm[score].to_numpy().astype(int), values.to_numpy())
+    np.testing.assert_array_equal(RFM.measure_values(rfm['Monetary']), wide['amount'].to_numpy())
+
+
+def test_summary_from_compact_table_matches_float64(customers):
+    rfm = RFM.RFMAnalyzer().analyze(customers)
+    wide = rfm.assign(Monetary=RFM.measure_values(rfm['Monetary']),
+                      **{score: rfm[score].astype('int64') for _, score, _ in RFM.SCORE_COLUMNS})
+    pd.testing.assert_frame_equal(RFM.ResultPresenter.summarize(rfm), RFM.ResultPresenter.summarize(wide))
+    report = RFM.memory_report(rfm)
+    assert report['bytes'] < report['wide_bytes']
@@ -0,0 +1,36 @@
+# === Тесты определения кодировки (FileProcessor.detect_encoding) ===
+import io
+
+import pytest
+
+import RFM
+
+HEADER = "id,date,amount\n"
+# Больше ENCODING_SAMPLE_SIZE байт чистого ASCII, кириллица — только после выборки
+ASCII_ROWS = "".join(f"{i},2024-01-01,{i}.5\n" for i in range(30000))
+CYRILLIC_ROWS = "клиент Иванов,2024-02-02,20\n" * 50
+
+
+@pytest.mark.parametrize('encoding', ['cp1251', 'utf-8'])
+def test_cyrillic_after_ascii_sample(encoding):
+    data = (HEADER + ASCII_ROWS + CYRILLIC_ROWS).encode(encoding)
+    assert len(HEADER + ASCII_ROWS) > RFM.ENCODING_SAMPLE_SIZE
+    detected = RFM.FileProcessor().detect_encoding(data)
+    assert data.decode(detected) == HEADER + ASCII_ROWS + CYRILLIC_ROWS
+
+
+def test_pure_ascii_is_utf8():
+    assert RFM.FileProcessor().detect_encoding((HEADER + ASCII_ROWS).encode()) == 'utf-8'
+
+
+def test_bom():
+    assert RFM.FileProcessor().detect_encoding(b'\xef\xbb\xbf' + HEADER.encode()) == 'utf-8-sig'
+
+
+def test_file_object_read_from_current_position():
+    # Префикс в cp1251 уже прочитан вызывающим кодом: кодировку определяем по остатку, позицию не трогаем
+    body = (HEADER + CYRILLIC_ROWS).encode('utf-8')
+    stream = io.BytesIO("Выгрузка 1С\n".encode('cp1251') + body)
+    start = stream.seek(len("Выгрузка 1С\n"))
+    assert RFM.FileProcessor().detect_encoding(stream) == 'utf-8'
+    assert stream.tell() == start
@@ -0,0 +1,50 @@
+# === Тесты замеров стадий (Metrics) ===
+import pandas as pd
+import pytest
+
+import Metrics
+import RFM
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text("customer,date,amount\n" + "".join(f"{i % 50},2024-0{i % 9 + 1}-10,{i}.5\n" for i in range(500)))
+    return str(path)
+
+
+def test_hook_receives_every_stage(csv_path):
+    records = []
+    metrics = Metrics.Metrics(hook=records.append)
+    result = RFM.main(csv_path, as_of_date='2025-01-01', metrics=metrics)
+    stages = [record['stage'] for record in records]
+    assert stages[:3] == ['detect_encoding', 'read_csv', 'validate_columns']
+    assert {'clean_data', 'aggregate', 'analyze'} <= set(stages)
+    assert result['metrics']['stages'] == records
+    aggregate = next(record for record in records if record['stage'] == 'aggregate')
+    assert (aggregate['rows_in'], aggregate['rows_out']) == (500, 50)
+    assert result['metrics']['total']['seconds'] == pytest.approx(sum(record['seconds'] for record in records))
+
+
+def test_stage_error_is_recorded_and_raised():
+    metrics = Metrics.Metrics(memory='tracemalloc')
+
+    def broken():
+        raise ValueError('плохой файл')
+
+    with pytest.raises(ValueError):
+        metrics.run('read_csv', broken)
+    [record] = metrics.report()['stages']
+    assert record['error'] == 'ValueError: плохой файл' and 'traced_peak_mb' in record
+
+
+def test_null_metrics_only_calls_the_function(csv_path):
+    assert Metrics.resolve(None) is Metrics.NULL_METRICS
+    assert Metrics.NULL_METRICS.run('stage', lambda x, y: x + y, 1, y=2, rows_in=3) == 3
+    assert Metrics.NULL_METRICS.report() is None
+    assert RFM.main(csv_path, as_of_date='2025-01-01')['metrics'] is None
+
+
+def test_unknown_memory_mode():
+    with pytest.raises(ValueError):
+        Metrics.Metrics(memory='heap')
@@ -0,0 +1,44 @@
+# === Тесты сегментации: таблица SEGMENT_LOOKUP против исходных построчных правил ===
+import itertools
+
+import pandas as pd
+import pytest
+
+import RFM
+
+TRIPLES = list(itertools.product(range(1, 6), repeat=3))
+
+
+def baseline_assign_segment(row):
+    """Правила RFMAnalyzer.assign_segment до векторизации — независимый эталон, не из RFM.py."""
+    r, f, m = int(row['R_Score']), int(row['F_Score']), int(row['M_Score'])
+    rfm_sum = r + f + m
+    if rfm_sum == 15:
+        return 'VIP-клиенты'
+    elif rfm_sum >= 12:
+        return 'Лояльные клиенты'
+    elif r == 5 and (f + m) <= 7:
+        return 'Новые покупатели'
+    elif rfm_sum == 9:
+        return 'Рискующие клиенты'
+    elif rfm_sum == 3:
+        return 'Спящие клиенты'
+    elif r >= 4:
+        return 'Новые покупатели' if (f + m) <= 7 else 'Лояльные клиенты'
+    elif r <= 2:
+        return 'Спящие клиенты' if (f + m) <= 4 else 'Рискующие клиенты'
+    return 'Рискующие клиенты'
+
+
+@pytest.mark.parametrize('r,f,m', TRIPLES)
+def test_lookup_table_matches_baseline(r, f, m):
+    expected = baseline_assign_segment({'R_Score': r, 'F_Score': f, 'M_Score': m})
+    assert RFM.SEGMENTS[RFM.SEGMENT_LOOKUP[r - 1, f - 1, m - 1]] == expected
+
+
+def test_lookup_segments_matches_row_wise_apply():
+    rfm = pd.DataFrame(TRIPLES, columns=['R_Score', 'F_Score', 'M_Score']).astype(RFM.SCORE_DTYPE)
+    expected = rfm.apply(baseline_assign_segment, axis=1)
+    segments = RFM.RFMAnalyzer().lookup_segments(rfm)
+    assert list(segments) == list(expected)
+    assert len(set(segments)) == len(RFM.SEGMENTS)  # Все сегменты достижимы
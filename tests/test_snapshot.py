@@ -0,0 +1,70 @@
+# === Тесты инкрементального анализа по снимкам (RFMSnapshot) ===
+import numpy as np
+import pandas as pd
+import pytest
+
+import RFM
+import RFMSnapshot
+
+
+@pytest.fixture
+def transactions(tmp_path):
+    """База на 1000 клиентов и небольшая дельта: 30 старых клиентов и 5 новых."""
+    rng = np.random.default_rng(3)
+    n = 20000
+    base = pd.DataFrame({'customer': rng.integers(0, 1000, n).astype(str),
+                         'date': (pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 360, n), unit='D')),
+                         'amount': rng.gamma(2, 500, n).round(2)})
+    delta = pd.DataFrame({'customer': [str(c) for c in range(30)] + [f'new{c}' for c in range(5)],
+                          'date': pd.Timestamp('2024-12-30'), 'amount': 1000.0})
+    paths = {name: str(tmp_path / f'{name}.csv') for name in ('base', 'delta', 'full')}
+    for name, frame in (('base', base), ('delta', delta), ('full', pd.concat([base, delta]))):
+        frame.assign(date=frame['date'].dt.strftime('%Y-%m-%d')).to_csv(paths[name], index=False)
+    paths['snapshot'] = str(tmp_path / 'snapshot.pkl')
+    return paths
+
+
+def test_small_delta_rescores_only_changed_customers(transactions):
+    RFMSnapshot.main(transactions['base'], transactions['snapshot'], '2025-01-01')
+    before = RFMSnapshot.RFMSnapshot.load(transactions['snapshot'])
+    edges = {column: np.asarray(edges).copy() for column, edges in before.scorer.edges.items()}
+
+    result = RFMSnapshot.main(transactions['delta'], transactions['snapshot'], '2025-01-02')
+    assert 'переучены' not in result['errors']
+    after = RFMSnapshot.RFMSnapshot.load(transactions['snapshot'])
+    for column, column_edges in edges.items():
+        np.testing.assert_array_equal(after.scorer.edges[column], column_edges)  # Границы не переучивались
+
+    untouched = before.customers.index.difference([str(c) for c in range(30)])
+    scores = ['R_Score', 'F_Score', 'M_Score', 'Segment']
+    pd.testing.assert_frame_equal(after.customers.loc[untouched, scores], before.customers.loc[untouched, scores])
+    assert len(after.customers) == 1005
+    # Численность групп ведётся по дельтам и совпадает с полным пересчётом
+    for column, score, _ in RFM.SCORE_COLUMNS:
+        counts = np.bincount(after.customers[score].to_numpy().astype(np.intp) - 1, minlength=5)
+        np.testing.assert_array_equal(after.score_counts[column], counts)
+
+
+def test_delta_keeps_compact_dtypes(transactions):
+    RFMSnapshot.main(transactions['base'], transactions['snapshot'], '2025-01-01')
+    RFMSnapshot.main(transactions['delta'], transactions['snapshot'], '2025-01-02')
+    customers = RFMSnapshot.RFMSnapshot.load(transactions['snapshot']).customers
+    for _, score, _ in RFM.SCORE_COLUMNS:
+        assert customers[score].dtype == RFM.SCORE_DTYPE
+    assert isinstance(customers['Segment'].dtype, pd.CategoricalDtype)
+    assert customers.loc['new0', 'Segment'] in RFM.SEGMENTS
+
+
+def test_refit_matches_full_analysis(transactions):
+    RFMSnapshot.main(transactions['base'], transactions['snapshot'], '2025-01-01')
+    result = RFMSnapshot.main(transactions['delta'], transactions['snapshot'], '2025-01-02', refit=True)
+    expected = RFM.main(transactions['full'], as_of_date='2025-01-02')['summary']
+    pd.testing.assert_frame_equal(result['summary'], expected)
+
+
+def test_drift_triggers_refit(transactions, monkeypatch):
+    RFMSnapshot.main(transactions['base'], transactions['snapshot'], '2025-01-01')
+    monkeypatch.setattr(RFMSnapshot, 'SNAPSHOT_DRIFT_TOLERANCE', 0.0)
+    result = RFMSnapshot.main(transactions['delta'], transactions['snapshot'], '2025-01-02')
+    assert 'группы разъехались' in result['errors']
+    assert RFMSnapshot.RFMSnapshot.load(transactions['snapshot']).drift() == 0.0
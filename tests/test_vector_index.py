@@ -0,0 +1,99 @@
+# === Тесты поиска в памяти (VectorIndex) против перебора и записанных ответов pgvector ===
+import numpy as np
+import pytest
+
+from VectorIndex import NumpyVectorIndex, compare_backends, parity_query, vector_literals
+
+SEGMENTS = ['VIP-клиенты', 'Лояльные клиенты', 'Спящие клиенты']
+
+
+@pytest.fixture
+def catalogue():
+    """24 рекомендации (2 языка × 3 сегмента × 4) и ненормированные векторы размерности 16."""
+    rng = np.random.default_rng(5)
+    rows = [(segment, lang, f'{lang} {segment} {i}') for lang in ('ru', 'en') for segment in SEGMENTS for i in range(4)]
+    raw = rng.normal(size=(len(rows), 16)).astype(np.float32) * rng.uniform(0.5, 3, size=(len(rows), 1))
+    return rows, raw
+
+
+@pytest.fixture
+def index(catalogue):
+    rows, raw = catalogue
+    return NumpyVectorIndex(rows, NumpyVectorIndex.normalize(raw))
+
+
+def brute_force_l2(index, query, lang, segment, limit):
+    """Порядок ORDER BY embedding <-> query LIMIT limit: L2 до ненормированного запроса перебором."""
+    stored = np.asarray(index.embeddings, dtype=np.float64)
+    candidates = [i for i, row in enumerate(index.rows) if row[1] == lang and (segment is None or row[0] == segment)]
+    distances = {i: np.linalg.norm(stored[i] - query) for i in candidates}
+    return sorted(candidates, key=distances.get)[:limit]
+
+
+def test_rows_are_normalized(index):
+    np.testing.assert_allclose(np.linalg.norm(index.embeddings, axis=1), 1, rtol=1e-6)
+    assert index.embeddings.dtype == np.float32 and index.embeddings.flags['C_CONTIGUOUS']
+
+
+@pytest.mark.parametrize('lang,segment', [('ru', None), ('en', None), ('ru', 'VIP-клиенты'), ('en', 'Спящие клиенты')])
+@pytest.mark.parametrize('limit', [1, 3, 4, 50])
+def test_top_k_matches_brute_force(index, lang, segment, limit):
+    rng = np.random.default_rng(limit)
+    for _ in range(20):
+        query = rng.normal(size=16) * 4  # Запрос не нормирован — как model.encode
+        expected = brute_force_l2(index, query, lang, segment, limit)
+        assert index.top_k(query, lang, segment, limit).tolist() == expected
+
+
+def test_masks_filter_language_and_segment(index):
+    query = np.ones(16)
+    found = [index.rows[i] for i in index.top_k(query, 'en', 'Лояльные клиенты', 10)]
+    assert len(found) == 4 and all(row[:2] == ('Лояльные клиенты', 'en') for row in found)
+    assert len(index.top_k(query, 'ru', None, 100)) == 12  # limit больше кандидатов — все, по порядку
+    assert len(index.top_k(query, 'de', None, 3)) == 0
+    assert len(index.top_k(query, 'ru', 'Нет такого', 3)) == 0
+    assert len(index.top_k(query, 'ru', None, 0)) == 0
+
+
+def test_search_returns_sql_shaped_rows(index):
+    [(segment, text, literal)] = index.search(np.ones(16), 'ru', 'VIP-клиенты', limit=1)
+    assert segment == 'VIP-клиенты' and text.startswith('ru VIP-клиенты')
+    position = next(i for i, row in enumerate(index.rows) if row[2] == text)
+    assert literal == vector_literals(index.embeddings[[position]])[0]
+
+
+def test_save_load_memmap(index, tmp_path):
+    path = str(tmp_path / 'index.npy')
+    index.save(path, catalogue_hash='abc', model_version='m#2')
+    loaded, meta = NumpyVectorIndex.load(path, mmap=True)
+    assert isinstance(loaded.embeddings, np.memmap)
+    assert meta == {'catalogue_hash': 'abc', 'model_version': 'm#2'}
+    query = np.arange(16, dtype=np.float64)
+    assert loaded.search(query, 'en', None, 5) == index.search(query, 'en', None, 5)
+
+
+def recorded_sql(index, override=None):
+    """Подмена search_recommendations: «ответы базы» записаны перебором L2, override портит один ответ."""
+    def sql_search(query_embedding, lang, segment, limit):
+        if override and (lang, segment) == override:
+            positions = brute_force_l2(index, query_embedding, lang, segment, limit + 1)[1:]
+        else:
+            positions = brute_force_l2(index, query_embedding, lang, segment, limit)
+        return [(index.rows[i][0], index.rows[i][2], None) for i in positions]
+    return sql_search
+
+
+def embed(query):
+    return np.random.default_rng(abs(hash(query)) % 2 ** 32).normal(size=16)
+
+
+def test_parity_with_recorded_sql(index):
+    report = compare_backends(index, embed, recorded_sql(index), limit=3)
+    assert report['checked'] == len(index.masks) == 8
+    assert report['mismatches'] == []
+
+
+def test_parity_reports_mismatch(index):
+    report = compare_backends(index, embed, recorded_sql(index, override=('en', 'VIP-клиенты')), limit=3)
+    assert [(item['lang'], item['segment']) for item in report['mismatches']] == [('en', 'VIP-клиенты')]
+    assert parity_query('en', 'VIP-клиенты') == 'Recommendations for vip-клиенты in a mass-market retail'